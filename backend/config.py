@@ -13,6 +13,32 @@ DATA_DIR.mkdir(exist_ok=True)
 RANK_FILE = DATA_DIR / "block_scores.tsv"
 ACTION_LOG_FILE = DATA_DIR / "decision_log.csv"
 YOUR_NAME_FILE = DATA_DIR / "your_name.csv"
+PARAMETER_ZONES_FILE = DATA_DIR / "parameter_zones.csv"
+SURROGATE_FILE = DATA_DIR / "surrogate.npz"
+LOOKUP_TABLE_FILE = DATA_DIR / "score_table.npy"
+# 期間スコア・意思決定ログの索引付きの保存先（block_scores.tsv はここからの書き出し）
+STORE_FILE = DATA_DIR / "store.sqlite3"
+# 操作ログと、ユーザー・イベント種別ごとの行の位置の索引
+USER_LOG_FILE = DATA_DIR / "user_log.jsonl"
+USER_LOG_INDEX_FILE = DATA_DIR / "user_log.index.sqlite3"
+
+# モンテカルロモード用ワーカープールのプロセス数（0 の場合はリクエスト処理スレッド内で計算）
+MC_POOL_SIZE = int(os.getenv("MC_POOL_SIZE", min(2, os.cpu_count() or 1)))
+# 事前生成した気候外力を (RCP, seed, N) ごとに保持する件数
+FORCING_CACHE_SIZE = int(os.getenv("FORCING_CACHE_SIZE", 16))
+# 行を返さず集計だけを返す場合（ストリーミング集計）に、1つのタスクで計算するシミュレーション数
+MC_STREAM_CHUNK_SIZE = int(os.getenv("MC_STREAM_CHUNK_SIZE", 500))
+# /sensitivity の1リクエストで計算するシミュレーション数（点数 × replicates）の上限
+SENSITIVITY_MAX_RUNS = int(os.getenv("SENSITIVITY_MAX_RUNS", 500000))
+# /optimize・/pareto の1リクエストで計算するシミュレーション数（世代数 × 集団の大きさ × replicates の上限）の上限
+OPTIMIZER_MAX_RUNS = int(os.getenv("OPTIMIZER_MAX_RUNS", 500000))
+# /pareto で評価した候補の指標を保持する件数（同じ条件のリクエストでは再計算しない）
+PARETO_CACHE_SIZE = int(os.getenv("PARETO_CACHE_SIZE", 200000))
+# decision_log.csv の fsync の方針（always / interval / never）と、interval のときの間隔（秒）
+ACTION_LOG_FSYNC = os.getenv("ACTION_LOG_FSYNC", "interval")
+ACTION_LOG_FSYNC_SECONDS = int(os.getenv("ACTION_LOG_FSYNC_SECONDS", 5))
+# 予測モードの代理モデルが DEFAULT_PARAMS と一致しない（またはない）場合に、起動時にバックグラウンドで学習し直すか
+SURROGATE_AUTO_TRAIN = os.getenv("SURROGATE_AUTO_TRAIN", "true").lower() == "true"
 
 start_year = 2026
 end_year = 2100
@@ -153,6 +179,10 @@ rcp_climate_params = {
 }
 
 __all__ = [
-    "DATA_DIR", "RANK_FILE", "ACTION_LOG_FILE", "YOUR_NAME_FILE",
+    "DATA_DIR", "RANK_FILE", "ACTION_LOG_FILE", "YOUR_NAME_FILE", "PARAMETER_ZONES_FILE", "MC_POOL_SIZE", "FORCING_CACHE_SIZE",
+    "MC_STREAM_CHUNK_SIZE", "SENSITIVITY_MAX_RUNS", "OPTIMIZER_MAX_RUNS",
+    "PARETO_CACHE_SIZE", "SURROGATE_FILE", "SURROGATE_AUTO_TRAIN",
+    "LOOKUP_TABLE_FILE", "STORE_FILE", "USER_LOG_FILE", "USER_LOG_INDEX_FILE",
+    "ACTION_LOG_FSYNC", "ACTION_LOG_FSYNC_SECONDS",
     "DEFAULT_PARAMS", "rcp_climate_params"
 ]
\ No newline at end of file
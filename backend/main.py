@@ -2,23 +2,50 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent / "src"))
 
-from fastapi import FastAPI, HTTPException, WebSocket, Depends
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from pydantic import ValidationError
 import pandas as pd
 import numpy as np
 import json
 import zipfile
+import asyncio
+import threading
+import time
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Optional
 
-from config import DEFAULT_PARAMS, rcp_climate_params, RANK_FILE, ACTION_LOG_FILE, YOUR_NAME_FILE
+from config import (
+    DEFAULT_PARAMS, rcp_climate_params, RANK_FILE, ACTION_LOG_FILE, YOUR_NAME_FILE,
+    MC_POOL_SIZE, FORCING_CACHE_SIZE, MC_STREAM_CHUNK_SIZE, SENSITIVITY_MAX_RUNS, OPTIMIZER_MAX_RUNS,
+    PARAMETER_ZONES_FILE, PARETO_CACHE_SIZE, SURROGATE_FILE, SURROGATE_AUTO_TRAIN,
+    LOOKUP_TABLE_FILE, ACTION_LOG_FSYNC, ACTION_LOG_FSYNC_SECONDS, STORE_FILE, USER_LOG_FILE, USER_LOG_INDEX_FILE
+)
 from models import (
     SimulationRequest, SimulationResponse, CompareRequest, CompareResponse,
-    DecisionVar, CurrentValues, BlockRaw
+    DecisionVar, CurrentValues, BlockRaw, PoolResizeRequest, SensitivityRequest, OptimizeRequest, ParetoRequest,
+    LookupRequest
 )
 from simulation import simulate_simulation
+from store import ScoreStore
+from encoding import FRAMES_MEDIA_TYPE, RESPONSE_FORMATS, encode_columns, encode_frames
+from adaptive import run_adaptive
+from append_log import AppendOnlyCsv
+from decisions import DECISION_KEYS
+from ensemble import new_seed
+from forcing import LOG_WEIGHT_KEY, ForcingCache
+from leaderboard import Leaderboard
+from lookup import ScoreTable, table_fingerprint
+from optimizer import load_lever_levels, optimize_policy, period_starts
+from pareto import ScoreCache, pareto_search
+from sampling import SAMPLING_METHODS
+from sensitivity import SENSITIVITY_METHODS, num_points, run_sensitivity, validate_factors
+from surrogate import SurrogateStore, surrogate_fingerprint
+from summary import SUMMARY_COLUMNS, MetricTracker, StreamingSummary, summarize_ensemble, summarize_weighted
+from worker_pool import EnsemblePool
+from user_log import UserLog, parse_time
 from utils import calculate_scenario_indicators, aggregate_blocks
 
 def _save_results_data(user_name: str, scenario_name: str, block_scores: list):
@@ -33,26 +60,10 @@ def _save_results_data(user_name: str, scenario_name: str, block_scores: list):
     user_name_file = data_dir / "your_name.csv"
     pd.DataFrame([{"user_name": user_name}]).to_csv(user_name_file, index=False)
 
-    # 保存评分数据
+    # 保存评分数据（删除同一用户的旧数据后写入）
     if block_scores:
-        df_scores = pd.DataFrame(block_scores)
-        df_scores['user_name'] = user_name
-        df_scores['scenario_name'] = scenario_name
-        df_scores['timestamp'] = pd.Timestamp.utcnow()
-
-        # 保存到block_scores.tsv
-        block_scores_file = data_dir / "block_scores.tsv"
-        if block_scores_file.exists():
-            # 读取现有数据
-            existing_df = pd.read_csv(block_scores_file, sep='\t')
-            # 删除同一用户的旧数据
-            existing_df = existing_df[existing_df['user_name'] != user_name]
-            # 合并新数据
-            combined_df = pd.concat([existing_df, df_scores], ignore_index=True)
-        else:
-            combined_df = df_scores
-
-        combined_df.to_csv(block_scores_file, sep='\t', index=False)
+        version = score_store.replace_user_scores(user_name, scenario_name, block_scores, pd.Timestamp.utcnow())
+        _update_leaderboard(user_name, version)
 
 app = FastAPI()
 app.add_middleware(
@@ -71,6 +82,79 @@ app.add_middleware(
 
 scenarios_data: Dict[str, pd.DataFrame] = {}
 
+# モンテカルロモード用の常駐ワーカープール（アプリ起動時に立ち上げ、全リクエストで共有）
+ensemble_pool = EnsemblePool(MC_POOL_SIZE)
+# 意思決定変数に依存しない気候外力は (RCP, seed, N) ごとに使い回す（政策比較では共通乱数になる）
+forcing_cache = ForcingCache(FORCING_CACHE_SIZE)
+# /pareto で評価した候補の指標（同じ条件なら世代数や目的を変えたリクエストでも使い回す）
+score_cache = ScoreCache(PARETO_CACHE_SIZE)
+# 予測モードの代理モデル（DEFAULT_PARAMS・RCP のパラメータが変わったら作り直す）
+surrogate_store = SurrogateStore(SURROGATE_FILE)
+surrogate_version = surrogate_fingerprint(DEFAULT_PARAMS, rcp_climate_params)
+# decision_log.csv は追記専用（1本の書き込みスレッドがまとめて追記し、ヘッダーは一度だけ書く）
+ACTION_LOG_COLUMNS = list(DecisionVar.model_fields) + ['user_name', 'scenario_name', 'timestamp']
+decision_log = AppendOnlyCsv(ACTION_LOG_FILE, ACTION_LOG_COLUMNS, fsync=ACTION_LOG_FSYNC,
+                             fsync_seconds=ACTION_LOG_FSYNC_SECONDS)
+# 期間スコアと意思決定ログの索引付きの保存先（SQLite。初回起動時に既存の TSV / CSV を取り込む）
+score_store = ScoreStore(STORE_FILE, ACTION_LOG_COLUMNS)
+# 操作ログ（書き込みはすべてここを通し、ユーザー・イベント種別ごとの行の位置の索引を同時に更新する）
+user_log = UserLog(USER_LOG_FILE, USER_LOG_INDEX_FILE)
+# /ranking のメモリ上の順位表（書き込みのたびにそのユーザーだけ更新し、保存先の版が合わなければ作り直す）
+leaderboard = Leaderboard()
+# 事前計算したレバーの格子のスコア表（precompute_lookup.py で作る。更新されたら次の問い合わせで開き直す）
+score_table = ScoreTable(LOOKUP_TABLE_FILE)
+
+def _sync_data_files():
+    # ファイルを直接読む（プレビュー・ダウンロード）前に、未書き込みのログと SQLite の期間スコアをファイルに反映する
+    decision_log.flush()
+    score_store.export_block_scores(RANK_FILE)
+
+def _current_leaderboard():
+    version = score_store.scores_version()
+    if not leaderboard.is_current(version):
+        # 作り直している間に書き込みがあれば版が合わず、次の読み込みでまた作り直す
+        leaderboard.rebuild(score_store.ranking(), version)
+    return leaderboard
+
+def _update_leaderboard(user_name, version):
+    leaderboard.update(user_name, score_store.user_score(user_name), version)
+
+def _log_query(since, until, offset, limit):
+    # 操作ログの絞り込み・ページ分割の指定を検査して (since, until) の UNIX 秒を返す
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="offset must be >= 0")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be >= 1")
+    times = []
+    for name, value in (("since", since), ("until", until)):
+        parsed = parse_time(value) if value is not None else None
+        if value is not None and parsed is None:
+            raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 timestamp")
+        times.append(parsed)
+    return times
+
+def _retrain_surrogate():
+    return surrogate_store.retrain_async(ensemble_pool, DEFAULT_PARAMS, rcp_climate_params,
+                                         load_lever_levels(PARAMETER_ZONES_FILE), surrogate_version)
+
+@app.on_event("startup")
+def start_ensemble_pool():
+    ensemble_pool.start()
+    print(f"🚀 [Worker Pool] 进程池已启动: {ensemble_pool.status()['size']} 个工作进程")
+    imported = score_store.import_files(RANK_FILE, ACTION_LOG_FILE)
+    if imported is not None:
+        print(f"📥 [Store] 已导入现有数据: {imported}")
+    if surrogate_store.load(surrogate_version):
+        print(f"🧠 [Surrogate] 已加载代理模型: {SURROGATE_FILE}")
+    elif SURROGATE_AUTO_TRAIN:
+        print("🧠 [Surrogate] 代理模型不存在或参数已变更，开始后台训练")
+        _retrain_surrogate()
+
+@app.on_event("shutdown")
+def stop_ensemble_pool():
+    ensemble_pool.shutdown()
+    decision_log.close()
+
 # 管理员认证
 security = HTTPBasic()
 
@@ -91,10 +175,8 @@ def authenticate_admin(credentials: HTTPBasicCredentials = Depends(security)):
 def ping():
     return {"message": "pong"}
 
-@app.post("/simulate", response_model=SimulationResponse)
-def run_simulation(req: SimulationRequest):
-    scenario_name = req.scenario_name
-    mode = req.mode
+def _prepare_simulation(req: SimulationRequest):
+    """リクエストから意思決定変数の DataFrame と、RCP シナリオを反映したパラメータを作る"""
     decision_df = pd.DataFrame([dv.model_dump() for dv in req.decision_vars]) if req.decision_vars else pd.DataFrame()
 
     # Update params based on RCP scenario and current values
@@ -102,45 +184,126 @@ def run_simulation(req: SimulationRequest):
     if req.decision_vars and len(req.decision_vars) > 0:
         rcp_param = rcp_climate_params.get(req.decision_vars[0].cp_climate_params, {})
         params.update(rcp_param)
+    return decision_df, params
+
+def _validate_importance_sampling(req):
+    """重点サンプリングの設定を検証する（重み付き集計は全行を計算する経路だけで行うので adaptive とは併用しない）"""
+    importance = req.importance_sampling
+    if req.adaptive:
+        raise HTTPException(status_code=400, detail="importance_sampling cannot be combined with adaptive")
+    if not 0 < importance.mix <= 1:
+        raise HTTPException(status_code=400, detail="importance_sampling.mix must be in (0, 1]")
+    if importance.freq_scale <= 0 or importance.min_freq < 0:
+        raise HTTPException(status_code=400, detail="importance_sampling.freq_scale must be positive and min_freq non-negative")
+    if any(period <= 1 for period in importance.return_periods):
+        raise HTTPException(status_code=400, detail="importance_sampling.return_periods must be greater than 1")
+    unknown = [col for col in importance.thresholds if col not in SUMMARY_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown threshold columns: {unknown}")
+
+@app.post("/simulate", response_model=SimulationResponse)
+def run_simulation(req: SimulationRequest, accept: Optional[str] = Header(None)):
+    scenario_name = req.scenario_name
+    mode = req.mode
+    # レスポンス形式：リクエストの response_format、なければ Accept ヘッダで決める（既定は records）
+    response_format = req.response_format or ("frames" if accept and FRAMES_MEDIA_TYPE in accept else "records")
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown response_format: {response_format}")
+    decision_df, params = _prepare_simulation(req)
 
     all_df = pd.DataFrame()
     block_scores = []
+    ensemble = None
+    summary = None
+    convergence = None
+    sampling = None
+    seed = req.seed
+    # seed 指定時は逐次・予測モードも同じ乱数系列で再現できるようにする
+    rng = np.random.default_rng(seed) if seed is not None else None
 
     if mode == "Monte Carlo Simulation Mode":
-        # 并行化蒙特卡洛仿真以充分利用多核CPU
-        from concurrent.futures import ProcessPoolExecutor
-        import multiprocessing
-
-        def single_simulation(sim_index):
-            """单次仿真函数，用于并行执行"""
-            sim_result = simulate_simulation(
+        # 常駐ワーカープールで、アンサンブルを連続した塊ごとにバッチ版エンジンで計算する
+        # （各ワーカーは共有メモリ上の出力配列に直接書き込む）
+        if req.summary and any(not 0 <= q <= 1 for q in req.quantiles):
+            raise HTTPException(status_code=400, detail="quantiles must be between 0 and 1")
+        if req.adaptive and not req.rel_tolerance > 0:
+            raise HTTPException(status_code=400, detail="rel_tolerance must be positive")
+        if req.sampling not in SAMPLING_METHODS:
+            raise HTTPException(status_code=400, detail=f"Unknown sampling: {req.sampling}")
+        importance = req.importance_sampling
+        tilt = None
+        if importance is not None:
+            _validate_importance_sampling(req)
+            tilt = (importance.freq_scale, importance.min_freq, importance.loc_shift, importance.mix)
+        print(f"🚀 [Monte Carlo] 使用常驻进程池计算 {req.num_simulations} 次仿真")
+        if seed is None:
+            seed = new_seed()
+        num_simulations = req.num_simulations
+        if req.adaptive:
+            # 収束するまで塊ごとに増やす（summary は常に返す）。行も返す場合は、使った本数で下の通常経路を
+            # 実行し直す（シミュレーション i の結果は (seed, i) だけで決まるので同じアンサンブルになる）
+            streaming, convergence = run_adaptive(
+                ensemble_pool,
                 years=params['years'],
                 initial_values=req.current_year_index_seq.model_dump(),
                 decision_vars_list=decision_df,
-                params=params
+                params=params,
+                seed=seed,
+                quantiles=req.quantiles,
+                max_simulations=req.num_simulations,
+                rel_tolerance=req.rel_tolerance,
+                max_seconds=req.max_seconds,
+                sampling=req.sampling
             )
-            df_sim = pd.DataFrame(sim_result)
-            df_sim["Simulation"] = sim_index
-            return df_sim
-
-        # 限制并行度以避免资源过载（Railway环境优化）
-        max_workers = min(2, multiprocessing.cpu_count(), req.num_simulations)
-        print(f"🚀 [Monte Carlo] 使用 {max_workers} 个CPU核心并行计算 {req.num_simulations} 次仿真")
-
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有仿真任务
-            futures = [executor.submit(single_simulation, sim) for sim in range(req.num_simulations)]
-            # 收集结果
-            results = [future.result() for future in futures]
-
-        all_df = pd.concat(results, ignore_index=True)
-        block_scores = []
-        print(f"✅ [Monte Carlo] 并行计算完成，共处理 {len(all_df)} 行数据")
-
-        # 清理内存以避免资源过载
-        import gc
-        del results
-        gc.collect()
+            num_simulations = convergence['num_simulations']
+            summary = streaming.result()
+            sampling = streaming.metrics.sampling_report()
+            print(f"✅ [Monte Carlo] 自适应仿真结束（{convergence['stop_reason']}），共 {num_simulations} 次仿真")
+        elif req.summary and not req.include_rows and importance is None:
+            # 行を返さない場合は、塊ごとの部分集計だけを合併する（メモリはアンサンブルの大きさによらない）
+            streaming = ensemble_pool.run_summary(
+                years=params['years'],
+                initial_values=req.current_year_index_seq.model_dump(),
+                decision_vars_list=decision_df,
+                params=params,
+                num_simulations=req.num_simulations,
+                seed=seed,
+                quantiles=req.quantiles,
+                chunk_size=MC_STREAM_CHUNK_SIZE,
+                sampling=req.sampling
+            )
+            summary = streaming.result()
+            sampling = streaming.metrics.sampling_report()
+            print(f"✅ [Monte Carlo] 流式聚合完成，共 {summary['num_simulations']} 次仿真")
+        if req.include_rows or importance is not None or not (req.summary or req.adaptive):
+            rcp = req.decision_vars[0].cp_climate_params if req.decision_vars else None
+            forcing = forcing_cache.get(rcp, seed, num_simulations, params['years'], params, req.sampling, tilt)
+            ensemble = ensemble_pool.run(
+                years=params['years'],
+                initial_values=req.current_year_index_seq.model_dump(),
+                decision_vars_list=decision_df,
+                params=params,
+                num_simulations=num_simulations,
+                seed=seed,
+                forcing=forcing,
+                include_planting_history=req.include_planting_history,
+                sampling=req.sampling
+            )
+            all_df = ensemble.to_frame()
+            block_scores = []
+            if importance is not None:
+                # 重点サンプリングでは提案分布から引いているので、集計は尤度比で重み付けする（行にも重みを付ける）
+                log_weight = forcing[LOG_WEIGHT_KEY]
+                summary = summarize_weighted(ensemble.array, log_weight, req.quantiles, importance.thresholds,
+                                             importance.return_periods)
+                all_df['Importance Weight'] = np.exp(log_weight).ravel()
+            elif req.summary and not req.adaptive:
+                summary = summarize_ensemble(ensemble.array, req.quantiles)
+            if sampling is None and importance is None:
+                tracker = MetricTracker(req.sampling)
+                tracker.update(ensemble.array)
+                sampling = tracker.sampling_report()
+            print(f"✅ [Monte Carlo] 批量计算完成，共处理 {len(all_df)} 行数据")
 
     elif mode == "Sequential Decision-Making Mode":
         sim_years = np.arange(req.decision_vars[0].year, req.decision_vars[0].year + 1)
@@ -148,39 +311,26 @@ def run_simulation(req: SimulationRequest):
             years=sim_years,
             initial_values=req.current_year_index_seq.model_dump(),
             decision_vars_list=decision_df,
-            params=params
+            params=params,
+            rng=rng,
+            include_planting_history=req.include_planting_history
         )
         all_df = pd.DataFrame(result)
         block_scores = aggregate_blocks(all_df)
 
-        # ログ保存
-        df_log = pd.DataFrame([dv.model_dump() for dv in req.decision_vars])
-        df_log['user_name'] = req.user_name
-        df_log['scenario_name'] = scenario_name
-        df_log['timestamp'] = pd.Timestamp.utcnow()
-        if ACTION_LOG_FILE.exists():
-            df_old = pd.read_csv(ACTION_LOG_FILE)
-            df_combined = pd.concat([df_old, df_log], ignore_index=True)
-        else:
-            df_combined = df_log
-        df_combined.to_csv(ACTION_LOG_FILE, index=False)
+        # ログ保存（追記はバックグラウンドの書き込みスレッドが行う）
+        timestamp = pd.Timestamp.utcnow()
+        records = [{**dv.model_dump(), 'user_name': req.user_name, 'scenario_name': scenario_name,
+                    'timestamp': timestamp} for dv in req.decision_vars]
+        for record in records:
+            decision_log.append(record)
+        score_store.add_decisions(records)
 
-        df_csv = pd.DataFrame(block_scores)
-        df_csv['user_name'] = req.user_name
-        df_csv['scenario_name'] = scenario_name
-        df_csv['timestamp'] = pd.Timestamp.utcnow()
         # 保存用户名文件
         pd.DataFrame([{"user_name": req.user_name}]).to_csv(YOUR_NAME_FILE, index=False)
-        if RANK_FILE.exists():
-            old = pd.read_csv(RANK_FILE, sep='\t')
-            merged = (
-                old.set_index(['user_name', 'scenario_name', 'period'])
-                .combine_first(df_csv.set_index(['user_name', 'scenario_name', 'period']))
-                .reset_index()
-            )
-            merged.to_csv(RANK_FILE, sep='\t', index=False)
-        else:
-            df_csv.to_csv(RANK_FILE, sep='\t', index=False)
+        # 既にある (ユーザー, シナリオ, 期間) の値は残す（以前の combine_first と同じ）
+        version = score_store.add_block_scores(req.user_name, scenario_name, block_scores, pd.Timestamp.utcnow())
+        _update_leaderboard(req.user_name, version)
 
     
     elif mode == "Predict Simulation Mode":
@@ -191,7 +341,9 @@ def run_simulation(req: SimulationRequest):
             years=sim_years,
             initial_values=req.current_year_index_seq.model_dump(),
             decision_vars_list=decision_df,
-            params=params
+            params=params,
+            rng=rng,
+            include_planting_history=req.include_planting_history
         )
 
         all_df = pd.DataFrame(seq_result)
@@ -232,30 +384,209 @@ def run_simulation(req: SimulationRequest):
     else:
         raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}")
 
-    if mode != "Predict Simulation Mode":
-        scenarios_data[scenario_name] = all_df.copy()
-
-    return SimulationResponse(
-        scenario_name=scenario_name,
-        data=all_df.to_dict(orient="records"),
-        block_scores=block_scores
-    )
+    try:
+        if mode != "Predict Simulation Mode":
+            scenarios_data[scenario_name] = all_df.copy()
+
+        if response_format != "records":
+            # 列指向・バイナリ形式は行ごとの Pydantic 検証を通さずにそのまま返す
+            meta = {
+                "scenario_name": scenario_name,
+                "block_scores": [BlockRaw(**score).model_dump() for score in block_scores],
+                "seed": seed,
+                "summary": summary,
+                "convergence": convergence,
+                "sampling": sampling,
+            }
+            rows = all_df if req.include_rows else all_df.iloc[0:0]
+            if response_format == "columns":
+                return Response(content=encode_columns(rows, meta), media_type="application/json")
+            return Response(content=encode_frames(rows, meta), media_type=FRAMES_MEDIA_TYPE)
+
+        return SimulationResponse(
+            scenario_name=scenario_name,
+            data=all_df.to_dict(orient="records") if req.include_rows else [],
+            block_scores=block_scores,
+            seed=seed,
+            summary=summary,
+            convergence=convergence,
+            sampling=sampling
+        )
+    finally:
+        if ensemble is not None:
+            # 共有メモリを参照している DataFrame を先に手放してから解放する
+            del all_df
+            ensemble.close()
+
+@app.post("/sensitivity")
+def run_sensitivity_analysis(req: SensitivityRequest):
+    """パラメータ・意思決定変数の大域的感度分析（Sobol 指数 / Morris の要素効果）"""
+    if req.method not in SENSITIVITY_METHODS:
+        raise HTTPException(status_code=400, detail=f"Unknown method: {req.method}")
+    if req.num_samples < 2 or req.replicates < 1 or req.num_bootstrap < 0:
+        raise HTTPException(status_code=400, detail="num_samples must be >= 2, replicates >= 1 and num_bootstrap >= 0")
+    if not 0 < req.confidence < 1:
+        raise HTTPException(status_code=400, detail="confidence must be between 0 and 1")
+    if req.method == "morris" and (req.num_levels < 2 or req.num_levels % 2):
+        raise HTTPException(status_code=400, detail="num_levels must be an even number >= 2")
+    num_runs = num_points(req.method, len(req.factors), req.num_samples) * req.replicates
+    if num_runs > SENSITIVITY_MAX_RUNS:
+        raise HTTPException(status_code=400, detail=f"Too many runs: {num_runs} > {SENSITIVITY_MAX_RUNS}")
+    decision_df, params = _prepare_simulation(req)
+    factors = [(factor.name, factor.low, factor.high) for factor in req.factors]
+    try:
+        validate_factors(factors, params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    seed = req.seed if req.seed is not None else new_seed()
+    print(f"🔬 [Sensitivity] {req.method} 分析 {len(req.factors)} 个因子，共 {num_runs} 次仿真")
+    try:
+        result = run_sensitivity(
+            ensemble_pool,
+            years=params['years'],
+            initial_values=req.current_year_index_seq.model_dump(),
+            decision_vars_list=decision_df,
+            params=params,
+            factors=factors,
+            method=req.method,
+            num_samples=req.num_samples,
+            num_levels=req.num_levels,
+            replicates=req.replicates,
+            seed=seed,
+            num_bootstrap=req.num_bootstrap,
+            confidence=req.confidence,
+            metrics=req.metrics
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"✅ [Sensitivity] 完成，耗时 {result['elapsed']:.2f} 秒")
+    return result
+
+@app.post("/optimize")
+def run_policy_optimization(req: OptimizeRequest):
+    """期待 total_score を最大にする期間ごとの意思決定（差分進化）。ファシリテーター用の比較基準の戦略"""
+    if req.replicates < 1 or req.popsize < 1 or req.max_generations < 1 or req.num_simulations < 2:
+        raise HTTPException(status_code=400, detail="replicates, popsize and max_generations must be >= 1 and num_simulations >= 2")
+    if any(not 0 <= q <= 1 for q in req.quantiles):
+        raise HTTPException(status_code=400, detail="quantiles must be between 0 and 1")
+    decision_df, params = _prepare_simulation(req)
+    num_levers = len(req.levers) if req.levers is not None else len(DECISION_KEYS)
+    dims = len(period_starts(params['years'])) * num_levers
+    num_runs = (req.max_generations + 1) * req.popsize * dims * req.replicates
+    if num_runs > OPTIMIZER_MAX_RUNS:
+        raise HTTPException(status_code=400, detail=f"Too many runs: {num_runs} > {OPTIMIZER_MAX_RUNS}")
+    seed = req.seed if req.seed is not None else new_seed()
+    rcp = req.decision_vars[0].cp_climate_params if req.decision_vars else None
+    print(f"🧭 [Optimizer] 差分进化搜索 {dims} 个变量，最多 {num_runs} 次仿真")
+    try:
+        result = optimize_policy(
+            ensemble_pool,
+            years=params['years'],
+            initial_values=req.current_year_index_seq.model_dump(),
+            decision_vars_list=decision_df,
+            params=params,
+            lever_levels=load_lever_levels(PARAMETER_ZONES_FILE),
+            levers=req.levers,
+            rcp=rcp,
+            discrete=req.discrete,
+            replicates=req.replicates,
+            popsize=req.popsize,
+            max_generations=req.max_generations,
+            max_seconds=req.max_seconds,
+            seed=seed,
+            num_simulations=req.num_simulations,
+            quantiles=req.quantiles
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"✅ [Optimizer] 完成，期待得分 {result['expected_score']:.2f}，耗时 {result['elapsed']:.2f} 秒")
+    return result
+
+@app.post("/pareto")
+def run_pareto_search(req: ParetoRequest):
+    """BENCHMARK の指標を目的とした非劣解の戦略の集合（NSGA-II）"""
+    if req.replicates < 1 or req.population < 4 or req.generations < 0:
+        raise HTTPException(status_code=400, detail="replicates must be >= 1, population >= 4 and generations >= 0")
+    decision_df, params = _prepare_simulation(req)
+    num_runs = (req.generations + 1) * req.population * req.replicates
+    if num_runs > OPTIMIZER_MAX_RUNS:
+        raise HTTPException(status_code=400, detail=f"Too many runs: {num_runs} > {OPTIMIZER_MAX_RUNS}")
+    seed = req.seed if req.seed is not None else new_seed()
+    rcp = req.decision_vars[0].cp_climate_params if req.decision_vars else None
+    print(f"🧭 [Pareto] NSGA-II 搜索，种群 {req.population}，最多 {req.generations} 代")
+    try:
+        result = pareto_search(
+            ensemble_pool,
+            years=params['years'],
+            initial_values=req.current_year_index_seq.model_dump(),
+            decision_vars_list=decision_df,
+            params=params,
+            lever_levels=load_lever_levels(PARAMETER_ZONES_FILE),
+            levers=req.levers,
+            objectives=req.objectives,
+            rcp=rcp,
+            discrete=req.discrete,
+            replicates=req.replicates,
+            population=req.population,
+            generations=req.generations,
+            max_seconds=req.max_seconds,
+            seed=seed,
+            cache=score_cache
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"✅ [Pareto] 完成，非劣解 {len(result['front'])} 个，新评估 {result['evaluations']} 个，耗时 {result['elapsed']:.2f} 秒")
+    return result
+
+@app.post("/predict/surrogate")
+def predict_surrogate(req: SimulationRequest):
+    """予測モードの即時版。代理モデルで、意思決定の年以降の軌跡と期間スコアの期待値・帯を返す"""
+    if not surrogate_store.ready(surrogate_version):
+        raise HTTPException(status_code=503, detail="代理モデルを学習中です", headers={"Retry-After": "60"})
+    if not req.decision_vars:
+        raise HTTPException(status_code=400, detail="decision_vars is required")
+    decision = req.decision_vars[0]
+    _, params = _prepare_simulation(req)
+    try:
+        return surrogate_store.predict(decision.cp_climate_params, decision.year, req.current_year_index_seq.model_dump(),
+                                       decision.model_dump(), params)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"No surrogate model for RCP {decision.cp_climate_params} / year {decision.year}")
+
+@app.get("/predict/surrogate/report")
+def get_surrogate_report():
+    """代理モデルの状態と、学習に使っていないデータでの精度"""
+    return {**surrogate_store.status(), "accuracy": surrogate_store.report()}
+
+@app.post("/lookup")
+def lookup_scores(req: LookupRequest):
+    """事前計算した表から、全期間一定のレバーの期待スコアと軌跡を返す（ファシリテーター用の即時プレビュー）"""
+    decision = req.decision_vars
+    try:
+        return score_table.lookup(decision.cp_climate_params, decision.model_dump(), req.method,
+                                  req.include_trajectories)
+    except LookupError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/lookup/info")
+def get_lookup_info():
+    """スコア表の格子・RCP・作成日時と、現在のパラメータと一致するか（stale）"""
+    return score_table.info(table_fingerprint(DEFAULT_PARAMS, rcp_climate_params))
 
 @app.get("/ranking")
-def get_ranking():
-    if not RANK_FILE.exists():
-        return []
-    df = pd.read_csv(RANK_FILE, sep='\t')
-    latest = df.sort_values('timestamp').drop_duplicates(['user_name', 'scenario_name', 'period'], keep='last')
-    rank_df = (
-        latest.groupby('user_name')['total_score']
-        .mean()
-        .reset_index()
-        .sort_values('total_score', ascending=False)
-        .reset_index(drop=True)
-    )
-    rank_df['rank'] = rank_df.index + 1
-    return rank_df.to_dict(orient='records')
+def get_ranking(top: Optional[int] = None):
+    if top is not None and top < 1:
+        raise HTTPException(status_code=400, detail="top must be >= 1")
+    return _current_leaderboard().ranking(top)
+
+@app.get("/ranking/{user_name}")
+def get_user_rank(user_name: str):
+    entry = _current_leaderboard().rank_of(user_name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No ranking for user: {user_name}")
+    return entry
 
 @app.post("/compare", response_model=CompareResponse)
 def compare_scenario_data(req: CompareRequest):
@@ -277,11 +608,8 @@ def export_scenario_data(scenario_name: str):
 
 @app.get("/block_scores")
 def get_block_scores():
-    if not RANK_FILE.exists():
-        return []
     try:
-        df = pd.read_csv(RANK_FILE, sep="\t")
-        return df.to_dict(orient="records")
+        return score_store.block_scores()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -302,36 +630,32 @@ def get_user_data(user_name: str):
         }
 
         # 获取决策日志
-        if ACTION_LOG_FILE.exists():
-            df_log = pd.read_csv(ACTION_LOG_FILE)
-            user_logs = df_log[df_log['user_name'] == user_name]
-            if not user_logs.empty:
-                result["decision_log_csv"] = user_logs.to_csv(index=False)
-                result["found"] = True
-                print(f"✅ [API] 找到决策日志: {len(user_logs)} 条记录")
+        decision_csv = score_store.decisions_csv(user_name)
+        if decision_csv:
+            result["decision_log_csv"] = decision_csv
+            result["found"] = True
+            print(f"✅ [API] 找到决策日志: {decision_csv.count(chr(10)) - 1} 条记录")
 
         # 获取评分数据并验证完整性
-        if RANK_FILE.exists():
-            df_scores = pd.read_csv(RANK_FILE, sep='\t')
-            user_scores = df_scores[df_scores['user_name'] == user_name]
-            if not user_scores.empty:
-                # 检查是否有3个时期的数据
-                periods = user_scores['period'].unique()
-                expected_periods = ['2026-2050', '2051-2075', '2076-2100']
-
-                result["periods_found"] = len(periods)
-                result["data_complete"] = len(periods) >= 3
-
-                if result["data_complete"]:
-                    # 按时期排序，确保顺序正确
-                    user_scores_sorted = user_scores.sort_values('period')
-                    result["block_scores_tsv"] = user_scores_sorted.to_csv(sep='\t', index=False)
-                    print(f"✅ [API] 找到完整评分数据: {len(periods)} 个时期")
-                else:
-                    result["block_scores_tsv"] = user_scores.to_csv(sep='\t', index=False)
-                    print(f"⚠️ [API] 评分数据不完整: 只有 {len(periods)} 个时期")
+        user_scores = score_store.block_scores_frame(user_name)
+        if not user_scores.empty:
+            # 检查是否有3个时期的数据
+            periods = user_scores['period'].unique()
+            expected_periods = ['2026-2050', '2051-2075', '2076-2100']
+
+            result["periods_found"] = len(periods)
+            result["data_complete"] = len(periods) >= 3
+
+            if result["data_complete"]:
+                # 按时期排序，确保顺序正确
+                user_scores_sorted = user_scores.sort_values('period')
+                result["block_scores_tsv"] = user_scores_sorted.to_csv(sep='\t', index=False)
+                print(f"✅ [API] 找到完整评分数据: {len(periods)} 个时期")
+            else:
+                result["block_scores_tsv"] = user_scores.to_csv(sep='\t', index=False)
+                print(f"⚠️ [API] 评分数据不完整: 只有 {len(periods)} 个时期")
 
-                result["found"] = True
+            result["found"] = True
 
         if not result["found"]:
             print(f"❌ [API] 未找到用户数据: {user_name}")
@@ -356,6 +680,11 @@ def get_file_status():
     data_dir = Path(__file__).parent / "data"
     frontend_data_dir = Path(__file__).parent.parent / "frontend" / "public" / "results" / "data"
 
+    try:
+        _sync_data_files()
+    except Exception as e:
+        # 書き込めていない行は下の decision_log_writer（error / failed）で確認できる
+        print(f"❌ [File Status] 数据文件同步失败: {e}")
     files_to_check = [
         ("your_name.csv", YOUR_NAME_FILE),
         ("decision_log.csv", ACTION_LOG_FILE),
@@ -365,6 +694,7 @@ def get_file_status():
     status = {
         "backend_data_dir": str(data_dir),
         "frontend_data_dir": str(frontend_data_dir),
+        "decision_log_writer": decision_log.status(),
         "backend_files": {},
         "frontend_files": {},
         "summary": {
@@ -404,16 +734,121 @@ def get_file_status():
     return status
 
 
+# モンテカルロの途中結果を WebSocket で送る
+# クライアントは SimulationRequest と同じ JSON を1つ送る。サーバーは塊が終わるたびに
+# {"type": "progress", ...}、最後に {"type": "final", ...} を送る（summary は /simulate の summary と同じ形）。
+# 切断されるか {"type": "cancel"} を受け取ったら、新しい塊は投入しない。
+@app.websocket("/ws/simulate")
+async def websocket_simulate_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        req = SimulationRequest.model_validate(await websocket.receive_json())
+    except (ValidationError, ValueError) as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1008)
+        return
+    if req.mode != "Monte Carlo Simulation Mode":
+        await websocket.send_json({"type": "error", "detail": f"Unsupported mode: {req.mode}"})
+        await websocket.close(code=1008)
+        return
+    if any(not 0 <= q <= 1 for q in req.quantiles):
+        await websocket.send_json({"type": "error", "detail": "quantiles must be between 0 and 1"})
+        await websocket.close(code=1008)
+        return
+    if req.sampling not in SAMPLING_METHODS:
+        await websocket.send_json({"type": "error", "detail": f"Unknown sampling: {req.sampling}"})
+        await websocket.close(code=1008)
+        return
+    if req.importance_sampling is not None:
+        # 重み付き集計は /simulate だけで行う
+        await websocket.send_json({"type": "error", "detail": "importance_sampling is not supported over WebSocket"})
+        await websocket.close(code=1008)
+        return
+
+    decision_df, params = _prepare_simulation(req)
+    seed = req.seed if req.seed is not None else new_seed()
+    cancel = threading.Event()
+    iterator = ensemble_pool.iter_summary(
+        years=params['years'],
+        initial_values=req.current_year_index_seq.model_dump(),
+        decision_vars_list=decision_df,
+        params=params,
+        num_simulations=req.num_simulations,
+        seed=seed,
+        quantiles=req.quantiles,
+        chunk_size=MC_STREAM_CHUNK_SIZE,
+        cancel=cancel,
+        sampling=req.sampling
+    )
+
+    def next_progress():
+        # 計算と集計の取りまとめはスレッド側で行い、イベントループを止めない
+        item = next(iterator, None)
+        return None if item is None else (item[1], item[0].result(), item[0].metrics.sampling_report())
+
+    async def watch_client():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") and json.loads(message["text"]).get("type") == "cancel":
+                    break
+        except Exception:
+            pass
+        finally:
+            cancel.set()
+
+    watcher = asyncio.create_task(watch_client())
+    started = time.time()
+    print(f"🚀 [Monte Carlo WS] 开始流式计算 {req.num_simulations} 次仿真")
+    try:
+        while not cancel.is_set():
+            item = await asyncio.to_thread(next_progress)
+            if cancel.is_set():
+                break
+            if item is None:
+                if req.num_simulations > 0:
+                    break
+                # 0 本のときも final は送る
+                empty = StreamingSummary(params['years'], req.quantiles, sampling=req.sampling)
+                item = (0, empty.result(), empty.metrics.sampling_report())
+            completed, summary, sampling = item
+            await websocket.send_json({
+                "type": "final" if completed == req.num_simulations else "progress",
+                "completed": completed,
+                "num_simulations": req.num_simulations,
+                "seed": seed,
+                "elapsed": time.time() - started,
+                "summary": summary,
+                "sampling": sampling,
+            })
+            if completed == req.num_simulations:
+                break
+        if not cancel.is_set():
+            await websocket.close()
+            print(f"✅ [Monte Carlo WS] 完成，耗时 {time.time() - started:.2f} 秒")
+        else:
+            print(f"⚠️ [Monte Carlo WS] 客户端已断开或取消，停止计算")
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        cancel.set()
+        watcher.cancel()
+        try:
+            await asyncio.to_thread(iterator.close)
+        except ValueError:
+            # 別スレッドがまだ next() の途中なら、cancel を見てそちらで止まる
+            pass
+
 # サーバに送信されているログをWebSocketで受信。現在はbackendに保存中
 @app.websocket("/ws/log")
 async def websocket_log_endpoint(websocket: WebSocket):
     await websocket.accept()
-    log_path = Path(__file__).parent / "data" / "user_log.jsonl"
     while True:
         try:
             data = await websocket.receive_text()
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(data + "\n")
+            user_log.append([data])
         except Exception as e:
             # クライアント切断などでエラーが出たら終了
             break
@@ -427,15 +862,8 @@ async def receive_batch_logs(request: dict):
         if not logs:
             return {"status": "success", "message": "No logs to process"}
 
-        log_path = Path(__file__).parent / "data" / "user_log.jsonl"
-
-        # 确保data目录存在
-        log_path.parent.mkdir(exist_ok=True)
-
-        # 批量写入log数据
-        with open(log_path, "a", encoding="utf-8") as f:
-            for log_entry in logs:
-                f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+        # 批量写入log数据（同时更新索引）
+        user_log.append_logs(logs)
 
         print(f"✅ [API] 批量接收 {len(logs)} 条log数据")
         return {
@@ -459,9 +887,6 @@ async def end_experiment(request: dict):
         if not user_name:
             raise HTTPException(status_code=400, detail="User name is required")
 
-        log_path = Path(__file__).parent / "data" / "user_log.jsonl"
-        log_path.parent.mkdir(exist_ok=True)
-
         # 写入结束实验的日志
         end_log = {
             "type": "ExperimentEnd",
@@ -470,12 +895,8 @@ async def end_experiment(request: dict):
             "total_logs": len(logs)
         }
 
-        with open(log_path, "a", encoding="utf-8") as f:
-            # 写入所有用户行为日志
-            for log_entry in logs:
-                f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-            # 写入实验结束标记
-            f.write(json.dumps(end_log, ensure_ascii=False) + "\n")
+        # 写入所有用户行为日志和实验结束标记
+        user_log.append_logs(list(logs) + [end_log])
 
         print(f"✅ [Experiment End] 用户 {user_name} 实验结束，保存 {len(logs)} 条日志")
 
@@ -491,33 +912,28 @@ async def end_experiment(request: dict):
 
 # 获取用户日志API端点
 @app.get("/user-logs/{user_name}")
-async def get_user_logs(user_name: str):
-    """获取指定用户的所有日志数据"""
+async def get_user_logs(user_name: str, event_type: Optional[str] = None, since: Optional[str] = None,
+                        until: Optional[str] = None, offset: int = 0, limit: Optional[int] = None):
+    """获取指定用户的日志数据（可按事件类型、时间范围 [since, until) 筛选并分页）"""
     try:
-        log_path = Path(__file__).parent / "data" / "user_log.jsonl"
-
-        if not log_path.exists():
+        since_time, until_time = _log_query(since, until, offset, limit)
+        if not user_log.path.exists():
             return {"logs": [], "message": "No logs found"}
 
-        user_logs = []
-        with open(log_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    try:
-                        log = json.loads(line.strip())
-                        if log.get('user_name') == user_name:
-                            user_logs.append(log)
-                    except json.JSONDecodeError:
-                        continue
+        user_logs, total_count = user_log.query(user_name, event_type, since_time, until_time, offset, limit)
 
-        print(f"✅ [User Logs] 获取用户 {user_name} 的日志: {len(user_logs)} 条")
+        print(f"✅ [User Logs] 获取用户 {user_name} 的日志: {len(user_logs)}/{total_count} 条")
 
         return {
             "user_name": user_name,
             "logs": user_logs,
-            "total_count": len(user_logs)
+            "total_count": total_count,
+            "offset": offset,
+            "limit": limit
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ [User Logs] 获取失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get user logs: {str(e)}")
@@ -527,28 +943,13 @@ async def get_user_logs(user_name: str):
 async def get_admin_dashboard(admin: str = Depends(authenticate_admin)):
     """获取管理员仪表板数据"""
     try:
-        data_dir = Path(__file__).parent / "data"
-
-        # 读取用户日志
-        user_log_file = data_dir / "user_log.jsonl"
-        user_logs = []
-        if user_log_file.exists():
-            with open(user_log_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        user_logs.append(json.loads(line.strip()))
+        # 用户日志的统计（通过索引，不读取整个文件）
+        user_log_file = user_log.path
+        total_logs, unique_users, _, _ = user_log.stats()
 
         # 读取评分数据
-        block_scores = []
-        if RANK_FILE.exists():
-            df = pd.read_csv(RANK_FILE, sep='\t')
-            block_scores = df.to_dict('records')
-
-        # 统计信息
-        unique_users = set()
-        for log in user_logs:
-            if 'user_name' in log:
-                unique_users.add(log['user_name'])
+        block_scores = score_store.block_scores()
+        _sync_data_files()
 
         # 按用户分组的评分数据
         user_scores = {}
@@ -559,16 +960,16 @@ async def get_admin_dashboard(admin: str = Depends(authenticate_admin)):
             user_scores[user_name].append(score)
 
         # 最近活动
-        recent_logs = sorted(user_logs, key=lambda x: x.get('timestamp', ''), reverse=True)[:50]
+        recent_logs = user_log.recent(50)
 
         return {
             "summary": {
                 "total_users": len(unique_users),
-                "total_logs": len(user_logs),
+                "total_logs": total_logs,
                 "total_simulations": len(block_scores),
-                "last_activity": recent_logs[0]['timestamp'] if recent_logs else None
+                "last_activity": recent_logs[0].get('timestamp') if recent_logs else None
             },
-            "users": list(unique_users),
+            "users": unique_users,
             "user_scores": user_scores,
             "recent_activity": recent_logs,
             "data_files": {
@@ -579,12 +980,46 @@ async def get_admin_dashboard(admin: str = Depends(authenticate_admin)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"データの取得に失敗しました: {str(e)}")
 
+@app.get("/admin/users/{user_name}")
+async def get_admin_user(user_name: str, event_type: Optional[str] = None, since: Optional[str] = None,
+                         until: Optional[str] = None, offset: int = 0, limit: Optional[int] = 100,
+                         admin: str = Depends(authenticate_admin)):
+    """获取指定用户的详细信息（事件统计、分页的日志、评分数据和排名）"""
+    since_time, until_time = _log_query(since, until, offset, limit)
+    try:
+        logs, total_count = user_log.query(user_name, event_type, since_time, until_time, offset, limit)
+        event_counts = user_log.event_counts(user_name)
+        block_scores = score_store.block_scores(user_name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ユーザー情報の取得に失敗しました: {str(e)}")
+    if not event_counts and not block_scores:
+        raise HTTPException(status_code=404, detail=f"No data found for user: {user_name}")
+    return {
+        "user_name": user_name,
+        "event_counts": event_counts,
+        "total_events": sum(event_counts.values()),
+        "logs": logs,
+        "total_count": total_count,
+        "offset": offset,
+        "limit": limit,
+        "block_scores": block_scores,
+        "ranking": _current_leaderboard().rank_of(user_name)
+    }
+
+@app.post("/admin/user-logs/reindex")
+async def reindex_user_logs(admin: str = Depends(authenticate_admin)):
+    """从头重建操作日志的索引"""
+    count = await asyncio.to_thread(user_log.rebuild)
+    print(f"🗂️ [User Logs] 索引已重建: {count} 条日志")
+    return {"indexed": count, **user_log.status()}
+
 @app.get("/admin/data-files")
 async def list_data_files(admin: str = Depends(authenticate_admin)):
     """获取data文件夹下所有文件的列表和信息"""
     try:
         data_dir = Path(__file__).parent / "data"
         files_info = []
+        _sync_data_files()
 
         if data_dir.exists():
             for file_path in data_dir.iterdir():
@@ -607,6 +1042,7 @@ async def preview_file_content(filename: str, admin: str = Depends(authenticate_
     try:
         data_dir = Path(__file__).parent / "data"
         file_path = data_dir / filename
+        _sync_data_files()
 
         print(f"Preview request for file: {filename}")
         print(f"File path: {file_path}")
@@ -739,6 +1175,7 @@ async def download_single_file(filename: str, admin: str = Depends(authenticate_
     try:
         data_dir = Path(__file__).parent / "data"
         file_path = data_dir / filename
+        _sync_data_files()
 
         # セキュリティチェック：パストラバーサル攻撃を防ぐ
         if not file_path.resolve().is_relative_to(data_dir.resolve()):
@@ -765,6 +1202,7 @@ async def download_all_data(admin: str = Depends(authenticate_admin)):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         zip_filename = f"climate_simulation_data_{timestamp}.zip"
         zip_path = data_dir / zip_filename
+        _sync_data_files()
 
         # 创建压缩包
         with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
@@ -809,6 +1247,7 @@ async def download_user_logs(admin: str = Depends(authenticate_admin)):
 async def download_scores(admin: str = Depends(authenticate_admin)):
     """下载评分数据文件"""
     try:
+        _sync_data_files()
         if not RANK_FILE.exists():
             raise HTTPException(status_code=404, detail="評価ファイルが存在しません")
 
@@ -822,43 +1261,45 @@ async def download_scores(admin: str = Depends(authenticate_admin)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"評価データのダウンロードに失敗しました: {str(e)}")
 
+def _pool_status():
+    """进程池及各缓存的状态（GET /admin/pool 与 resize 返回同样的结构）"""
+    return {**ensemble_pool.status(), "forcing_cache": forcing_cache.info(), "score_cache": score_cache.info()}
+
+@app.get("/admin/pool")
+async def get_pool_status(admin: str = Depends(authenticate_admin)):
+    """获取蒙特卡洛常驻进程池及气候外力缓存的状态"""
+    return _pool_status()
+
+@app.post("/admin/surrogate/retrain")
+def retrain_surrogate(admin: str = Depends(authenticate_admin)):
+    """在后台重新训练预测模式的代理模型"""
+    started = _retrain_surrogate()
+    print(f"🔧 [Admin] 代理模型重新训练: {'已开始' if started else '正在训练中'}")
+    return {"started": started, **surrogate_store.status()}
+
+@app.post("/admin/pool/resize")
+def resize_pool(req: PoolResizeRequest, admin: str = Depends(authenticate_admin)):
+    """调整蒙特卡洛常驻进程池的大小"""
+    if req.size < 0:
+        raise HTTPException(status_code=400, detail="プールサイズは0以上で指定してください")
+    ensemble_pool.resize(req.size)
+    print(f"🔧 [Admin] 进程池大小已调整为 {req.size}")
+    return _pool_status()
+
 @app.get("/admin/data-stats")
 async def get_data_stats(admin: str = Depends(authenticate_admin)):
     """获取数据统计信息，用于清空前确认"""
     try:
-        data_dir = Path(__file__).parent / "data"
-
-        # 统计用户日志
-        user_log_file = data_dir / "user_log.jsonl"
-        user_logs = []
-        unique_users = set()
-
-        if user_log_file.exists():
-            with open(user_log_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        try:
-                            log = json.loads(line.strip())
-                            user_logs.append(log)
-                            if 'user_name' in log:
-                                unique_users.add(log['user_name'])
-                        except json.JSONDecodeError:
-                            continue
+        # 统计用户日志（通过索引）
+        user_log_file = user_log.path
+        total_logs, unique_users, earliest_activity, latest_activity = user_log.stats()
 
         # 统计评分数据
-        block_scores = []
-        simulation_periods = set()
-
-        if RANK_FILE.exists():
-            df = pd.read_csv(RANK_FILE, sep='\t')
-            block_scores = df.to_dict('records')
-            simulation_periods = set(df['period'].unique()) if 'period' in df.columns else set()
+        total_simulations, simulation_periods = score_store.score_stats()
 
         # 统计决策日志
-        decision_logs = []
-        if ACTION_LOG_FILE.exists():
-            df_log = pd.read_csv(ACTION_LOG_FILE)
-            decision_logs = df_log.to_dict('records')
+        total_decision_logs = score_store.count_decisions()
+        _sync_data_files()
 
         # 计算文件大小
         file_sizes = {}
@@ -886,29 +1327,19 @@ async def get_data_stats(admin: str = Depends(authenticate_admin)):
                     "exists": False
                 }
 
-        # 获取最早和最新的活动时间
-        earliest_activity = None
-        latest_activity = None
-
-        if user_logs:
-            timestamps = [log.get('timestamp') for log in user_logs if log.get('timestamp')]
-            if timestamps:
-                earliest_activity = min(timestamps)
-                latest_activity = max(timestamps)
-
         stats = {
             "summary": {
                 "total_users": len(unique_users),
-                "total_logs": len(user_logs),
-                "total_simulations": len(block_scores),
-                "total_decision_logs": len(decision_logs),
+                "total_logs": total_logs,
+                "total_simulations": total_simulations,
+                "total_decision_logs": total_decision_logs,
                 "simulation_periods": len(simulation_periods),
                 "earliest_activity": earliest_activity,
                 "latest_activity": latest_activity,
                 "total_size_mb": round(total_size / (1024 * 1024), 2)
             },
             "files": file_sizes,
-            "users": list(unique_users),
+            "users": unique_users,
             "periods": list(simulation_periods)
         }
 
@@ -929,7 +1360,7 @@ async def clear_all_data(admin: str = Depends(authenticate_admin)):
 
         # 定义需要清空的文件
         files_to_clear = [
-            ("user_log.jsonl", data_dir / "user_log.jsonl"),
+            ("user_log.jsonl", user_log.path),
             ("block_scores.tsv", RANK_FILE),
             ("decision_log.csv", ACTION_LOG_FILE),
             ("your_name.csv", YOUR_NAME_FILE)
@@ -946,15 +1377,22 @@ async def clear_all_data(admin: str = Depends(authenticate_admin)):
                     original_size = file_path.stat().st_size
 
                     # 清空文件内容但保留文件
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        # 对于TSV和CSV文件，保留表头
+                    if file_name == "decision_log.csv":
+                        # 决策日志由后台写入线程追加，需通过它清空（保留表头）
+                        decision_log.clear()
+                    elif file_name == "user_log.jsonl":
+                        # 用户日志完全清空，索引也一并清空
+                        user_log.clear()
+                    else:
                         if file_name == "block_scores.tsv":
-                            f.write("user_name\tscenario_name\tperiod\ttotal_score\ttimestamp\n")
-                        elif file_name == "decision_log.csv":
-                            f.write("year,planting_trees_amount,house_migration_amount,dam_levee_construction_cost,paddy_dam_construction_cost,capacity_building_cost,transportation_invest,agricultural_RnD_cost,cp_climate_params,user_name,scenario_name,timestamp\n")
-                        elif file_name == "your_name.csv":
-                            f.write("user_name\n")
-                        # user_log.jsonl 完全清空
+                            # 评分数据和决策日志的索引存储一并清空
+                            score_store.clear()
+                        with open(file_path, 'w', encoding='utf-8') as f:
+                            # 对于TSV和CSV文件，保留表头
+                            if file_name == "block_scores.tsv":
+                                f.write("user_name\tscenario_name\tperiod\ttotal_score\ttimestamp\n")
+                            elif file_name == "your_name.csv":
+                                f.write("user_name\n")
 
                     cleared_files.append({
                         "file": file_name,
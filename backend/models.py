@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 
 class DecisionVar(BaseModel):
     year: int
@@ -12,6 +12,11 @@ class DecisionVar(BaseModel):
     agricultural_RnD_cost: float
     cp_climate_params: float
 
+class PlantingHistory(BaseModel):
+    # 植林履歴のリングバッファ（last_year までの直近 tree_growup_year 年分、古い順）
+    last_year: Optional[int] = None
+    amounts: List[float] = []
+
 class CurrentValues(BaseModel):
     temp: float
     precip: float
@@ -24,7 +29,8 @@ class CurrentValues(BaseModel):
     levee_level: Optional[float] = 0.0
     high_temp_tolerance_level: Optional[float] = 0.0
     forest_area: Optional[float] = 0.0
-    planting_history: Optional[Dict[int, float]] = {}
+    # 旧形式の {年: 植林量} も受け付ける
+    planting_history: Optional[Union[PlantingHistory, Dict[int, float]]] = {}
     urban_level: Optional[float] = 0.0
     resident_capacity: Optional[float] = 0.0
     transportation_level: Optional[float] = 100.0
@@ -35,6 +41,17 @@ class CurrentValues(BaseModel):
     resident_burden: Optional[float] = 0.0
     biodiversity_level: Optional[float] = 0.0
 
+class ImportanceSampling(BaseModel):
+    # 極端降水の重点サンプリング。(シミュレーション × 年) ごとに確率 mix で、頻度 max(freq × freq_scale, min_freq)、
+    # 最後のイベントの Gumbel 位置 mu + loc_shift × beta の分布から引く（残りは元の分布）
+    freq_scale: float = 1.0
+    min_freq: float = 1.0
+    loc_shift: float = 3.0
+    mix: float = 0.5
+    # 超過確率を返す閾値 {列名: [閾値, ...]} と、値を返す再現期間（年）
+    thresholds: Dict[str, List[float]] = {}
+    return_periods: List[float] = [10, 50, 100]
+
 class BlockRaw(BaseModel):
     period: str
     raw: Dict[str, float]
@@ -47,6 +64,27 @@ class SimulationRequest(BaseModel):
     mode: str
     decision_vars: List[DecisionVar] = []
     num_simulations: int = 100
+    # 乱数の seed（同じ seed なら同じアンサンブルを返す。未指定ならサーバー側で生成）
+    seed: Optional[int] = None
+    # True のときだけ各行に planting_history（PlantingHistory 形式）を載せる
+    include_planting_history: bool = False
+    # モンテカルロモードで、年ごとの平均・標準偏差・分位点（summary）をサーバー側で計算して返す
+    summary: bool = False
+    quantiles: List[float] = [0.05, 0.25, 0.5, 0.75, 0.95]
+    # False のときは data（全行）を返さない（summary だけで足りる場合に転送量を減らす）
+    include_rows: bool = True
+    # モンテカルロモードで、指標の平均の標準誤差が rel_tolerance × |平均| 以下になるまでアンサンブルを増やす
+    # （num_simulations は上限、max_seconds は時間の上限。使った本数と標準誤差は convergence に入る）
+    adaptive: bool = False
+    # モンテカルロモードのサンプリング方式："random"（既定）/ "antithetic" / "lhs" / "sobol"
+    sampling: str = "random"
+    # 指定すると極端降水を重点サンプリングし、summary を尤度比で重み付けして返す（各行にも Importance Weight が付く）
+    importance_sampling: Optional[ImportanceSampling] = None
+    rel_tolerance: float = 0.01
+    max_seconds: Optional[float] = None
+    # レスポンス形式："records"（既定）/ "columns"（列指向 JSON）/ "frames"（NumPy バッファのバイナリ）
+    # 未指定の場合は Accept: application/x-numpy-frames なら frames
+    response_format: Optional[str] = None
     current_year_index_seq: CurrentValues
     # 添加仿真数据字段，用于Record Results Mode
     simulation_data: Optional[List[Dict[str, Any]]] = []
@@ -56,6 +94,80 @@ class SimulationResponse(BaseModel):
     scenario_name: str
     data: List[Dict[str, Any]]
     block_scores: List[BlockRaw]
+    seed: Optional[int] = None
+    summary: Optional[Dict[str, Any]] = None
+    convergence: Optional[Dict[str, Any]] = None
+    # モンテカルロモードのサンプリング方式と、指標ごとの有効サンプルサイズ
+    sampling: Optional[Dict[str, Any]] = None
+
+class SensitivityFactor(BaseModel):
+    # DEFAULT_PARAMS の数値パラメータ名、または意思決定変数名（全期間一定の値として動かす）
+    name: str
+    low: float
+    high: float
+
+class SensitivityRequest(BaseModel):
+    # "sobol"（Saltelli の計画で S1 / ST）または "morris"（要素効果で mu* / sigma）
+    method: str = "sobol"
+    factors: List[SensitivityFactor]
+    # 因子で動かさない意思決定変数と RCP シナリオ（cp_climate_params）
+    decision_vars: List[DecisionVar] = []
+    current_year_index_seq: CurrentValues
+    # sobol は基本サンプル数（2 の累乗に切り上げ）、morris は軌跡の本数
+    num_samples: int = 256
+    # morris の格子の水準数（偶数）
+    num_levels: int = 4
+    # 各点を評価する共通乱数アンサンブルの本数
+    replicates: int = 8
+    seed: Optional[int] = None
+    # 結果に含める指標（既定は期間ごとの total_score とその平均 "block:mean"）
+    metrics: Optional[List[str]] = None
+    num_bootstrap: int = 200
+    confidence: float = 0.95
+
+class OptimizeRequest(BaseModel):
+    # 基準のスケジュール（動かさないレバーの値と初期集団）と RCP シナリオ（cp_climate_params）
+    decision_vars: List[DecisionVar] = []
+    current_year_index_seq: CurrentValues
+    # 動かすレバー（既定はすべての意思決定変数）
+    levers: Optional[List[str]] = None
+    # True ならスライダーの段階（整数）だけを探す
+    discrete: bool = True
+    # 各候補を評価する共通乱数アンサンブルの本数
+    replicates: int = 16
+    # 集団の大きさ = 変数の数（期間数 × レバー数）× popsize
+    popsize: int = 5
+    max_generations: int = 30
+    max_seconds: Optional[float] = None
+    seed: Optional[int] = None
+    # 最良の戦略と基準を評価し直すシミュレーション数
+    num_simulations: int = 1000
+    quantiles: List[float] = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+class ParetoRequest(BaseModel):
+    # 基準のスケジュール（動かさないレバーの値と初期集団）と RCP シナリオ（cp_climate_params）
+    decision_vars: List[DecisionVar] = []
+    current_year_index_seq: CurrentValues
+    # 動かすレバー（既定はすべての意思決定変数）
+    levers: Optional[List[str]] = None
+    # 目的にする BENCHMARK の指標（既定は7つすべて）
+    objectives: Optional[List[str]] = None
+    discrete: bool = True
+    replicates: int = 8
+    population: int = 100
+    generations: int = 50
+    max_seconds: Optional[float] = None
+    seed: Optional[int] = None
+
+class LookupRequest(BaseModel):
+    # 全期間一定のレバーの値と RCP シナリオ（cp_climate_params）。year は使わない
+    decision_vars: DecisionVar
+    # nearest（最近傍の格子点）または linear（多重線形補間）
+    method: str = "linear"
+    include_trajectories: bool = True
+
+class PoolResizeRequest(BaseModel):
+    size: int
 
 class CompareRequest(BaseModel):
     scenario_names: List[str]
@@ -0,0 +1,56 @@
+"""
+Offline score table precompute
+
+レバーの格子 × RCP シナリオの期待スコアと軌跡を事前に計算し、/lookup が読む表（data/score_table.npy と .json）を作る。
+格子の指定（省略時は画面のスライダーの全段階）は {レバー名: 値のリスト または 段階数} の JSON。
+    python precompute_lookup.py --grid grid.json --replicates 32 --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from config import DEFAULT_PARAMS, LOOKUP_TABLE_FILE, PARAMETER_ZONES_FILE, rcp_climate_params
+from lookup import default_axes, normalize_axes, precompute_table
+from optimizer import load_lever_levels
+from worker_pool import EnsemblePool
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute expected block scores over a lever grid")
+    parser.add_argument("--grid", help="JSON file mapping levers to value lists or level counts (default: all slider levels)")
+    parser.add_argument("--output", "-o", default=str(LOOKUP_TABLE_FILE), help="table file (default: data/score_table.npy)")
+    parser.add_argument("--rcp", type=float, action="append", help="only these RCP scenarios (repeatable)")
+    parser.add_argument("--replicates", type=int, default=16, help="common-random-number runs per grid point")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (0 computes in this process)")
+    args = parser.parse_args()
+
+    if args.grid:
+        with open(args.grid, encoding="utf-8") as f:
+            axes = normalize_axes(json.load(f))
+    else:
+        axes = normalize_axes(default_axes(load_lever_levels(PARAMETER_ZONES_FILE)))
+    rcp_params = rcp_climate_params
+    if args.rcp:
+        rcp_params = {rcp: rcp_climate_params[rcp] for rcp in args.rcp}
+
+    def progress(rcp, done, total):
+        print(f"📐 [Lookup] RCP {rcp}: {done}/{total} 个格点")
+
+    pool = EnsemblePool(args.workers)
+    pool.start()
+    try:
+        meta = precompute_table(pool, args.output, DEFAULT_PARAMS, rcp_params, axes, replicates=args.replicates,
+                                seed=args.seed, progress=progress)
+    finally:
+        pool.shutdown()
+    print(f"✅ [Lookup] 查找表已写入 {args.output}（{meta['num_runs']} 次仿真，耗时 {meta['elapsed']:.1f} 秒）")
+
+
+if __name__ == "__main__":
+    main()
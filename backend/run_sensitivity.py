@@ -0,0 +1,71 @@
+"""
+Offline sensitivity analysis
+
+/sensitivity と同じリクエスト JSON を読み、サーバーを起動せずに感度分析を実行して結果を JSON に書き出す。
+    python run_sensitivity.py spec.json --output result.json --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent / "src"))
+
+import pandas as pd
+
+from config import DEFAULT_PARAMS, rcp_climate_params
+from ensemble import new_seed
+from models import SensitivityRequest
+from sensitivity import run_sensitivity
+from worker_pool import EnsemblePool
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sobol / Morris sensitivity analysis of the block scores")
+    parser.add_argument("spec", help="JSON file with the same fields as the /sensitivity request")
+    parser.add_argument("--output", "-o", help="output JSON file (default: stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (0 computes in this process)")
+    args = parser.parse_args()
+
+    with open(args.spec, encoding="utf-8") as f:
+        req = SensitivityRequest(**json.load(f))
+    decision_df = pd.DataFrame([dv.model_dump() for dv in req.decision_vars]) if req.decision_vars else pd.DataFrame()
+    params = DEFAULT_PARAMS.copy()
+    if req.decision_vars:
+        params.update(rcp_climate_params.get(req.decision_vars[0].cp_climate_params, {}))
+    seed = req.seed if req.seed is not None else new_seed()
+
+    pool = EnsemblePool(args.workers)
+    pool.start()
+    try:
+        result = run_sensitivity(
+            pool,
+            years=params['years'],
+            initial_values=req.current_year_index_seq.model_dump(),
+            decision_vars_list=decision_df,
+            params=params,
+            factors=[(factor.name, factor.low, factor.high) for factor in req.factors],
+            method=req.method,
+            num_samples=req.num_samples,
+            num_levels=req.num_levels,
+            replicates=req.replicates,
+            seed=seed,
+            num_bootstrap=req.num_bootstrap,
+            confidence=req.confidence,
+            metrics=req.metrics
+        )
+    finally:
+        pool.shutdown()
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+        print(f"✅ [Sensitivity] 结果已写入 {args.output}（{result['num_runs']} 次仿真，耗时 {result['elapsed']:.2f} 秒）")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# adaptive.py
+#
+# 適応的モンテカルロ。アンサンブルを塊ごとに流し（EnsemblePool.iter_summary）、
+# シナリオ指標と期間ごとの total_score の平均の標準誤差を追跡して、
+# すべての指標で 標準誤差 <= rel_tolerance × |平均| になったら打ち切る。
+# シミュレーション数の上限（max_simulations）か時間の上限（max_seconds）に達した場合もそこで止める。
+
+import threading
+import time
+
+import numpy as np
+
+# 収束判定を始める最小のシミュレーション数（少ないと標準誤差そのものが当てにならない）
+MIN_SIMULATIONS = 100
+# 収束判定の粒度（塊の大きさ）。小さいほど必要数を超えて計算する分が減る
+ADAPTIVE_CHUNK_SIZE = 100
+
+
+def converged(report, rel_tolerance):
+    """すべての指標で 標準誤差 <= rel_tolerance × |平均| か（平均が NaN の指標は判定から除く）"""
+    for stats in report.values():
+        mean, se = stats["mean"], stats["se"]
+        if np.isnan(mean):
+            continue
+        if se > rel_tolerance * abs(mean):
+            return False
+    return True
+
+
+def run_adaptive(pool, years, initial_values, decision_vars_list, params, seed, quantiles,
+                 max_simulations, rel_tolerance, max_seconds=None, chunk_size=ADAPTIVE_CHUNK_SIZE, sampling="random"):
+    """収束するか予算に達するまでアンサンブルを増やし、(StreamingSummary, 収束レポート) を返す
+
+    シミュレーション i の結果は (seed, i, sampling) だけで決まるので、打ち切った時点の N で
+    通常のモンテカルロを実行し直せば、同じアンサンブルの全行が得られる。
+    random 以外のサンプリングでは、標準誤差は独立な反復の組から見積もる（summary.MetricTracker）ので、
+    分散低減の分だけ早く収束する。
+    """
+    started = time.time()
+    cancel = threading.Event()
+    summary = None
+    stop_reason = "max_simulations"
+    iterator = pool.iter_summary(years, initial_values, decision_vars_list, params, max_simulations, seed,
+                                 quantiles, chunk_size, cancel=cancel, sampling=sampling)
+    try:
+        for summary, completed in iterator:
+            if completed >= MIN_SIMULATIONS and converged(summary.metric_report(), rel_tolerance):
+                stop_reason = "converged"
+                break
+            if max_seconds is not None and time.time() - started >= max_seconds:
+                stop_reason = "time_budget"
+                break
+    finally:
+        cancel.set()
+        iterator.close()
+
+    report = summary.metric_report() if summary is not None else {}
+    for stats in report.values():
+        # 平均が 0 で標準誤差がある指標は相対誤差を定義しない（JSON に inf を入れない）
+        stats["rel_se"] = stats["se"] / abs(stats["mean"]) if stats["mean"] else (0.0 if stats["se"] == 0 else None)
+    return summary, {
+        "converged": stop_reason == "converged",
+        "stop_reason": stop_reason,
+        "num_simulations": summary.moments.count if summary is not None else 0,
+        "max_simulations": int(max_simulations),
+        "rel_tolerance": float(rel_tolerance),
+        "elapsed": time.time() - started,
+        "metrics": report,
+    }
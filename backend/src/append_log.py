@@ -0,0 +1,237 @@
+# append_log.py
+#
+# 追記専用の CSV ログ（decision_log.csv）。リクエストごとに全体を読み込んで1行足して書き直す代わりに、
+# 行をキューに入れるだけで返し、1本の書き込みスレッドがたまった行をまとめて追記する。
+#
+# - ヘッダーはファイルが空のときに一度だけ書く（既存のファイルはそのヘッダーの列順に合わせる）
+# - fsync の方針: always（まとめて書くたび）/ interval（fsync_seconds 秒に1回まで。書き込みが途絶えても、
+#   未 fsync の行があれば書き込みスレッドが fsync_seconds 以内に fsync する）/ never（OS に任せる）
+# - ファイルを直接読む前に flush を呼べば、それまでに追加した行はすべて書き込まれている
+# - 書き込みに失敗した行は捨てずに持っておき、次の書き込み（または flush）で書き直す。flush / close は
+#   書き直しも失敗したときにその例外を送出し、status の error にも残る（途中まで書いた行は切り詰めて戻す）
+#
+# 行はどの形式でも pandas の to_csv と同じ表現（str、改行は \n）で書く。
+
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+FSYNC_POLICIES = ("always", "interval", "never")
+# 失敗した行の書き直しを書き込みスレッドに頼む合図（None は停止の合図）
+_RETRY = object()
+
+
+class AppendOnlyCsv:
+    """1本の書き込みスレッドでまとめて追記する CSV ファイル"""
+
+    def __init__(self, path, columns, fsync="interval", fsync_seconds=5.0, batch_size=256):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self._path = Path(path)
+        self._columns = list(columns)
+        self._fsync = fsync
+        self._fsync_seconds = float(fsync_seconds)
+        self._batch_size = max(1, int(batch_size))
+        self._queue = queue.Queue()
+        # ファイルへの書き込み・読み込み・切り詰めはこのロックの下で行う
+        self._file_lock = threading.Lock()
+        # 追加した行数と書き込んだ行数（flush はこれが追いつくのを待つ）
+        self._progress = threading.Condition()
+        self._appended = 0
+        self._written = 0
+        # 書き込みに失敗して書き直しを待っている行と、最後の失敗（書き込めたら None に戻す）
+        self._failed = []
+        self._error = None
+        # 書き込みを試みた回数（flush が、自分の待っている行の書き込みの結果を見分けるのに使う）
+        self._attempts = 0
+        self._thread = None
+        self._last_fsync = time.monotonic()
+        # 書いたが fsync していない行があるか（interval のとき、書き込みが途絶えたら書き込みスレッドが fsync する）
+        self._unsynced = False
+
+    @property
+    def path(self):
+        return self._path
+
+    def _ensure_started(self):
+        with self._progress:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"append-log-{self._path.name}", daemon=True)
+                self._thread.start()
+
+    def append(self, record):
+        """1行（{列名: 値}）をキューに入れる。書き込みは待たない"""
+        self._ensure_started()
+        with self._progress:
+            self._appended += 1
+        self._queue.put(dict(record))
+
+    def flush(self, timeout=None):
+        """それまでに append した行がすべて書き込まれるまで待つ。間に合えば True
+
+        書き込みに失敗した行が残っていれば書き直させ、それも失敗すればその例外を送出する（行は持ったまま）。
+        """
+        with self._progress:
+            target = self._appended
+            if self._written >= target:
+                return True
+            attempts = self._attempts
+            retry = self._error is not None
+        self._ensure_started()
+        if retry:
+            self._queue.put(_RETRY)
+        with self._progress:
+            failed = lambda: self._error is not None and self._attempts > attempts
+            done = self._progress.wait_for(lambda: self._written >= target or failed(), timeout)
+            if self._written < target and failed():
+                raise self._error
+            return done
+
+    def clear(self):
+        """内容を消してヘッダーだけにする（それまでの append は書き込んでから消す）"""
+        self.flush()
+        with self._file_lock:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._path, 'w', encoding='utf-8', newline='') as f:
+                csv.writer(f, lineterminator='\n').writerow(self._columns)
+                f.flush()
+                self._sync(f.fileno(), force=True)
+
+    def close(self, timeout=5.0):
+        """残りの行を書き込んで書き込みスレッドを止める（書き込めなかった行があれば、止めた後にその例外を送出する）"""
+        if self._thread is None:
+            return
+        try:
+            self.flush(timeout)
+        finally:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self):
+        with self._progress:
+            return {
+                "path": str(self._path),
+                "appended": self._appended,
+                "written": self._written,
+                "pending": self._appended - self._written,
+                "failed": len(self._failed),
+                "fsync": self._fsync,
+                "error": None if self._error is None else f"{type(self._error).__name__}: {self._error}",
+            }
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self._idle_timeout())
+            except queue.Empty:
+                self._sync_idle()
+                continue
+            # 最初の1行（または合図）が来たら、その時点でたまっている行をまとめて書く
+            records, stop = self._drain(record)
+            if records or self._failed:
+                self._write_batch(records)
+            if stop:
+                self._sync_idle()
+                return
+
+    def _drain(self, record):
+        # record から始めて、キューにたまっている行を batch_size 行まで取り出す（停止の合図が来たら stop）
+        records = []
+        while True:
+            if record is None:
+                return records, True
+            if record is not _RETRY:
+                records.append(record)
+            if len(records) >= self._batch_size:
+                return records, False
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                return records, False
+
+    def _write_batch(self, records):
+        # 前に失敗した行に続けて書く。失敗したらまとめて持っておき、次の書き込みで書き直す
+        batch = self._failed + records
+        try:
+            self._write(batch)
+        except Exception as e:
+            print(f"❌ [Append Log] 写入 {self._path.name} 失败，{len(batch)} 行将在下次写入时重试: {e}")
+            with self._progress:
+                self._failed = batch
+                self._error = e
+                self._attempts += 1
+                self._progress.notify_all()
+            return
+        with self._progress:
+            self._failed = []
+            self._error = None
+            self._written += len(batch)
+            self._attempts += 1
+            self._progress.notify_all()
+
+    def _idle_timeout(self):
+        # 次の行を待つ時間（interval で未 fsync の行があれば、次の fsync の時刻まで）
+        if self._fsync != "interval" or not self._unsynced:
+            return None
+        return max(0.0, self._last_fsync + self._fsync_seconds - time.monotonic())
+
+    def _sync_idle(self):
+        # 書き込みが途絶えている間に、未 fsync の行を fsync する
+        with self._file_lock:
+            if not self._unsynced or not self._path.exists():
+                return
+            fd = os.open(self._path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._last_fsync = time.monotonic()
+            self._unsynced = False
+
+    def _write(self, batch):
+        with self._file_lock:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self._path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                start = os.lseek(fd, 0, os.SEEK_END)
+                # 行はまとめて文字列にしてから一度に書く（途中で失敗したら start まで切り詰めて戻せるように）
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, lineterminator='\n')
+                columns = self._header(fd) if start else None
+                if not columns:
+                    columns = self._columns
+                    if start == 0:
+                        writer.writerow(columns)
+                for record in batch:
+                    writer.writerow(['' if record.get(column) is None else str(record.get(column)) for column in columns])
+                data = memoryview(buffer.getvalue().encode('utf-8'))
+                try:
+                    while data:
+                        data = data[os.write(fd, data):]
+                    self._sync(fd)
+                except Exception:
+                    # 書き直したときに行が重ならないよう、途中まで書いた分を切り詰めて戻す
+                    os.ftruncate(fd, start)
+                    raise
+            finally:
+                os.close(fd)
+
+    def _header(self, fd):
+        # 既存ファイルのヘッダー（列順をそれに合わせる）
+        with open(os.dup(fd), 'r', encoding='utf-8', newline='') as f:
+            f.seek(0)
+            return next(csv.reader([f.readline()]), [])
+
+    def _sync(self, fd, force=False):
+        now = time.monotonic()
+        if force or self._fsync == "always" or (self._fsync == "interval" and now - self._last_fsync >= self._fsync_seconds):
+            os.fsync(fd)
+            self._last_fsync = now
+            self._unsynced = False
+        elif self._fsync == "interval":
+            self._unsynced = True
@@ -0,0 +1,48 @@
+# conftest.py
+#
+# テストで共通に使うシナリオ（RCP4.5 の既定パラメータ・画面の初期値・途中で切り替える戦略・seed）。
+#
+# backend/ で python -m pytest -q src/ として実行する。
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config import DEFAULT_PARAMS, rcp_climate_params
+
+# 画面の currentValues の初期値
+INITIAL_VALUES = {
+    'temp': 15, 'precip': 1700, 'municipal_demand': 100, 'available_water': 1000, 'crop_yield': 100,
+    'hot_days': 30, 'extreme_precip_freq': 0.1, 'ecosystem_level': 100, 'levee_level': 0.5,
+    'high_temp_tolerance_level': 0, 'forest_area': 0, 'planting_history': {}, 'urban_level': 100,
+    'resident_capacity': 0, 'transportation_level': 0, 'levee_investment_total': 0, 'RnD_investment_total': 0,
+    'risky_house_total': 10000, 'non_risky_house_total': 0, 'resident_burden': 5.379e8, 'biodiversity_level': 100,
+}
+
+# 植林・移転・堤防・田んぼダム・研修・研究開発・交通の各分岐を通るよう、途中で切り替える戦略
+DECISIONS = [
+    {'year': 2026, 'planting_trees_amount': 100, 'house_migration_amount': 100, 'dam_levee_construction_cost': 1,
+     'paddy_dam_construction_cost': 1, 'capacity_building_cost': 1, 'agricultural_RnD_cost': 1, 'transportation_invest': 1},
+    {'year': 2051, 'planting_trees_amount': 50, 'house_migration_amount': 0, 'dam_levee_construction_cost': 3,
+     'paddy_dam_construction_cost': 0, 'capacity_building_cost': 2, 'agricultural_RnD_cost': 3, 'transportation_invest': 0},
+    {'year': 2076, 'planting_trees_amount': 0, 'house_migration_amount': 200, 'dam_levee_construction_cost': 0,
+     'paddy_dam_construction_cost': 2, 'capacity_building_cost': 0, 'agricultural_RnD_cost': 0, 'transportation_invest': 2},
+]
+
+
+@pytest.fixture
+def scenario():
+    """{params, years, initial_values, decisions, seed, num_simulations}（呼び出しごとに新しいコピー）"""
+    params = DEFAULT_PARAMS.copy()
+    params.update(rcp_climate_params[4.5])
+    return {
+        'params': params,
+        'years': params['years'],
+        'initial_values': {**INITIAL_VALUES, 'planting_history': {}},
+        'decisions': [dict(row) for row in DECISIONS],
+        'seed': 20240601,
+        'num_simulations': 8,
+    }
@@ -0,0 +1,70 @@
+# decisions.py
+#
+# 意思決定変数の入力（DataFrame / dict のリスト / 年で引ける表）を、実行の最初に一度だけ
+# (対象年 × DECISION_KEYS) の配列にコンパイルする。年ループではこの配列を添字で引くだけにする。
+#
+# 各行に 'year' がある場合は、その年から次の行の年の前年まで同じ値を使う（階段状）。
+# 毎年の行を並べれば年ごと、10年ごとの行を並べれば10年ごとの戦略になる。
+# 最初の行より前の年には最初の行を使う。
+
+import numpy as np
+import pandas as pd
+
+DECISION_KEYS = [
+    'planting_trees_amount',
+    'house_migration_amount',
+    'dam_levee_construction_cost',
+    'paddy_dam_construction_cost',
+    'capacity_building_cost',
+    'agricultural_RnD_cost',
+    'transportation_invest',
+]
+
+
+def _row(record):
+    # 指定のない意思決定変数は 0（simulate_year の decision_vars.get(key, 0) と同じ）
+    values = [record.get(key, 0) for key in DECISION_KEYS]
+    return [0.0 if pd.isna(value) else float(value) for value in values]
+
+
+def compile_decisions(decision_vars_list, years, start_year):
+    """意思決定変数を (len(years) × len(DECISION_KEYS)) の配列にする
+
+    - 'year' を持つ行の並び（DataFrame または dict のリスト）: 各行の年から階段状に適用
+    - 'year' を持たない DataFrame: 先頭行を全期間に適用
+    - 'year' を持たない dict のリスト: 最後の要素を全期間に適用
+    - それ以外（.loc で年を引ける表）: 10年単位の index を参照する
+    - (len(years) × len(DECISION_KEYS)) の配列: そのまま使う
+    - (シミュレーション数 × len(years) × len(DECISION_KEYS)) の配列: シミュレーションごとのスケジュールとしてそのまま使う
+    """
+    years = np.asarray(years)
+    n_years = len(years)
+
+    if isinstance(decision_vars_list, np.ndarray):
+        schedule = np.asarray(decision_vars_list, dtype=np.float64)
+        if schedule.ndim not in (2, 3) or schedule.shape[-2:] != (n_years, len(DECISION_KEYS)):
+            raise ValueError(f"decision schedule must have shape (..., {n_years}, {len(DECISION_KEYS)}), got {schedule.shape}")
+        return schedule
+
+    if isinstance(decision_vars_list, pd.DataFrame):
+        records = decision_vars_list.to_dict(orient='records')
+        fallback = records[:1]
+    elif isinstance(decision_vars_list, list):
+        records = list(decision_vars_list)
+        fallback = records[-1:]
+    else:
+        decade_years = (years - start_year) // 10 * 10 + start_year
+        rows = {year: _row(decision_vars_list.loc[year].to_dict()) for year in np.unique(decade_years)}
+        return np.array([rows[year] for year in decade_years], dtype=np.float64).reshape(n_years, len(DECISION_KEYS))
+
+    if not records:
+        return np.zeros((n_years, len(DECISION_KEYS)))
+
+    if all(not pd.isna(record.get('year')) for record in records):
+        records = sorted(records, key=lambda record: record['year'])
+        row_years = np.array([int(record['year']) for record in records])
+        rows = np.array([_row(record) for record in records], dtype=np.float64)
+        index = np.maximum(np.searchsorted(row_years, years, side='right') - 1, 0)
+        return rows[index]
+
+    return np.tile(np.array(_row(fallback[0]), dtype=np.float64), (n_years, 1))
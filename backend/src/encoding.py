@@ -0,0 +1,79 @@
+# encoding.py
+#
+# /simulate のレスポンスを、行ごとの辞書（records）以外の形で返すためのエンコーダ。
+#
+# - columns: 列名は一度だけ、値は列ごとの配列にした JSON
+# - frames:  NumPy の生バッファを並べたバイナリ
+#
+#     b"ENSF" | ヘッダ長 (uint32, little endian) | ヘッダ JSON (UTF-8) | 8 バイト境界に揃えた列バッファ...
+#
+#   ヘッダには scenario_name などのメタデータと、列ごとの {name, dtype, length, offset, nbytes}
+#   （offset はバッファ領域の先頭から）を入れる。数値でない列（planting_history など）はヘッダの
+#   "objects" に JSON のまま入れる。フロントエンドでは dtype に対応する TypedArray でそのまま読める。
+
+import json
+import struct
+
+import numpy as np
+
+FRAMES_MAGIC = b"ENSF"
+FRAMES_MEDIA_TYPE = "application/x-numpy-frames"
+RESPONSE_FORMATS = ["records", "columns", "frames"]
+
+
+def _column_values(series):
+    values = series.to_numpy()
+    if values.dtype.kind in "biuf":
+        return values
+    return None
+
+
+def encode_columns(df, meta):
+    """列指向の JSON（bytes）。meta は scenario_name などレスポンスのその他の項目"""
+    data = {}
+    for col in df.columns:
+        values = _column_values(df[col])
+        data[col] = values.tolist() if values is not None else df[col].tolist()
+    body = dict(meta, format="columns", num_rows=len(df), columns=list(df.columns), data=data)
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def encode_frames(df, meta):
+    """NumPy バッファを並べたバイナリ（bytes）"""
+    columns = []
+    objects = {}
+    buffers = []
+    offset = 0
+    for col in df.columns:
+        values = _column_values(df[col])
+        if values is None:
+            objects[col] = df[col].tolist()
+            continue
+        # リトルエンディアンに揃える（int は int64、bool は uint8 として送る）
+        dtype = np.dtype('<u1') if values.dtype.kind == 'b' else values.dtype.newbyteorder('<')
+        buffer = np.ascontiguousarray(values, dtype=dtype).tobytes()
+        columns.append({"name": col, "dtype": dtype.str, "length": len(values), "offset": offset, "nbytes": len(buffer)})
+        padding = -len(buffer) % 8
+        buffers.append(buffer + b"\0" * padding)
+        offset += len(buffer) + padding
+
+    header = dict(meta, format="frames", num_rows=len(df), columns=columns, objects=objects)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    # バッファ領域も 8 バイト境界から始める
+    header_bytes += b" " * (-(len(FRAMES_MAGIC) + 4 + len(header_bytes)) % 8)
+    return b"".join([FRAMES_MAGIC, struct.pack("<I", len(header_bytes)), header_bytes] + buffers)
+
+
+def decode_frames(payload):
+    """encode_frames の逆変換。(ヘッダ, {列名: ndarray または list}) を返す（Python クライアント・検証用）"""
+    if payload[:4] != FRAMES_MAGIC:
+        raise ValueError("not a frames payload")
+    (header_len,) = struct.unpack("<I", payload[4:8])
+    header = json.loads(payload[8:8 + header_len])
+    start = 8 + header_len
+    data = {}
+    for column in header["columns"]:
+        begin = start + column["offset"]
+        data[column["name"]] = np.frombuffer(payload, dtype=column["dtype"], count=column["length"], offset=begin)
+    data.update(header["objects"])
+    return header, data
@@ -0,0 +1,318 @@
+# ensemble.py
+#
+# simulate_year / simulate_simulation と同じモデル式を、アンサンブル全体
+# （N 本のシミュレーション × 状態変数）について NumPy 配列で1年ずつ進めるバッチ版エンジン。
+# 参照実装（simulation.py）とは乱数の引き方だけが異なり、行ごとの出力列・意味は同一。
+#
+# 気候外力（気温・降水量・高温日数・極端降水）は forcing.py で事前生成したものを受け取る。
+# それ以外の乱数はシミュレーション番号ごとに独立した Generator から引くので、
+# 同じ seed なら、ワーカー数やアンサンブルの分割の仕方によらず同じ結果になる。
+
+import numpy as np
+import pandas as pd
+
+from decisions import DECISION_KEYS, compile_decisions
+from extremes import flood_damage as event_flood_damage
+from forcing import last_event_rain
+from planting import PlantingRing
+from sampling import NOISE_DESIGN, dirichlet_ones, standard_normal, uniform_design
+
+# SeedSequence(seed) の子のうち、シミュレーションごとの系列に使う番号（気候外力は forcing.FORCING_STREAM）
+SIMULATION_STREAM = 1
+
+# simulate_year の outputs と同じ並び（planting_history を除く）
+OUTPUT_COLUMNS = [
+    'Year',
+    'Temperature (℃)',
+    'Precipitation (mm)',
+    'Available Water',
+    'Crop Yield',
+    'Municipal Demand',
+    'Flood Damage',
+    'Levee Level',
+    'High Temp Tolerance Level',
+    'Hot Days',
+    'Extreme Precip Frequency',
+    'Extreme Precip Events',
+    'Ecosystem Level',
+    'Municipal Cost',
+    'Urban Level',
+    'Resident Burden',
+    'Levee investment total',
+    'RnD investment total',
+    'Resident capacity',
+    'Forest Area',
+    'risky_house_total',
+    'non_risky_house_total',
+    'transportation_level',
+    'paddy_dam_area',
+] + DECISION_KEYS
+
+# 出力配列上は float64 で持ち、DataFrame にする際に int に戻す列
+INTEGER_COLUMNS = ['Year', 'Extreme Precip Events']
+
+
+def new_seed():
+    """seed が指定されなかったリクエスト用に、新しい seed を1つ作る（JSON で安全に返せる 32bit 整数）"""
+    return int(np.random.SeedSequence().generate_state(1)[0])
+
+
+def simulation_rngs(seed, sim_start, sim_stop):
+    """シミュレーション番号 [sim_start, sim_stop) に対応する Generator を返す
+
+    SeedSequence(seed).spawn(2)[SIMULATION_STREAM].spawn(N)[i] と同じ系列を、N を知らずに i から直接作る。
+    """
+    return [
+        np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(SIMULATION_STREAM, i))))
+        for i in range(sim_start, sim_stop)
+    ]
+
+
+def draw_noise(seed, sim_start, sim_stop, n_years, sampling="random"):
+    """シミュレーション [sim_start, sim_stop) の、気候外力以外の乱数を全年分まとめて作る
+
+    random ならシミュレーションごとの Generator（simulation_rngs）から引き、それ以外は
+    sampling.uniform_design の計画（1年あたり 正規 3 + 一様 2 + Dirichlet 3 次元）から逆関数法で作る。
+    """
+    if sampling == "random":
+        return _draw_noise(simulation_rngs(seed, sim_start, sim_stop), n_years)
+    u = uniform_design(sampling, seed, NOISE_DESIGN, sim_start, sim_stop, 8 * n_years).reshape(-1, n_years, 8)
+    return {
+        'normal': standard_normal(u[:, :, 0:3]),
+        'uniform': u[:, :, 3:5],
+        'weights': dirichlet_ones(u[:, :, 5:8]),
+    }
+
+
+def _draw_noise(rngs, n_years):
+    # 気候外力以外の乱数を、シミュレーションごとにその Generator から全年分まとめて引く
+    n = len(rngs)
+    noise = {
+        'normal': np.empty((n, n_years, 3)),
+        'uniform': np.empty((n, n_years, 2)),
+        'weights': np.empty((n, n_years, 3)),
+    }
+    for i, rng in enumerate(rngs):
+        noise['normal'][i] = rng.standard_normal((n_years, 3))
+        noise['uniform'][i] = rng.random((n_years, 2))
+        noise['weights'][i] = rng.dirichlet([1, 1, 1], n_years)
+    return noise
+
+
+def simulate_ensemble(years, initial_values, decision_vars_list, params, forcing, noise, out=None):
+    """アンサンブル全体を一括で計算し、(シミュレーション数, len(years), len(OUTPUT_COLUMNS)) の配列を返す
+
+    forcing は同じシミュレーション範囲の気候外力（forcing.generate_forcing / slice_forcing）、
+    noise はそれ以外の乱数（draw_noise）。
+    out を渡した場合はそこへ直接書き込む（共有メモリ上の配列の一部など）。
+
+    params の値（構造を決める start_year / tree_growup_year などを除く）は、スカラーの代わりに
+    長さ = シミュレーション数の配列でもよい。decision_vars_list も (シミュレーション数 × 年 × 変数) の配列にできる。
+    initial_values の数値も同様に配列にでき、planting_history には (長さ × シミュレーション数) の PlantingRing を渡せる。
+    これで、パラメータや政策の違う多数の変種を1回のバッチで計算できる（evaluation.evaluate_variants）。
+    """
+    years = np.asarray(years)
+    n = len(noise['normal'])
+    n_years = len(years)
+    # 水害はその年の最後のイベントだけが効く（simulate_year と同じ）
+    last_rain = last_event_rain(forcing)
+
+    if out is None:
+        out = np.empty((n, n_years, len(OUTPUT_COLUMNS)))
+    columns = {col: out[:, :, j] for j, col in enumerate(OUTPUT_COLUMNS)}
+
+    # --- 初期値（simulate_year の prev_values.get と同じ既定値） ---
+    def _init(key, default):
+        value = initial_values.get(key, default)
+        return np.full(n, value if isinstance(value, np.ndarray) else float(value))
+
+    levee_level = _init('levee_level', 0.0)
+    high_temp_tolerance_level = _init('high_temp_tolerance_level', 0.0)
+    forest_area = _init('forest_area', params['total_area'] * params['initial_forest_area'])
+    resident_capacity = _init('resident_capacity', 0.0)
+    transportation_level = _init('transportation_level', 0.0)
+    municipal_demand = _init('municipal_demand', params['initial_municipal_demand'])
+    available_water = _init('available_water', 0.0)
+    levee_investment_total = _init('levee_investment_total', 0.0)
+    RnD_investment_total = _init('RnD_investment_total', 0.0)
+    risky_house_total = _init('risky_house_total', params['house_total'])
+    non_risky_house_total = _init('non_risky_house_total', 0)
+    paddy_dam_area = _init('paddy_dam_area', 0)
+    temp_threshold_crop = initial_values.get('temp_threshold_crop', params['temp_threshold_crop_ini'])
+    # 植林は意思決定変数のみで決まるので、スケジュールが共通ならアンサンブル共通
+    planting_history = PlantingRing.from_value(initial_values.get('planting_history'), params['tree_growup_year'])
+
+    # 意思決定変数は (年 × 変数)（またはシミュレーションごとの (シミュレーション × 年 × 変数)）の配列に一度だけ変換しておく
+    schedule = compile_decisions(decision_vars_list, years, params['start_year'])
+    if schedule.ndim == 3 and planting_history.amounts.ndim == 1:
+        planting_history = planting_history.broadcast(n)
+
+    start_year = params['start_year']
+    base_temp = params['base_temp']
+    total_area = params['total_area']
+    paddy_field_area = params['paddy_field_area']
+
+    for t, year in enumerate(years):
+        d = dict(zip(DECISION_KEYS, schedule[t] if schedule.ndim == 2 else schedule[:, t].T))
+        elapsed = year - start_year
+
+        z = noise['normal'][:, t]
+        u = noise['uniform'][:, t]
+
+        # 領域横断影響の係数（simulate_year と同じく毎年一様乱数で上書き）
+        forest_flood_reduction_coef = 0.4 + 2.4 * u[:, 0]
+        forest_water_retention_coef = 2 + 2 * u[:, 1]
+
+        # 1. 気象環境（事前生成した気候外力）
+        temp = forcing['temp'][:, t]
+        precip = forcing['precip'][:, t]
+        hot_days = forcing['hot_days'][:, t]
+        extreme_precip_freq = np.maximum(params['base_extreme_precip_freq'] + params['extreme_precip_freq_trend'] * elapsed, 0)
+        extreme_precip_events = forcing['events'][:, t]
+
+        # 2. 社会環境（水需要）
+        municipal_growth = params['municipal_demand_trend'] + params['municipal_demand_uncertainty'] * z[:, 0]
+        municipal_demand = municipal_demand * (1 + municipal_growth)
+
+        # 3. 森林面積（植林 - 自然減衰）
+        matured_trees = planting_history.matured(year)
+        planting_history.record(year, d['planting_trees_amount'])
+        natural_loss = forest_area * params['forest_degradation_rate']
+        forest_area = np.maximum(forest_area + matured_trees - natural_loss, 0)
+
+        flood_reduction = forest_flood_reduction_coef * ((forest_area - total_area * params['initial_forest_area']) / total_area)
+        water_retention_boost = forest_water_retention_coef * forest_area / total_area
+
+        # 4. 利用可能水量
+        evapotranspiration_amount = params['evapotranspiration_amount'] * (1 + (temp - base_temp) * 0.05)
+        available_water = np.minimum(
+            np.maximum(
+                available_water + precip - evapotranspiration_amount - municipal_demand
+                - params['runoff_coef'] * precip + water_retention_boost * precip,
+                0
+            ),
+            params['max_available_water']
+        )
+
+        # 5. 農業生産量
+        temp_ripening = temp + 10.0
+        excess = np.maximum(temp_ripening - (temp_threshold_crop + high_temp_tolerance_level), 0)
+        temp_impact = np.minimum(excess / (params['temp_critical_crop'] - temp_threshold_crop), 1)
+        paddy_dam_area = paddy_dam_area + d['paddy_dam_construction_cost'] / params['paddy_dam_cost_per_ha']
+        paddy_dam_ratio = np.minimum(paddy_dam_area / paddy_field_area, 1)
+        paddy_dam_yield_impact = params['paddy_dam_yield_coef'] * paddy_dam_ratio
+        water_impact = np.minimum(available_water / params['necessary_water_for_crops'], 1.0)
+        crop_yield = np.maximum(params['max_potential_yield'] * (1 - temp_impact) * water_impact * (1 - paddy_dam_yield_impact), 0)
+        available_water = np.maximum(available_water - params['necessary_water_for_crops'], 0)
+
+        # 5.2 農業R&D
+        RnD_investment_total = RnD_investment_total + d['agricultural_RnD_cost']
+        RnD_threshold = params['RnD_investment_threshold'] * params['RnD_investment_required_years']
+        RnD_threshold_with_noise = RnD_threshold + params['RnD_investment_threshold'] * 0.1 * z[:, 1]
+        rnd_done = RnD_investment_total >= RnD_threshold_with_noise
+        high_temp_tolerance_level = np.where(rnd_done, high_temp_tolerance_level + params['high_temp_tolerance_increment'], high_temp_tolerance_level)
+        RnD_investment_total = np.where(rnd_done, 0.0, RnD_investment_total)
+
+        # 6. 住宅の移転
+        total_house = risky_house_total + non_risky_house_total
+        risky_house_total = np.maximum(risky_house_total - d['house_migration_amount'] + total_house * municipal_growth, 0)
+        non_risky_house_total = non_risky_house_total + d['house_migration_amount']
+        migration_ratio = non_risky_house_total / total_house
+
+        # 7.1 堤防
+        levee_investment_total = levee_investment_total + d['dam_levee_construction_cost']
+        levee_threshold = params['levee_investment_threshold'] * params['levee_investment_required_years']
+        levee_threshold_with_noise = levee_threshold + params['levee_investment_threshold'] * 0.1 * z[:, 2]
+        levee_done = levee_investment_total >= levee_threshold_with_noise
+        levee_level = np.where(levee_done, levee_level + params['levee_level_increment'], levee_level)
+        levee_investment_total = np.where(levee_done, levee_investment_total - levee_threshold_with_noise, levee_investment_total)
+
+        # 7.2 水害（参照実装と同じく、その年の最後のイベントの被害が残る）
+        paddy_dam_level = params['paddy_dam_flood_coef'] * paddy_dam_ratio
+        flood_damage = event_flood_damage(last_rain[:, t], extreme_precip_events > 0, levee_level, paddy_dam_level,
+                                          flood_reduction, resident_capacity, migration_ratio, params['flood_damage_coefficient'])
+        crop_yield = crop_yield - flood_damage * params['flood_crop_damage_coef']
+
+        # 8. 生態系の評価
+        ecological_base = 0.5 * np.minimum(forest_area / total_area, 1.0) + 0.5 * np.minimum(available_water / params['ecosystem_threshold'], 1.0)
+        disturbance_resistance = np.maximum(0, 1.0 - 0.05 * np.abs(temp - base_temp) - 0.03 * extreme_precip_events)
+        human_pressure = 1.0 - np.minimum(0.01 * levee_level, 1.0)
+        weights = noise['weights'][:, t]
+        ecosystem_level = (weights[:, 0] * ecological_base + weights[:, 1] * disturbance_resistance + weights[:, 2] * human_pressure) * 100
+
+        # 9. 都市の居住可能性
+        transportation_level = transportation_level * 0.95 + params['transport_level_coef'] * d['transportation_invest'] - 0.01
+        urban_level = params['distance_urban_level_coef'] * (1 - migration_ratio) * transportation_level
+        urban_level = np.clip(urban_level - flood_damage * params['flood_urban_damage_coef'], 0, 100)
+
+        # 10. 住民の防災能力・意識
+        resident_capacity = np.minimum(0.99, np.maximum(0.0, resident_capacity * (1 - params['resident_capacity_degrade_ratio'])
+                                                        + d['capacity_building_cost'] * params['capacity_building_coefficient']))
+
+        # 11. コスト・住民負担
+        municipal_cost = d['dam_levee_construction_cost'] * 100_000_000 \
+            + d['agricultural_RnD_cost'] * 10_000_000 \
+            + d['paddy_dam_construction_cost'] * 1_000_000 \
+            + d['capacity_building_cost'] * 1_000_000 \
+            + d['planting_trees_amount'] * params['cost_per_1000trees'] \
+            + d['house_migration_amount'] * params['cost_per_migration'] \
+            + d['transportation_invest'] * 10_000_000
+        resident_burden = municipal_cost / total_house + flood_damage * params['flood_recovery_cost_coef'] / total_house
+
+        # --- 出力 ---
+        columns['Year'][:, t] = year
+        columns['Temperature (℃)'][:, t] = temp
+        columns['Precipitation (mm)'][:, t] = precip
+        columns['Available Water'][:, t] = available_water
+        columns['Crop Yield'][:, t] = crop_yield
+        columns['Municipal Demand'][:, t] = municipal_demand
+        columns['Flood Damage'][:, t] = flood_damage
+        columns['Levee Level'][:, t] = levee_level
+        columns['High Temp Tolerance Level'][:, t] = high_temp_tolerance_level
+        columns['Hot Days'][:, t] = hot_days
+        columns['Extreme Precip Frequency'][:, t] = extreme_precip_freq
+        columns['Extreme Precip Events'][:, t] = extreme_precip_events
+        columns['Ecosystem Level'][:, t] = ecosystem_level
+        columns['Municipal Cost'][:, t] = municipal_cost
+        columns['Urban Level'][:, t] = urban_level
+        columns['Resident Burden'][:, t] = resident_burden
+        columns['Levee investment total'][:, t] = levee_investment_total
+        columns['RnD investment total'][:, t] = RnD_investment_total
+        columns['Resident capacity'][:, t] = resident_capacity
+        columns['Forest Area'][:, t] = forest_area
+        columns['risky_house_total'][:, t] = risky_house_total
+        columns['non_risky_house_total'][:, t] = non_risky_house_total
+        columns['transportation_level'][:, t] = transportation_level
+        columns['paddy_dam_area'][:, t] = paddy_dam_area
+
+    # 意思決定変数の列はアンサンブル共通
+    out[:, :, len(OUTPUT_COLUMNS) - len(DECISION_KEYS):] = schedule
+
+    return out
+
+
+def planting_snapshots(years, initial_values, decision_vars_list, params):
+    """各年の行に載せる planting_history（その年のリングバッファの wire 形式）。アンサンブル共通なので年ごとに1つだけ作る"""
+    snapshots = []
+    history = PlantingRing.from_value(initial_values.get('planting_history'), params['tree_growup_year'])
+    schedule = compile_decisions(decision_vars_list, years, params['start_year'])
+    planting = schedule[:, DECISION_KEYS.index('planting_trees_amount')]
+    for year, amount in zip(years, planting):
+        history.record(year, float(amount))
+        snapshots.append(history.to_wire())
+    return snapshots
+
+
+def ensemble_to_frame(out, planting_history=None, sim_offset=0):
+    """simulate_ensemble の出力を、simulate_simulation を繰り返した場合と同じ行形式の DataFrame にする
+
+    数値列は out をコピーせずに参照する（整数列だけは int に変換する）。
+    """
+    n, n_years, n_cols = out.shape
+    df = pd.DataFrame(out.reshape(n * n_years, n_cols), columns=OUTPUT_COLUMNS, copy=False)
+    for col in INTEGER_COLUMNS:
+        df[col] = df[col].astype(np.int64)
+    if planting_history is not None:
+        df.insert(OUTPUT_COLUMNS.index('Forest Area') + 1, 'planting_history', planting_history * n)
+    df['Simulation'] = np.repeat(np.arange(sim_offset, sim_offset + n), n_years)
+    return df
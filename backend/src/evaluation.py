@@ -0,0 +1,114 @@
+# evaluation.py
+#
+# パラメータの値や意思決定スケジュールだけが違う多数の「変種」を、共通乱数のアンサンブルでまとめて評価する。
+# 感度分析（sensitivity.py）や政策の最適化で、1点ずつ simulate_ensemble を呼ぶ代わりに使う。
+#
+# 変種 j の replicates 本は、シミュレーション番号 j * replicates + r に並べ、r 本目にはどの変種でも
+# 同じ乱数（気候外力・それ以外のノイズ）を使う。変種間の差に乱数のばらつきが混ざらないので、少ない本数で比較できる。
+# simulate_ensemble はシミュレーションごとのパラメータ・スケジュールを受け付けるので、全変種を1回のバッチで計算する。
+
+import numpy as np
+
+from decisions import DECISION_KEYS, compile_decisions
+from ensemble import draw_noise, simulate_ensemble
+from forcing import FORCING_PARAMS, concat_forcing, generate_forcing, generate_variant_forcing
+from metrics import tracked_metrics
+
+# 配列にできないパラメータ（期間や植林リングの長さなど、計算の構造を決めるもの）
+STRUCTURAL_PARAMS = ('start_year', 'end_year', 'years', 'tree_growup_year')
+
+# 期間ごとの total_score の平均（/ranking と同じ集計）の指標名
+MEAN_SCORE = "block:mean"
+
+# 1回のバッチで計算するシミュレーション数の上限（出力配列のメモリを抑える）
+EVALUATION_CHUNK_SIMS = 2048
+
+
+def is_variable_param(params, name):
+    """name が変種ごとに変えられるパラメータか（数値のスカラーで、構造を決めるものでない）"""
+    return (name in params and name not in STRUCTURAL_PARAMS
+            and isinstance(params[name], (int, float)) and not isinstance(params[name], bool))
+
+
+def evaluate_variants(years, initial_values, decision_vars_list, params, seed, replicates,
+                      param_values=None, schedules=None, sampling="random", metrics_fn=tracked_metrics):
+    """変種ごとの指標の平均を (指標名のリスト, 変種数 × 指標数 の配列) で返す
+
+    param_values は {パラメータ名: 変種ごとの値 (m,)}、schedules は変種ごとの意思決定スケジュール
+    (m × 年 × len(DECISION_KEYS))。どちらもなければ decision_vars_list / params のまま。
+    指標は metrics_fn（既定は metrics.tracked_metrics。シナリオ指標と期間ごとの total_score）に MEAN_SCORE を加えたもの。
+    """
+    years = np.asarray(years)
+    param_values = {name: np.asarray(values, dtype=np.float64) for name, values in (param_values or {}).items()}
+    if schedules is not None:
+        m = len(schedules)
+    elif param_values:
+        m = len(next(iter(param_values.values())))
+    else:
+        m = 1
+    replicates = int(replicates)
+
+    per_sim = dict(params)
+    for name, values in param_values.items():
+        per_sim[name] = np.repeat(values, replicates)
+    if schedules is None:
+        schedule = compile_decisions(decision_vars_list, years, params['start_year'])
+    else:
+        schedule = np.repeat(np.asarray(schedules, dtype=np.float64), replicates, axis=0)
+
+    # r 本目の乱数はすべての変種で共通（共通乱数）
+    noise = draw_noise(seed, 0, replicates, len(years), sampling)
+    noise = {key: np.tile(values, (m, 1, 1)) for key, values in noise.items()}
+    forcing_values = {name: values for name, values in param_values.items() if name in FORCING_PARAMS}
+    if forcing_values:
+        # 気候外力のパラメータを変える場合は、共通のノイズに変種ごとのパラメータを当てて一度に作る
+        forcing = generate_variant_forcing(years, params, seed, replicates, forcing_values, sampling=sampling)
+    else:
+        forcing = concat_forcing([generate_forcing(years, params, seed, replicates, sampling=sampling)] * m)
+
+    array = simulate_ensemble(years, initial_values, schedule, per_sim, forcing, noise)
+    names, values = metrics_fn(array)
+    means = values.reshape(m, replicates, len(names)).mean(axis=1)
+    blocks = [i for i, name in enumerate(names) if name.startswith("block:")]
+    names = names + [MEAN_SCORE]
+    means = np.column_stack([means, means[:, blocks].mean(axis=1) if blocks else np.full(m, np.nan)])
+    return names, means
+
+
+def evaluate_in_pool(pool, years, initial_values, decision_vars_list, params, seed, replicates,
+                     param_values=None, schedules=None, sampling="random", metrics_fn=tracked_metrics):
+    """evaluate_variants を EVALUATION_CHUNK_SIMS 本ずつの塊に分けて、ワーカープールで並列に計算する"""
+    param_values = {name: np.asarray(values, dtype=np.float64) for name, values in (param_values or {}).items()}
+    if schedules is not None:
+        m = len(schedules)
+    elif param_values:
+        m = len(next(iter(param_values.values())))
+    else:
+        m = 1
+    step = max(1, EVALUATION_CHUNK_SIMS // max(1, int(replicates)))
+    tasks = []
+    for start in range(0, m, step):
+        stop = min(start + step, m)
+        tasks.append((
+            years, initial_values, decision_vars_list, params, seed, replicates,
+            {name: values[start:stop] for name, values in param_values.items()},
+            None if schedules is None else schedules[start:stop],
+            sampling,
+            metrics_fn,
+        ))
+    results = pool.map(evaluate_variants, tasks)
+    names = results[0][0]
+    return names, np.concatenate([means for _, means in results])
+
+
+def constant_schedules(decision_vars_list, years, start_year, overrides):
+    """基準のスケジュールの一部の意思決定変数を、変種ごとに全期間一定の値で置き換えたスケジュール
+
+    overrides は {意思決定変数名: 変種ごとの値 (m,)}。戻り値は (m × 年 × len(DECISION_KEYS))。
+    """
+    base = compile_decisions(decision_vars_list, years, start_year)
+    m = len(next(iter(overrides.values())))
+    schedules = np.repeat(base[np.newaxis], m, axis=0)
+    for name, values in overrides.items():
+        schedules[:, :, DECISION_KEYS.index(name)] = np.asarray(values, dtype=np.float64)[:, np.newaxis]
+    return schedules
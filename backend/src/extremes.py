@@ -0,0 +1,120 @@
+# extremes.py
+#
+# 極端降水イベントと水害のカーネル。
+# イベント数（Poisson）と降水量（Gumbel、一様乱数からの逆関数法）を全シミュレーション × 全年分まとめて引き、
+# 水害は配列のまま（イベントの有無をマスクにして）計算する。参照実装（simulation.py）とバッチ版（ensemble.py）で共用する。
+# 重点サンプリング（極端降水を起こりやすくした提案分布）の尤度比もここで計算する。
+
+import numpy as np
+
+
+def gumbel_inverse_cdf(rng, loc, scale, size=None):
+    """Gumbel 分布の乱数を逆関数法で引く
+
+    numpy の gumbel と同じく U = 1 - random() から loc - scale * log(-log(U)) を計算するので、
+    同じ Generator からは rng.gumbel(loc, scale, size) と同じ値になる（U == 1 の棄却を除く）。
+    """
+    u = 1.0 - rng.random(size)
+    return loc - scale * np.log(-np.log(u))
+
+
+def draw_extreme_events(rng, freq, mu, beta, num_simulations):
+    """年ごとの頻度 freq と Gumbel の mu / beta（いずれも長さ = 年数）から、全シミュレーション分のイベントを引く
+
+    戻り値は (events, rain)。events は (シミュレーション × 年) のイベント数、rain はイベントごとの降水量を (シミュレーション, 年, イベント) の順に並べた1次元配列（ragged）。
+    """
+    n_years = len(freq)
+    events = rng.poisson(freq, (num_simulations, n_years))
+    event_year = np.repeat(np.tile(np.arange(n_years), num_simulations), events.ravel())
+    rain = gumbel_inverse_cdf(rng, mu[event_year], beta[event_year], len(event_year))
+    return events, rain
+
+
+def poisson_inverse_cdf(u, lam):
+    """一様乱数 u（0 以上 1 未満）から Poisson(lam) の値を逆関数法で求める（u と lam はブロードキャストする）"""
+    u, lam = np.broadcast_arrays(np.asarray(u, dtype=np.float64), np.asarray(lam, dtype=np.float64))
+    k = np.zeros(u.shape, dtype=np.int64)
+    p = np.exp(-lam)
+    cdf = p.copy()
+    active = u >= cdf
+    while active.any():
+        k[active] += 1
+        p[active] *= lam[active] / k[active]
+        cdf[active] += p[active]
+        # 丸めで cdf が u に届かないまま確率が 0 になったら打ち切る
+        active &= (u >= cdf) & (p > 0)
+    return k
+
+
+def draw_coupled_extreme_events(rng, freq, mu, beta, num_simulations):
+    """頻度・mu・beta だけが違う m 個の変種（いずれも m × 年数）のイベントを、変種間で共通の一様乱数から引く
+
+    (シミュレーション, 年) ごとの一様乱数からイベント数を、(シミュレーション, 年, イベント) ごとの一様乱数から
+    降水量を逆関数法で求めるので、パラメータの近い変種は近いイベントになる。
+    戻り値は (events, rain)。events は (m × シミュレーション × 年)、rain は (変種, シミュレーション, 年, イベント) の順の1次元配列。
+    """
+    n_years = freq.shape[1]
+    events = poisson_inverse_cdf(rng.random((num_simulations, n_years))[np.newaxis], freq[:, np.newaxis, :])
+    max_events = int(events.max()) if events.size else 0
+    # gumbel_inverse_cdf と同じ U = 1 - random() からの標準 Gumbel
+    standard = -np.log(-np.log(1.0 - rng.random((num_simulations, n_years, max_events))))
+    rain = mu[:, np.newaxis, :, np.newaxis] + beta[:, np.newaxis, :, np.newaxis] * standard[np.newaxis]
+    return events, rain[np.arange(max_events) < events[..., np.newaxis]]
+
+
+def flood_damage(rain, has_event, levee_level, paddy_dam_level, flood_reduction,
+                 resident_capacity, migration_ratio, flood_damage_coefficient):
+    """降水量 rain（任意の形の配列）に対する水害額。has_event が False の要素は 0
+
+    参照実装と同じく、その年の被害は最後のイベントで決まるので、rain には各年の最後のイベントの降水量を渡す。
+    """
+    overflow_amount = np.maximum(rain - levee_level - paddy_dam_level, 0) * (1 - flood_reduction)
+    flood_impact = overflow_amount * flood_damage_coefficient
+    # 対策効果は災害規模により段階的に変化（S字カーブ）。400mm超過で能力無効に近づく
+    response_factor = 1 / (1 + np.exp(-0.1 * (overflow_amount - 400)))
+    effective_protection = (1 - resident_capacity * (1 - response_factor)) * (1 - migration_ratio * (1 - response_factor))
+    return np.where(has_event, np.maximum(flood_impact + flood_impact * effective_protection, 0.0), 0.0)
+
+
+
+def tilted_event_params(freq, mu, beta, freq_scale, min_freq, loc_shift):
+    """重点サンプリングで極端降水を起こりやすくした分布の (頻度, 最後のイベントの Gumbel 位置)
+
+    頻度は max(freq × freq_scale, min_freq)、最後のイベントの位置は mu + loc_shift × beta。
+    """
+    return np.maximum(freq * freq_scale, min_freq), mu + loc_shift * beta
+
+
+def draw_tilted_extreme_events(rng, freq, mu, beta, num_simulations, freq_scale, min_freq, loc_shift, mix):
+    """重点サンプリング用に、(シミュレーション × 年) ごとに確率 mix で傾けた分布から、残りは元の分布からイベントを引く
+
+    水害はその年の最後のイベントで決まるので、位置をずらすのは最後のイベントだけ。
+    提案分布は元の分布との混合なので、尤度比（元の分布 / 提案分布）は 1 / (1 - mix) 以下に収まる
+    （Gumbel の位置を単純にずらすと、左裾で尤度比の分散が発散する）。
+    戻り値は (events, rain, log_weight)。events と rain は draw_extreme_events と同じ形、
+    log_weight は (シミュレーション × 年) ごとの尤度比の対数。
+    """
+    n_years = len(freq)
+    freq_q, mu_q = tilted_event_params(freq, mu, beta, freq_scale, min_freq, loc_shift)
+    tilted = rng.random((num_simulations, n_years)) < mix
+    events = rng.poisson(np.where(tilted, freq_q, freq))
+    counts = events.ravel()
+    has_event = counts > 0
+    event_year = np.repeat(np.tile(np.arange(n_years), num_simulations), counts)
+    last = np.cumsum(counts)[has_event] - 1
+    loc = mu[event_year]
+    loc[last] = np.where(tilted.ravel()[has_event], mu_q[event_year[last]], loc[last])
+    rain = gumbel_inverse_cdf(rng, loc, beta[event_year], len(event_year))
+
+    # 傾けた分布と元の分布の密度比 log(p' / p)：Poisson の比 + 最後のイベントの Gumbel の比
+    with np.errstate(divide='ignore'):
+        log_rate = np.where(freq > 0, np.log(freq_q / freq), np.inf)
+    log_ratio = np.where(events > 0, events * log_rate, 0.0) - (freq_q - freq)
+    log_ratio = log_ratio.ravel()
+    year = event_year[last]
+    z = (rain[last] - mu[year]) / beta[year]
+    z_q = (rain[last] - mu_q[year]) / beta[year]
+    log_ratio[has_event] += (z + np.exp(-z)) - (z_q + np.exp(-z_q))
+    # p / ((1 - mix) p + mix p') = 1 / ((1 - mix) + mix × p' / p)
+    log_weight = -np.logaddexp(np.log1p(-mix), np.log(mix) + log_ratio)
+    return events, rain, log_weight.reshape(num_simulations, n_years)
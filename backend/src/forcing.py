@@ -0,0 +1,234 @@
+# forcing.py
+#
+# 気候外力（気温・降水量・高温日数・極端降水イベント数・イベントごとの降水量）の事前生成。
+# これらは意思決定変数に依存しないので、(RCP, seed, N) ごとに全年 × 全シミュレーション分を
+# まとめて引き、LRU キャッシュに保持する。同じ seed で政策を比べると共通乱数になる。
+#
+# イベントごとの降水量は (シミュレーション, 年, イベント) の順に並べた1次元配列（ragged）で持ち、
+# 各 (シミュレーション, 年) のイベント数は events に入っている。
+# 重点サンプリングの場合は、年ごとの尤度比の対数 log_weight (シミュレーション × 年) も持つ。
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from extremes import draw_coupled_extreme_events, draw_extreme_events, draw_tilted_extreme_events
+from sampling import FORCING_DESIGN, standard_normal, uniform_design
+
+# SeedSequence(seed) の子のうち、気候外力に使う番号（シミュレーションごとの系列は ensemble.SIMULATION_STREAM）
+FORCING_STREAM = 0
+# 気候外力のパラメータだけが違う変種の極端降水（generate_variant_forcing）に使う番号
+VARIANT_EVENT_STREAM = 3
+
+FORCING_KEYS = ['temp', 'precip', 'hot_days', 'events', 'rain']
+# 重点サンプリングのときだけ加わるキー
+LOG_WEIGHT_KEY = 'log_weight'
+
+# 気候外力の生成に使うパラメータ（これ以外のパラメータを変えても気候外力は同じ）
+FORCING_PARAMS = (
+    'start_year', 'base_temp', 'temp_trend', 'temp_uncertainty',
+    'base_precip', 'precip_trend', 'base_precip_uncertainty', 'precip_uncertainty_trend',
+    'initial_hot_days', 'temp_to_hot_days_coeff', 'hot_days_uncertainty',
+    'base_extreme_precip_freq', 'extreme_precip_freq_trend', 'base_mu', 'base_beta', 'extreme_precip_intensity_trend',
+)
+# そのうち極端降水に効くもの（それ以外は気温・降水量・高温日数だけに効く）
+EVENT_PARAMS = (
+    'start_year', 'base_extreme_precip_freq', 'extreme_precip_freq_trend', 'base_mu', 'base_beta',
+    'extreme_precip_intensity_trend',
+)
+
+# この本数ごとに独立した系列から引く（端数のブロックも全本数を引いてから切り出す）
+FORCING_BLOCK = 256
+
+
+def generate_forcing(years, params, seed, num_simulations, sim_start=0, sampling="random", tilt=None):
+    """シミュレーション [sim_start, sim_start + num_simulations) × 全年の気候外力をまとめて引く
+
+    FORCING_BLOCK 本ずつ独立した系列から引くので、シミュレーション i の気候外力は (seed, i) だけで決まり、
+    N や、どこから切り出して生成したかによらない（ストリーミング集計で塊ごとに生成しても同じ値になる）。
+    sampling が random 以外なら、気温・降水量・高温日数のノイズを sampling.uniform_design の計画から作る
+    （極端降水イベントは同じ擬似乱数のままなので、方式を変えてもイベントは共通）。
+    tilt = (freq_scale, min_freq, loc_shift, mix) なら極端降水を重点サンプリングの提案分布
+    （extremes.draw_tilted_extreme_events）から引き、log_weight を付ける。
+    """
+    sim_stop = sim_start + int(num_simulations)
+    first_block = sim_start // FORCING_BLOCK
+    last_block = max(first_block + 1, -(-sim_stop // FORCING_BLOCK))
+    z = _design_noise(years, seed, first_block, last_block, sampling)
+    blocks = []
+    for block in range(first_block, last_block):
+        start = (block - first_block) * FORCING_BLOCK
+        blocks.append(_generate_block(years, params, seed, block, None if z is None else z[start:start + FORCING_BLOCK], tilt))
+    forcing = blocks[0] if len(blocks) == 1 else concat_forcing(blocks)
+    offset = first_block * FORCING_BLOCK
+    return slice_forcing(forcing, sim_start - offset, sim_stop - offset)
+
+
+def _design_noise(years, seed, first_block, last_block, sampling):
+    # sampling が random 以外のとき、ブロック [first_block, last_block) の気温・降水量・高温日数のノイズ（本数 × 3 × 年数）
+    if sampling == "random":
+        return None
+    n_years = len(years)
+    z = standard_normal(uniform_design(sampling, seed, FORCING_DESIGN, first_block * FORCING_BLOCK,
+                                       last_block * FORCING_BLOCK, 3 * n_years))
+    return z.reshape(-1, 3, n_years)
+
+
+def _block_rng(seed, block):
+    return np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(FORCING_STREAM, block))))
+
+
+def _block_noise(rng, n_years, z=None):
+    # 気温・降水量・高温日数のノイズ。計画を使う場合も擬似乱数は同じだけ進めて、イベントを共通にする
+    noise = [rng.standard_normal((FORCING_BLOCK, n_years)) for _ in range(3)]
+    if z is not None:
+        noise = [z[:, k] for k in range(3)]
+    return noise
+
+
+def weather(years, params, noise):
+    """ノイズ3つから気温・降水量・高温日数（simulate_year と同じ式）。パラメータは配列でもよい（ブロードキャストする）"""
+    elapsed = np.asarray(years) - params['start_year']
+    base_temp = params['base_temp']
+    temp = base_temp + params['temp_trend'] * elapsed + params['temp_uncertainty'] * noise[0]
+    precip_unc = params['base_precip_uncertainty'] + params['precip_uncertainty_trend'] * elapsed
+    precip = np.maximum(0, params['base_precip'] + params['precip_trend'] * elapsed + precip_unc * noise[1])
+    hot_days = params['initial_hot_days'] + (temp - base_temp) * params['temp_to_hot_days_coeff'] \
+        + params['hot_days_uncertainty'] * noise[2]
+    return temp, precip, np.maximum(hot_days, 0)
+
+
+def _event_params(years, params):
+    # 極端降水の年ごとの頻度と Gumbel の mu / beta
+    elapsed = np.asarray(years) - params['start_year']
+    freq = np.maximum(params['base_extreme_precip_freq'] + params['extreme_precip_freq_trend'] * elapsed, 0)
+    mu = np.maximum(params['base_mu'] + params['extreme_precip_intensity_trend'] * elapsed, 0)
+    beta = np.maximum(params['base_beta'] + params['extreme_precip_intensity_trend'] * elapsed, 0)
+    return freq, mu, beta
+
+
+def _generate_block(years, params, seed, block, z=None, tilt=None):
+    """block 番目の FORCING_BLOCK 本分の気候外力。z（FORCING_BLOCK × 3 × 年数）があれば気温・降水量・高温日数のノイズに使う"""
+    rng = _block_rng(seed, block)
+    years = np.asarray(years)
+    n = FORCING_BLOCK
+
+    # 1. 気象環境
+    temp, precip, hot_days = weather(years, params, _block_noise(rng, len(years), z))
+
+    # 極端降水：イベント数（Poisson）とイベントごとの降水量（Gumbel）
+    freq, mu, beta = _event_params(years, params)
+    if tilt is None:
+        events, rain = draw_extreme_events(rng, freq, mu, beta, n)
+        return {'temp': temp, 'precip': precip, 'hot_days': hot_days, 'events': events, 'rain': rain}
+
+    events, rain, log_weight = draw_tilted_extreme_events(rng, freq, mu, beta, n, *tilt)
+    return {'temp': temp, 'precip': precip, 'hot_days': hot_days, 'events': events, 'rain': rain, LOG_WEIGHT_KEY: log_weight}
+
+
+def generate_variant_forcing(years, params, seed, replicates, variant_params, sampling="random"):
+    """気候外力のパラメータだけが違う m 個の変種の、それぞれ replicates 本の気候外力（変種 j の r 本目が j * replicates + r 本目）
+
+    variant_params は {パラメータ名: 変種ごとの値 (m,)}。ノイズは一度だけ引き、変種ごとのパラメータはブロードキャストで当てる。
+    気温・降水量・高温日数は、変種 j のパラメータで generate_forcing(years, ..., seed, replicates) を呼んだのと同じ値になる。
+    極端降水のパラメータ（EVENT_PARAMS）を変えない場合、イベントはすべての変種で generate_forcing と同じもの、
+    変える場合は変種間で共通の一様乱数から逆関数法で引く（extremes.draw_coupled_extreme_events）。
+    """
+    years = np.asarray(years)
+    n_years = len(years)
+    replicates = int(replicates)
+    m = len(next(iter(variant_params.values())))
+    varied = dict(params)
+    for name, values in variant_params.items():
+        varied[name] = np.asarray(values, dtype=np.float64)[:, np.newaxis, np.newaxis]
+
+    # シミュレーション [0, replicates) のノイズ（generate_forcing と同じブロックの同じ系列）
+    last_block = max(1, -(-replicates // FORCING_BLOCK))
+    z = _design_noise(years, seed, 0, last_block, sampling)
+    blocks = [_block_noise(_block_rng(seed, block), n_years,
+                           None if z is None else z[block * FORCING_BLOCK:(block + 1) * FORCING_BLOCK])
+              for block in range(last_block)]
+    noise = [np.concatenate([block[k] for block in blocks])[:replicates] for k in range(3)]
+    temp, precip, hot_days = (np.broadcast_to(values, (m, replicates, n_years)).reshape(m * replicates, n_years)
+                              for values in weather(years, varied, noise))
+
+    if any(name in EVENT_PARAMS for name in variant_params):
+        freq, mu, beta = (np.broadcast_to(values, (m, 1, n_years)).reshape(m, n_years)
+                          for values in _event_params(years, varied))
+        rng = np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(VARIANT_EVENT_STREAM,))))
+        events, rain = draw_coupled_extreme_events(rng, freq, mu, beta, replicates)
+        events = events.reshape(m * replicates, n_years)
+    else:
+        base = generate_forcing(years, params, seed, replicates, sampling=sampling)
+        events, rain = np.tile(base['events'], (m, 1)), np.tile(base['rain'], m)
+    return {'temp': temp, 'precip': precip, 'hot_days': hot_days, 'events': events, 'rain': rain}
+
+
+def concat_forcing(parts):
+    """シミュレーション方向に連結する"""
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def slice_forcing(forcing, sim_start, sim_stop):
+    """シミュレーション [sim_start, sim_stop) の分だけを取り出す（ワーカーに渡す塊用）"""
+    counts = forcing['events'].sum(axis=1)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    sliced = {key: forcing[key][sim_start:sim_stop] for key in forcing if key != 'rain'}
+    sliced['rain'] = forcing['rain'][offsets[sim_start]:offsets[sim_stop]]
+    return sliced
+
+
+def last_event_rain(forcing):
+    """各 (シミュレーション, 年) の最後のイベントの降水量（イベントがなければ 0）"""
+    events = forcing['events']
+    counts = events.ravel()
+    last_rain = np.zeros(counts.shape)
+    has_event = counts > 0
+    last_rain[has_event] = forcing['rain'][np.cumsum(counts)[has_event] - 1]
+    return last_rain.reshape(events.shape)
+
+
+class ForcingCache:
+    """(RCP, seed, N, 期間, サンプリング方式, 重点サンプリングの傾け方) をキーに気候外力を保持する LRU キャッシュ"""
+
+    def __init__(self, maxsize):
+        self._maxsize = max(0, int(maxsize))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, rcp, seed, num_simulations, years, params, sampling="random", tilt=None):
+        key = (rcp, seed, int(num_simulations), int(years[0]), int(years[-1]), sampling, tilt) if len(years) else None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+
+        forcing = generate_forcing(years, params, seed, num_simulations, sampling=sampling, tilt=tilt)
+        # 複数リクエストで共有するので書き込み不可にしておく
+        for value in forcing.values():
+            value.flags.writeable = False
+
+        with self._lock:
+            if self._maxsize > 0:
+                self._entries[key] = forcing
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._maxsize:
+                    self._entries.popitem(last=False)
+        return forcing
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self._maxsize,
+            "hits": self._hits,
+            "misses": self._misses,
+        }
@@ -0,0 +1,176 @@
+# leaderboard.py
+#
+# /ranking のためのメモリ上の順位表。ユーザーごとの total_score の平均（ScoreStore.ranking と同じ値）を、
+# 部分木の大きさを持つ treap（キーは (-平均点, ユーザー名)）で持つので、
+# 1ユーザーの更新・「X さんの順位」・上位 K 人は O(log n)（上位 K 人は + K）で答える。
+#
+# 期間スコアを書き込むたびに、その書き込みで進んだ保存先の版（ScoreStore.scores_version）と一緒に
+# そのユーザーの平均点だけを差し替える。版が1つずつ進んでいない（別のプロセスやスレッドの書き込みを見落とした、
+# 消去・取り込みがあった）ときは古い表として扱い、次の読み込みで保存先から作り直す。
+
+import random
+import threading
+
+
+class _Node:
+    __slots__ = ("key", "priority", "left", "right", "size")
+
+    def __init__(self, key, priority):
+        self.key = key
+        self.priority = priority
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    return node
+
+
+def _merge(left, right):
+    # left のキーはすべて right のキーより小さい
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _split(node, count):
+    # 先頭の count 個と残りに分ける
+    if node is None:
+        return None, None
+    if _size(node.left) >= count:
+        left, node.left = _split(node.left, count)
+        return left, _update(node)
+    node.right, right = _split(node.right, count - _size(node.left) - 1)
+    return _update(node), right
+
+
+def _count_less(node, key):
+    # key より小さいキーの数
+    count = 0
+    while node is not None:
+        if node.key < key:
+            count += _size(node.left) + 1
+            node = node.right
+        else:
+            node = node.left
+    return count
+
+
+def _first(node, count):
+    # 先頭の count 個のキー（中順）
+    keys = []
+    stack = []
+    while (stack or node is not None) and len(keys) < count:
+        if node is not None:
+            stack.append(node)
+            node = node.left
+        else:
+            node = stack.pop()
+            keys.append(node.key)
+            node = node.right
+    return keys
+
+
+class Leaderboard:
+    """ユーザーごとの平均点の順位表（順位は 1 から。同点はユーザー名順）"""
+
+    def __init__(self, seed=0):
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._root = None
+        self._scores = {}
+        # 反映済みの保存先の版（None は未構築か古い）
+        self._version = None
+        # 全件の /ranking の結果（更新のたびに捨てる）
+        self._cached = None
+
+    @staticmethod
+    def _key(user_name, score):
+        return (-score, user_name)
+
+    def _insert(self, user_name, score):
+        key = self._key(user_name, score)
+        left, right = _split(self._root, _count_less(self._root, key))
+        self._root = _merge(_merge(left, _Node(key, self._random.random())), right)
+        self._scores[user_name] = score
+
+    def _remove(self, user_name):
+        score = self._scores.pop(user_name)
+        left, right = _split(self._root, _count_less(self._root, self._key(user_name, score)))
+        _, right = _split(right, 1)
+        self._root = _merge(left, right)
+
+    def _set(self, user_name, score):
+        if user_name in self._scores:
+            self._remove(user_name)
+        if score is not None:
+            self._insert(user_name, float(score))
+        self._cached = None
+
+    def is_current(self, version):
+        with self._lock:
+            return self._version is not None and self._version == version
+
+    def rebuild(self, ranking, version):
+        """ScoreStore.ranking() の結果から作り直す"""
+        with self._lock:
+            self._root = None
+            self._scores = {}
+            self._cached = None
+            for row in ranking:
+                if row["total_score"] is not None:
+                    self._insert(row["user_name"], float(row["total_score"]))
+            self._version = version
+
+    def update(self, user_name, score, version):
+        """1回の書き込み（版が version になった）の後のユーザーの平均点（行がなければ None）を反映する。
+        その前の版を反映していなければ古い表として扱い、False を返す"""
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                self._version = None
+                self._cached = None
+                return False
+            self._set(user_name, score)
+            self._version = version
+            return True
+
+    def ranking(self, top=None):
+        """上位 top 人（None なら全員）の {user_name, total_score, rank}"""
+        with self._lock:
+            if top is None and self._cached is not None:
+                return list(self._cached)
+            keys = _first(self._root, len(self._scores) if top is None else top)
+            rows = [{"user_name": user_name, "total_score": -score, "rank": i + 1}
+                    for i, (score, user_name) in enumerate(keys)]
+            if top is None:
+                self._cached = rows
+            return list(rows)
+
+    def rank_of(self, user_name):
+        """そのユーザーの {user_name, total_score, rank, total_users}（いなければ None）"""
+        with self._lock:
+            if user_name not in self._scores:
+                return None
+            score = self._scores[user_name]
+            return {
+                "user_name": user_name,
+                "total_score": score,
+                "rank": _count_less(self._root, self._key(user_name, score)) + 1,
+                "total_users": len(self._scores),
+            }
+
+    def status(self):
+        with self._lock:
+            return {"users": len(self._scores), "version": self._version}
@@ -0,0 +1,247 @@
+# lookup.py
+#
+# 意思決定変数の格子上で事前に計算した、期間スコアと軌跡の期待値の表（ファシリテーター用の即時プレビュー）。
+# RCP シナリオごとに、7つのレバーの格子点（既定は画面のスライダーの段階 0〜max × LEVER_UNITS）を
+# 全期間一定の意思決定として、画面の初期値（surrogate.REFERENCE_STATE）から共通乱数のアンサンブルで評価する
+# （evaluation.evaluate_in_pool）。
+#
+# 表は (RCP × 格子の各軸 × 出力) の float32 の .npy（メモリマップで開く）と、軸や出力名を書いた .json の組。
+# 問い合わせは最近傍の1点か、周りの格子点（最大 2^7 点）の多重線形補間なので、格子の大きさによらず一定時間で答える。
+# 格子にないレバーは 0 に固定し、問い合わせの値は無視する（ignored として返す）。
+
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from decisions import DECISION_KEYS
+from ensemble import OUTPUT_COLUMNS
+from evaluation import MEAN_SCORE, constant_schedules, evaluate_in_pool
+from metrics import block_total_scores
+from optimizer import LEVER_UNITS
+from surrogate import REFERENCE_STATE, SURROGATE_COLUMNS
+
+LOOKUP_METHODS = ["nearest", "linear"]
+# 表の値の型（期待値のプレビューには単精度で足りる）
+TABLE_DTYPE = np.float32
+# 1回の evaluate_in_pool で評価する格子点の数（進捗表示とメモリの単位）
+PRECOMPUTE_CHUNK_POINTS = 512
+
+
+def default_axes(lever_levels):
+    """画面のスライダーの段階（0〜max）に対応する送信値を各レバーの軸にする"""
+    return {key: [level * LEVER_UNITS[key] for level in range(int(lever_levels[key]) + 1)] for key in DECISION_KEYS}
+
+
+def normalize_axes(axes):
+    """{レバー名: 値のリスト または 段階数（整数）} から、7つのレバーすべての昇順の軸を作る。問題があれば ValueError
+
+    指定のないレバーは 0 だけの軸になる。段階数 k は 0〜k 段階（× LEVER_UNITS）。
+    """
+    unknown = [key for key in axes if key not in DECISION_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown levers: {unknown}")
+    normalized = {}
+    for key in DECISION_KEYS:
+        values = axes.get(key, [0.0])
+        if isinstance(values, int):
+            if values < 0:
+                raise ValueError(f"lever {key}: number of levels must be >= 0")
+            values = [level * LEVER_UNITS[key] for level in range(values + 1)]
+        values = sorted(set(float(v) for v in values))
+        if not values:
+            raise ValueError(f"lever {key}: at least one value is required")
+        normalized[key] = values
+    return normalized
+
+
+def table_fingerprint(default_params, rcp_params):
+    """表を作った時のパラメータのハッシュ（DEFAULT_PARAMS が変わったら古い表と分かるように）"""
+    payload = {
+        "params": {name: (value.tolist() if isinstance(value, np.ndarray) else value) for name, value in default_params.items()},
+        "rcp": {str(rcp): values for rcp, values in rcp_params.items()},
+        "reference": REFERENCE_STATE,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def table_metrics(array):
+    """表に入れる指標（evaluate_variants の metrics_fn）。期間ごとの total_score と、SURROGATE_COLUMNS の年ごとの値"""
+    totals = block_total_scores(array)
+    names = [f"block:{label}" for label in totals]
+    columns = list(totals.values())
+    years = array[0, :, OUTPUT_COLUMNS.index('Year')].astype(int) if len(array) else []
+    for column in SURROGATE_COLUMNS:
+        values = array[:, :, OUTPUT_COLUMNS.index(column)]
+        names.extend(f"trajectory:{column}:{year}" for year in years)
+        columns.extend(values.T)
+    return names, np.stack(columns, axis=1)
+
+
+def precompute_table(pool, path, default_params, rcp_params, axes, replicates=16, seed=0, progress=None):
+    """すべての RCP × 格子点を評価して path（.npy）と path.with_suffix('.json') に書き出し、メタ情報を返す
+
+    axes は normalize_axes の戻り値。書き込みは一時ファイルに行い、最後に置き換える（サーバーは古い表を読み続けられる）。
+    """
+    started = time.time()
+    path = Path(path)
+    rcps = sorted(float(rcp) for rcp in rcp_params)
+    shape = [len(axes[key]) for key in DECISION_KEYS]
+    points = np.array(list(itertools.product(*[axes[key] for key in DECISION_KEYS])))
+    years = np.asarray(default_params['years'])
+
+    temporary = path.with_name(path.stem + ".tmp.npy")
+    table = None
+    names = None
+    for r, rcp in enumerate(rcps):
+        params = dict(default_params, **rcp_params[rcp])
+        for start in range(0, len(points), PRECOMPUTE_CHUNK_POINTS):
+            chunk = points[start:start + PRECOMPUTE_CHUNK_POINTS]
+            schedules = constant_schedules([], years, params['start_year'],
+                                           {key: chunk[:, j] for j, key in enumerate(DECISION_KEYS)})
+            names, means = evaluate_in_pool(pool, years, REFERENCE_STATE, [], params, seed, replicates,
+                                            schedules=schedules, metrics_fn=table_metrics)
+            if table is None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                table = np.lib.format.open_memmap(temporary, mode='w+', dtype=TABLE_DTYPE,
+                                                  shape=(len(rcps), *shape, len(names)))
+            # 格子点は itertools.product の順（C 順）なので、軸をまとめた形で書き込める
+            table.reshape(len(rcps), len(points), len(names))[r, start:start + len(chunk)] = means
+            if progress is not None:
+                progress(rcp, start + len(chunk), len(points))
+    table.flush()
+    del table
+
+    meta = {
+        "rcps": rcps,
+        "levers": list(DECISION_KEYS),
+        "axes": axes,
+        "outputs": names,
+        "years": [int(year) for year in years],
+        "replicates": int(replicates),
+        "seed": seed,
+        "num_points": int(len(points)),
+        "num_runs": int(len(rcps) * len(points) * replicates),
+        "fingerprint": table_fingerprint(default_params, rcp_params),
+        "built_at": datetime.now().isoformat(),
+        "elapsed": time.time() - started,
+    }
+    meta_path = path.with_suffix(".json")
+    meta_temporary = meta_path.with_name(meta_path.name + ".tmp")
+    meta_temporary.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    # 表とメタ情報は別々に置き換わるので、読み込み側（ScoreTable）は形が揃うまで古い組を使い続ける
+    os.replace(temporary, path)
+    os.replace(meta_temporary, meta_path)
+    return meta
+
+
+class ScoreTable:
+    """事前計算した表の読み込みと問い合わせ。ファイルが更新されたら次の問い合わせで開き直す"""
+
+    def __init__(self, path):
+        self._path = Path(path)
+        self._meta_path = self._path.with_suffix(".json")
+        self._lock = threading.Lock()
+        self._values = None
+        self._meta = None
+        self._mtime = None
+
+    def _current(self):
+        # (表, メタ情報)。ファイルがなければ (None, None)
+        try:
+            mtime = (self._path.stat().st_mtime_ns, self._meta_path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            return None, None
+        with self._lock:
+            if mtime != self._mtime:
+                meta = json.loads(self._meta_path.read_text(encoding="utf-8"))
+                values = np.load(self._path, mmap_mode='r')
+                if values.shape != (len(meta["rcps"]), *[len(meta["axes"][key]) for key in meta["levers"]],
+                                    len(meta["outputs"])):
+                    # 書き換えの途中（表とメタ情報の組が揃っていない）。次の問い合わせで読み直す
+                    return self._values, self._meta
+                self._values, self._meta, self._mtime = values, meta, mtime
+            return self._values, self._meta
+
+    def info(self, fingerprint=None):
+        values, meta = self._current()
+        if meta is None:
+            return {"ready": False}
+        info = {key: value for key, value in meta.items() if key != "outputs"}
+        info.update({"ready": True, "shape": list(values.shape), "size_bytes": int(values.nbytes)})
+        if fingerprint is not None:
+            info["stale"] = meta["fingerprint"] != fingerprint
+        return info
+
+    def lookup(self, rcp, decisions, method="linear", include_trajectories=True):
+        """{レバー名: 値} の期待スコアと軌跡。表がなければ LookupError、RCP や method が不正なら ValueError"""
+        if method not in LOOKUP_METHODS:
+            raise ValueError(f"Unknown method: {method}")
+        values, meta = self._current()
+        if meta is None:
+            raise LookupError("score table has not been built")
+        started = time.perf_counter()
+        if float(rcp) not in meta["rcps"]:
+            raise ValueError(f"RCP {rcp} is not in the table: {meta['rcps']}")
+        r = meta["rcps"].index(float(rcp))
+
+        # 軸ごとに (下の格子点, 上の格子点, 上の重み)。範囲外は端に寄せる
+        brackets = []
+        clamped = []
+        ignored = []
+        for key in meta["levers"]:
+            axis = np.asarray(meta["axes"][key])
+            value = float(decisions.get(key, 0.0))
+            if len(axis) == 1:
+                if value != axis[0]:
+                    ignored.append(key)
+                brackets.append((0, 0, 0.0))
+                continue
+            if not axis[0] <= value <= axis[-1]:
+                clamped.append(key)
+            value = min(max(value, axis[0]), axis[-1])
+            upper = int(min(max(np.searchsorted(axis, value, side='right'), 1), len(axis) - 1))
+            weight = (value - axis[upper - 1]) / (axis[upper] - axis[upper - 1])
+            if method == "nearest":
+                index = upper if weight >= 0.5 else upper - 1
+                brackets.append((index, index, 0.0))
+            else:
+                brackets.append((upper - 1, upper, weight))
+
+        # 重みが 0 でない角だけを足し合わせる（最大 2^レバー数 点）
+        row = np.zeros(values.shape[-1])
+        corners = [[(low, 1.0 - weight)] + ([(high, weight)] if weight > 0 else []) for low, high, weight in brackets]
+        for corner in itertools.product(*corners):
+            weight = np.prod([w for _, w in corner])
+            if weight > 0:
+                row += weight * values[(r,) + tuple(index for index, _ in corner)]
+
+        outputs = meta["outputs"]
+        blocks = {name.split(":", 1)[1]: float(row[i]) for i, name in enumerate(outputs)
+                  if name.startswith("block:") and name != MEAN_SCORE}
+        result = {
+            "rcp": float(rcp),
+            "method": method,
+            "block_scores": blocks,
+            "mean_score": float(row[outputs.index(MEAN_SCORE)]),
+            "grid_point": {key: float(meta["axes"][key][low if weight < 0.5 else high])
+                           for key, (low, high, weight) in zip(meta["levers"], brackets)},
+            "clamped": clamped,
+            "ignored": ignored,
+        }
+        if include_trajectories:
+            n_years = len(meta["years"])
+            first = outputs.index(f"trajectory:{SURROGATE_COLUMNS[0]}:{meta['years'][0]}")
+            result["years"] = meta["years"]
+            result["trajectories"] = {
+                column: row[first + c * n_years:first + (c + 1) * n_years].tolist()
+                for c, column in enumerate(SURROGATE_COLUMNS)
+            }
+        result["elapsed_ms"] = (time.perf_counter() - started) * 1000
+        return result
@@ -0,0 +1,114 @@
+# metrics.py
+#
+# calculate_scenario_indicators と aggregate_blocks（utils.py）の指標を、アンサンブルの出力配列
+# (sims × years × outputs) から、シミュレーションごとにまとめて計算する。
+# 適応的モンテカルロの収束判定（指標ごとの標準誤差）に使う。
+
+import numpy as np
+
+from ensemble import OUTPUT_COLUMNS
+from utils import BENCHMARK, BLOCKS
+
+# calculate_scenario_indicators と同じ並び
+INDICATOR_NAMES = ['収量', '洪水被害', '生態系', '森林面積', '予算', '住民負担', '都市利便性']
+# _raw_values と同じ並び（total_score はこの順に平均する）
+BLOCK_METRICS = ['収量', '洪水被害', '予算', '住民負担', '生態系', '森林面積', '都市利便性']
+
+_SUM_COLUMNS = {'収量': 'Crop Yield', '洪水被害': 'Flood Damage', '予算': 'Municipal Cost', '住民負担': 'Resident Burden'}
+_MEAN_COLUMNS = {'生態系': 'Ecosystem Level', '森林面積': 'Forest Area', '都市利便性': 'Urban Level'}
+
+
+def _column(array, name):
+    return array[:, :, OUTPUT_COLUMNS.index(name)]
+
+
+def scenario_indicators(array):
+    """シミュレーションごとの calculate_scenario_indicators。{指標名: (sims,) の配列}"""
+    years = _column(array, 'Year')[0] if len(array) else np.array([])
+    last = np.flatnonzero(years == 2100)
+    ecosystem = _column(array, 'Ecosystem Level')
+    return {
+        '収量': _column(array, 'Crop Yield').sum(axis=1),
+        '洪水被害': _column(array, 'Flood Damage').sum(axis=1),
+        '生態系': ecosystem[:, last[0]] if len(last) else np.full(len(array), np.nan),
+        '森林面積': _column(array, 'Forest Area').mean(axis=1),
+        '予算': _column(array, 'Municipal Cost').sum(axis=1),
+        '住民負担': _column(array, 'Resident Burden').sum(axis=1),
+        '都市利便性': _column(array, 'Urban Level').mean(axis=1),
+    }
+
+
+def scale_to_100(raw, metric):
+    """utils._scale_to_100 の配列版"""
+    b = BENCHMARK[metric]
+    v = np.clip(raw, min(b['worst'], b['best']), max(b['worst'], b['best']))
+    if b['invert']:
+        score = 100 * (b['worst'] - v) / (b['worst'] - b['best'])
+    else:
+        score = 100 * (v - b['worst']) / (b['best'] - b['worst'])
+    return np.round(score, 1)
+
+
+def block_raw_values(array):
+    """シミュレーションごとの aggregate_blocks の raw。{期間ラベル: {指標名: (sims,) の配列}}（年がない期間は除く）"""
+    years = _column(array, 'Year')[0] if len(array) else np.array([])
+    blocks = {}
+    for start, end, label in BLOCKS:
+        mask = (years >= start) & (years <= end)
+        if not mask.any():
+            continue
+        raw = {}
+        for metric in BLOCK_METRICS:
+            if metric in _SUM_COLUMNS:
+                raw[metric] = _column(array, _SUM_COLUMNS[metric])[:, mask].sum(axis=1)
+            else:
+                raw[metric] = _column(array, _MEAN_COLUMNS[metric])[:, mask].mean(axis=1)
+        blocks[label] = raw
+    return blocks
+
+
+def block_metric_scores(array):
+    """シミュレーションごとの aggregate_blocks の score。{期間ラベル: {指標名: (sims,) の配列}}（年がない期間は除く）"""
+    return {
+        label: {metric: scale_to_100(values, metric) for metric, values in raw.items()}
+        for label, raw in block_raw_values(array).items()
+    }
+
+
+def block_total_scores(array):
+    """シミュレーションごとの aggregate_blocks の total_score。{期間ラベル: (sims,) の配列}（年がない期間は除く）"""
+    return {label: np.mean(list(scores.values()), axis=0) for label, scores in block_metric_scores(array).items()}
+
+
+def tracked_metrics(array):
+    """収束判定に使う指標を (名前のリスト, sims × 指標数 の配列) で返す
+
+    名前は "indicator:収量" / "block:2026-2050" の形。
+    """
+    names = []
+    columns = []
+    for name, values in scenario_indicators(array).items():
+        names.append(f"indicator:{name}")
+        columns.append(values)
+    for label, values in block_total_scores(array).items():
+        names.append(f"block:{label}")
+        columns.append(values)
+    return names, np.stack(columns, axis=1) if columns else np.empty((len(array), 0))
+
+
+def objective_scores(array):
+    """多目的の探索に使う指標を (名前のリスト, sims × 指標数 の配列) で返す
+
+    名前は "score:収量"（指標ごとの score の期間平均）と "block:2026-2050"（期間ごとの total_score）の形。
+    """
+    blocks = block_metric_scores(array)
+    names = []
+    columns = []
+    if blocks:
+        for metric in BLOCK_METRICS:
+            names.append(f"score:{metric}")
+            columns.append(np.mean([scores[metric] for scores in blocks.values()], axis=0))
+    for label, scores in blocks.items():
+        names.append(f"block:{label}")
+        columns.append(np.mean(list(scores.values()), axis=0))
+    return names, np.stack(columns, axis=1) if columns else np.empty((len(array), 0))
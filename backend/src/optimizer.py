@@ -0,0 +1,197 @@
+# optimizer.py
+#
+# 政策の最適化。各期間（utils.BLOCKS の 25 年ごと。ゲームで意思決定する区切りと同じ）の開始年に
+# 意思決定変数（レバー）を決めるスケジュールを、差分進化（scipy.optimize.differential_evolution）で探し、
+# 期間ごとの total_score の平均（/ranking と同じ集計）の期待値を最大にする。
+#
+# レバーの範囲は parameter_zones.csv の max 列（画面のスライダーの段階数）× 1段階あたりの値（LEVER_UNITS。
+# フロントエンドの表示値 → 送信値の変換と同じ）。discrete のときは段階（整数）だけを探すので、
+# 結果はそのままゲームで入力できる。
+#
+# 世代ごとの集団は、共通乱数の replicates 本のアンサンブルとして1回のバッチでまとめて評価する
+# （evaluation.evaluate_in_pool）。評価は seed だけで決まる決定的な関数になるので、同じ点の再評価はキャッシュから返す。
+# 最後に、最良のスケジュールと基準のスケジュールを、最適化に使っていない seed の大きなアンサンブルで評価し直す
+# （同じ乱数で選んだ最良値は楽観的に偏るため）。
+
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import differential_evolution
+from scipy.stats import qmc
+
+from decisions import DECISION_KEYS, compile_decisions
+from evaluation import MEAN_SCORE, evaluate_in_pool
+from forcing import generate_forcing
+from metrics import block_total_scores
+from utils import BLOCKS
+
+# 画面のスライダー1段階あたりの送信値（フロントエンドの変換表と同じ）
+LEVER_UNITS = {
+    'planting_trees_amount': 100.0,
+    'house_migration_amount': 5.0,
+    'dam_levee_construction_cost': 1.0,
+    'paddy_dam_construction_cost': 5.0,
+    'capacity_building_cost': 5.0,
+    'agricultural_RnD_cost': 5.0,
+    'transportation_invest': 5.0,
+}
+# parameter_zones.csv にレバーの行がない場合の段階数
+DEFAULT_LEVER_LEVELS = 2
+
+
+def load_lever_levels(path):
+    """parameter_zones.csv の max 列から {レバー名: 最大の段階} を読む（ファイルや行がなければ DEFAULT_LEVER_LEVELS）"""
+    levels = {key: DEFAULT_LEVER_LEVELS for key in DECISION_KEYS}
+    path = Path(path)
+    if path.exists():
+        zones = pd.read_csv(path)
+        for _, row in zones.iterrows():
+            if row['param'] in levels and not pd.isna(row['max']):
+                levels[row['param']] = int(row['max'])
+    return levels
+
+
+def period_starts(years):
+    """意思決定する年（各期間の開始年のうち、対象年に含まれるもの）"""
+    years = np.asarray(years)
+    return [start for start, end, _ in BLOCKS if ((years >= start) & (years <= end)).any()]
+
+
+def build_schedules(base, years, starts, levers, values):
+    """基準のスケジュール base (年 × len(DECISION_KEYS)) の levers 列を、期間ごとの値で置き換える
+
+    values は (集団の大きさ × 期間数 × レバー数) の送信値。戻り値は (集団の大きさ × 年 × len(DECISION_KEYS))。
+    """
+    years = np.asarray(years)
+    period = np.maximum(np.searchsorted(np.asarray(starts), years, side='right') - 1, 0)
+    schedules = np.repeat(base[np.newaxis], len(values), axis=0)
+    columns = [DECISION_KEYS.index(key) for key in levers]
+    schedules[:, :, columns] = values[:, period, :]
+    return schedules
+
+
+def strategy_records(values, starts, levers, base_rows, rcp):
+    """期間ごとの送信値を DecisionVar と同じ形の dict のリストにする（/simulate の decision_vars にそのまま使える）
+
+    base_rows は各期間の開始年の基準の値（期間数 × len(DECISION_KEYS)）で、動かさないレバーに使う。
+    """
+    records = []
+    for p, year in enumerate(starts):
+        record = {'year': int(year), **dict(zip(DECISION_KEYS, map(float, base_rows[p])))}
+        record.update({key: float(values[p, j]) for j, key in enumerate(levers)})
+        record['cp_climate_params'] = rcp
+        records.append(record)
+    return records
+
+
+def _score_distribution(pool, years, initial_values, schedule, params, seed, num_simulations, quantiles):
+    # 1つのスケジュールを num_simulations 本計算し、期間ごと・平均の total_score の平均と分位点を返す
+    forcing = generate_forcing(years, params, seed, num_simulations)
+    with pool.run(years, initial_values, schedule, params, num_simulations, seed, forcing) as result:
+        totals = block_total_scores(result.array)
+    totals[MEAN_SCORE] = np.mean(list(totals.values()), axis=0)
+    return {
+        label: {
+            "mean": float(scores.mean()),
+            "std": float(scores.std(ddof=1)) if len(scores) > 1 else 0.0,
+            "quantiles": {str(q): float(v) for q, v in zip(quantiles, np.quantile(scores, quantiles))},
+        }
+        for label, scores in totals.items()
+    }
+
+
+def optimize_policy(pool, years, initial_values, decision_vars_list, params, lever_levels, levers=None, rcp=None,
+                    discrete=True, replicates=16, popsize=5, max_generations=30, max_seconds=None, seed=0,
+                    num_simulations=1000, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """期待 total_score を最大にする期間ごとのレバーの値を探して、結果の辞書を返す
+
+    levers は動かすレバー（既定はすべて）。動かさないレバーは decision_vars_list（基準のスケジュール）のまま。
+    lever_levels は load_lever_levels の戻り値。popsize は scipy と同じく「変数の数 × popsize」が集団の大きさ。
+    """
+    levers = list(DECISION_KEYS if levers is None else levers)
+    unknown = [key for key in levers if key not in DECISION_KEYS]
+    if not levers or unknown or len(set(levers)) != len(levers):
+        raise ValueError(f"levers must be distinct decision variables: {unknown or levers}")
+    started = time.time()
+    years = np.asarray(years)
+    starts = period_starts(years)
+    base = compile_decisions(decision_vars_list, years, params['start_year'])
+    units = np.array([LEVER_UNITS[key] for key in levers])
+    upper = np.tile([float(lever_levels[key]) for key in levers], len(starts))
+    dims = len(upper)
+    shape = (len(starts), len(levers))
+
+    cache = {}
+    history = []
+    counts = {"evaluations": 0, "runs": 0}
+    stop_reason = ["max_generations"]
+
+    def objective(x):
+        # x: (変数の数 × 集団の大きさ)（段階の単位）。未評価の点だけを1回のバッチで計算する
+        levels = np.atleast_2d(np.asarray(x).T)
+        if discrete:
+            levels = np.round(levels)
+        keys = [tuple(row) for row in levels]
+        missing = list(dict.fromkeys(key for key in keys if key not in cache))
+        if missing:
+            values = np.array(missing).reshape(len(missing), *shape) * units
+            names, means = evaluate_in_pool(pool, years, initial_values, decision_vars_list, params, seed, replicates,
+                                            schedules=build_schedules(base, years, starts, levers, values))
+            scores = means[:, names.index(MEAN_SCORE)]
+            cache.update(zip(missing, scores))
+            counts["evaluations"] += len(missing)
+            counts["runs"] += len(missing) * replicates
+        # differential_evolution は最小化なので符号を反転する
+        return -np.array([cache[key] for key in keys])
+
+    def callback(xk, convergence=None):
+        history.append({"generation": len(history) + 1, "best_score": float(max(cache.values())),
+                        "evaluations": counts["evaluations"], "elapsed": time.time() - started})
+        if max_seconds is not None and time.time() - started >= max_seconds:
+            stop_reason[0] = "time_budget"
+            return True
+        return False
+
+    # 初期集団はラテン超方格に、基準のスケジュールと「何もしない」スケジュールを加えたもの
+    # （レバーには費用がかかるので、箱の角にある何もしない戦略は乱数の初期集団からは見つけにくい）
+    base_rows = base[np.searchsorted(years, starts)]
+    x0 = np.clip(base_rows[:, [DECISION_KEYS.index(key) for key in levers]] / units, 0.0, upper.reshape(shape)).ravel()
+    init = qmc.LatinHypercube(dims, seed=np.random.default_rng(seed)).random(max(5, popsize * dims) - 2) * upper
+    init = np.vstack([init, x0, np.zeros(dims)])
+    if discrete:
+        init = np.round(init)
+    # 集団の評価値がすべて同じ（1点に収束）になるまで続ける（既定の tol は total_score の尺度では粗すぎる）
+    result = differential_evolution(
+        objective, [(0.0, u) for u in upper], maxiter=max_generations, seed=seed, init=init, tol=0,
+        integrality=np.full(dims, discrete), vectorized=True, updating='deferred', polish=False, callback=callback
+    )
+    if result.success:
+        stop_reason[0] = "converged"
+    best_levels = np.round(result.x) if discrete else result.x
+    best_values = best_levels.reshape(shape) * units
+
+    # 最適化に使っていない seed で、最良と基準のスケジュールを評価し直す
+    validation_seed = int(np.random.SeedSequence(seed).spawn(1)[0].generate_state(1)[0])
+    best_schedule = build_schedules(base, years, starts, levers, best_values[np.newaxis])[0]
+    best = _score_distribution(pool, years, initial_values, best_schedule, params, validation_seed, num_simulations,
+                               quantiles)
+    baseline = _score_distribution(pool, years, initial_values, base, params, validation_seed, num_simulations,
+                                   quantiles)
+    return {
+        "strategy": strategy_records(best_values, starts, levers, base_rows, rcp),
+        "levels": {key: [float(v) for v in best_levels.reshape(shape)[:, j]] for j, key in enumerate(levers)},
+        "levers": levers,
+        "periods": [int(year) for year in starts],
+        "expected_score": float(-result.fun),
+        "validation": {"seed": validation_seed, "num_simulations": int(num_simulations),
+                       "best": best, "baseline": baseline},
+        "generations": int(result.nit),
+        "evaluations": counts["evaluations"],
+        "num_runs": counts["runs"] + 2 * int(num_simulations),
+        "stop_reason": stop_reason[0],
+        "history": history,
+        "seed": seed,
+        "elapsed": time.time() - started,
+    }
@@ -0,0 +1,124 @@
+# params.py
+#
+# simulate_year が毎年 params 辞書から約70個のキーを引き、トレンド項
+# （base_temp + temp_trend * (year - start_year) など）を計算し直していたのを、
+# リクエストごとに一度だけ「コンパイル」しておくための構造体。
+# 年に依存する項は params['years'] 全体について配列で前計算し、年ループでは添字で引くだけにする。
+
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledParams:
+    """1回の実行で使うパラメータ一式（変更不可）。年依存の項は first_year からの添字で引く"""
+
+    first_year: int
+    start_year: int
+
+    # --- 年ごとの前計算（長さ = 対象年数） ---
+    temp_mean: np.ndarray            # base_temp + temp_trend * 経過年
+    precip_mean: np.ndarray          # base_precip + precip_trend * 経過年
+    precip_unc: np.ndarray           # base_precip_uncertainty + precip_uncertainty_trend * 経過年
+    extreme_precip_freq: np.ndarray  # max(base_extreme_precip_freq + extreme_precip_freq_trend * 経過年, 0)
+    mu: np.ndarray                   # max(base_mu + extreme_precip_intensity_trend * 経過年, 0)
+    beta: np.ndarray                 # max(base_beta + extreme_precip_intensity_trend * 経過年, 0)
+
+    # --- 年によらない定数 ---
+    # 気象
+    base_temp: float
+    temp_uncertainty: float
+    initial_hot_days: float
+    temp_to_hot_days_coeff: float
+    hot_days_uncertainty: float
+    # 水需要
+    initial_municipal_demand: float
+    municipal_demand_trend: float
+    municipal_demand_uncertainty: float
+    # 水循環
+    max_available_water: float
+    evapotranspiration_amount: float
+    ecosystem_threshold: float
+    # 農業
+    max_potential_yield: float
+    high_temp_tolerance_increment: float
+    necessary_water_for_crops: float
+    paddy_dam_cost_per_ha: float
+    paddy_dam_yield_coef: float
+    temp_critical_crop: float
+    temp_threshold_crop_ini: float
+    RnD_investment_threshold: float
+    RnD_threshold_mean: float        # RnD_investment_threshold * RnD_investment_required_years
+    # 水災害
+    flood_damage_coefficient: float
+    levee_level_increment: float
+    levee_investment_threshold: float
+    levee_threshold_mean: float      # levee_investment_threshold * levee_investment_required_years
+    flood_recovery_cost_coef: float
+    runoff_coef: float
+    # 森林
+    cost_per_1000trees: float
+    forest_degradation_rate: float
+    tree_growup_year: int
+    initial_forest_area_ha: float    # total_area * initial_forest_area
+    # 住宅
+    house_total: float
+    cost_per_migration: float
+    # 住民意識
+    capacity_building_coefficient: float
+    resident_capacity_degrade_ratio: float
+    # 交通
+    transport_level_coef: float
+    distance_urban_level_coef: float
+    # 領域横断影響
+    flood_crop_damage_coef: float
+    flood_urban_damage_coef: float
+    paddy_dam_flood_coef: float
+    # 地形
+    total_area: float
+    paddy_field_area: float
+
+    def year_index(self, year):
+        """year に対応する前計算配列の添字"""
+        index = int(year) - self.first_year
+        if not 0 <= index < len(self.temp_mean):
+            raise ValueError(f"year {year} is outside the compiled range")
+        return index
+
+    def covers(self, years):
+        return len(years) == 0 or (int(min(years)) >= self.first_year
+                                   and int(max(years)) < self.first_year + len(self.temp_mean))
+
+
+# params 辞書からそのまま写すフィールド
+_COPIED = [f.name for f in fields(CompiledParams)
+           if f.name not in ('first_year', 'temp_mean', 'precip_mean', 'precip_unc', 'extreme_precip_freq',
+                             'mu', 'beta', 'RnD_threshold_mean', 'levee_threshold_mean', 'initial_forest_area_ha')]
+
+
+def compile_params(params, years=None):
+    """params 辞書から CompiledParams を作る。years を省略すると params['years'] 全体について前計算する"""
+    years = np.asarray(params['years'] if years is None else years)
+    if len(years):
+        years = np.arange(int(years.min()), int(years.max()) + 1)
+    elapsed = years - params['start_year']
+
+    def _frozen(array):
+        array = np.asarray(array, dtype=np.float64)
+        array.flags.writeable = False
+        return array
+
+    return CompiledParams(
+        first_year=int(years[0]) if len(years) else int(params['start_year']),
+        temp_mean=_frozen(params['base_temp'] + params['temp_trend'] * elapsed),
+        precip_mean=_frozen(params['base_precip'] + params['precip_trend'] * elapsed),
+        precip_unc=_frozen(params['base_precip_uncertainty'] + params['precip_uncertainty_trend'] * elapsed),
+        extreme_precip_freq=_frozen(np.maximum(params['base_extreme_precip_freq'] + params['extreme_precip_freq_trend'] * elapsed, 0)),
+        mu=_frozen(np.maximum(params['base_mu'] + params['extreme_precip_intensity_trend'] * elapsed, 0)),
+        beta=_frozen(np.maximum(params['base_beta'] + params['extreme_precip_intensity_trend'] * elapsed, 0)),
+        RnD_threshold_mean=params['RnD_investment_threshold'] * params['RnD_investment_required_years'],
+        levee_threshold_mean=params['levee_investment_threshold'] * params['levee_investment_required_years'],
+        initial_forest_area_ha=params['total_area'] * params['initial_forest_area'],
+        **{name: params[name] for name in _COPIED},
+    )
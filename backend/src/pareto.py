@@ -0,0 +1,300 @@
+# pareto.py
+#
+# 多目的の政策探索（NSGA-II）。utils.BENCHMARK の7つの指標（収量・洪水被害・予算・住民負担・生態系・
+# 森林面積・都市利便性）の score を aggregate_blocks と同じ 0〜100 の尺度で、期間平均したものを目的とし、
+# どれも他に劣らない（非劣解の）意思決定スケジュールの集合を返す。
+#
+# スケジュールの表し方（期間ごとのレバーの段階）とレバーの範囲は optimizer.py と同じ。
+# 世代ごとの子の集団は、共通乱数の replicates 本のアンサンブルとして1回のバッチでまとめて評価する。
+# 評価は (初期値・基準のスケジュール・パラメータ・seed・replicates, 候補のスケジュール) だけで決まるので、
+# ScoreCache に保持してリクエストをまたいで使い回す（同じ条件で世代数を増やしたり目的を変えたりしても再計算しない）。
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from scipy.stats import qmc
+
+from decisions import DECISION_KEYS, compile_decisions
+from evaluation import MEAN_SCORE, evaluate_in_pool
+from metrics import BLOCK_METRICS, objective_scores
+from optimizer import LEVER_UNITS, build_schedules, period_starts, strategy_records
+
+# 連続の場合の SBX 交叉と多項式突然変異の分布指数（NSGA-II の標準的な値）と、交叉する確率
+CROSSOVER_ETA = 15.0
+MUTATION_ETA = 20.0
+CROSSOVER_PROB = 0.9
+
+
+class ScoreCache:
+    """(評価の条件, 候補のスケジュール) をキーに、候補の指標の平均を保持する LRU キャッシュ"""
+
+    def __init__(self, maxsize):
+        self._maxsize = max(0, int(maxsize))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_many(self, context, keys):
+        """keys のうちキャッシュにあるものの {キー: 指標の配列}"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get((context, key))
+                if entry is not None:
+                    self._entries.move_to_end((context, key))
+                    found[key] = entry
+            self._hits += len(found)
+            self._misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, context, items):
+        with self._lock:
+            if self._maxsize == 0:
+                return
+            for key, values in items:
+                self._entries[(context, key)] = values
+                self._entries.move_to_end((context, key))
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self._maxsize,
+            "hits": self._hits,
+            "misses": self._misses,
+        }
+
+
+def context_key(initial_values, base, params, seed, replicates):
+    """評価の条件（候補のスケジュール以外で結果を決めるもの）のハッシュ"""
+    scalars = {name: value for name, value in params.items() if isinstance(value, (int, float))}
+    digest = hashlib.sha1()
+    digest.update(json.dumps([initial_values, scalars, int(seed), int(replicates)], sort_keys=True, default=str).encode())
+    digest.update(np.ascontiguousarray(base, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def non_dominated_sort(objectives):
+    """最大化の高速非優越ソート（Deb et al. 2002）。前から順に、各フロントの行番号の配列のリストを返す"""
+    n = len(objectives)
+    if n == 0:
+        return []
+    ge = (objectives[:, np.newaxis, :] >= objectives[np.newaxis, :, :]).all(axis=2)
+    gt = (objectives[:, np.newaxis, :] > objectives[np.newaxis, :, :]).any(axis=2)
+    dominates = ge & gt
+    # 各点を優越する点の数。0 になった点から順にフロントへ取り出す
+    counts = dominates.sum(axis=0)
+    fronts = []
+    current = np.flatnonzero(counts == 0)
+    while len(current):
+        fronts.append(current)
+        counts = counts - dominates[current].sum(axis=0)
+        counts[current] = -1
+        current = np.flatnonzero(counts == 0)
+    return fronts
+
+
+def crowding_distance(objectives):
+    """フロント内の混雑距離（端の点は inf）"""
+    n, m = objectives.shape
+    distance = np.zeros(n)
+    if n <= 2:
+        distance[:] = np.inf
+        return distance
+    for k in range(m):
+        order = np.argsort(objectives[:, k], kind='stable')
+        values = objectives[order, k]
+        distance[order[[0, -1]]] = np.inf
+        span = values[-1] - values[0]
+        if span > 0:
+            distance[order[1:-1]] += (values[2:] - values[:-2]) / span
+    return distance
+
+
+def _rank_and_crowding(objectives):
+    rank = np.empty(len(objectives), dtype=int)
+    crowding = np.empty(len(objectives))
+    for r, front in enumerate(non_dominated_sort(objectives)):
+        rank[front] = r
+        crowding[front] = crowding_distance(objectives[front])
+    return rank, crowding
+
+
+def _select(objectives, size):
+    # フロントの順に詰め、最後のフロントは混雑距離の大きい順に取る
+    chosen = []
+    for front in non_dominated_sort(objectives):
+        if len(chosen) + len(front) <= size:
+            chosen.extend(front)
+            continue
+        distance = crowding_distance(objectives[front])
+        chosen.extend(front[np.argsort(-distance, kind='stable')[:size - len(chosen)]])
+        break
+    return np.array(chosen, dtype=int)
+
+
+def _tournament(rng, rank, crowding, size):
+    # 二項トーナメント：ランクが小さい方、同じなら混雑距離が大きい方
+    a, b = rng.integers(0, len(rank), (2, size))
+    better = (rank[a] < rank[b]) | ((rank[a] == rank[b]) & (crowding[a] > crowding[b]))
+    return np.where(better, a, b)
+
+
+def _variation(rng, parents, upper, discrete):
+    """子の集団を作る。parents は (2k × 変数の数)
+
+    連続なら SBX 交叉と多項式突然変異（Deb & Agrawal）。段階（整数）の場合は、それでは親の近くにしか
+    子ができず丸めると親に戻ってしまうので、一様交叉と、段階を一様に選び直す突然変異を使う。
+    """
+    n, dims = parents.shape
+    p1, p2 = parents[0::2], parents[1::2]
+    swap = (rng.random((len(p1), 1)) < CROSSOVER_PROB) & (rng.random(p1.shape) < 0.5)
+    mutate = rng.random((n, dims)) < 1.0 / dims
+    if discrete:
+        children = np.concatenate([np.where(swap, p2, p1), np.where(swap, p1, p2)])
+        levels = np.floor(rng.random((n, dims)) * (upper + 1))
+        return np.where(mutate, levels, children)
+
+    u = rng.random(p1.shape)
+    beta = np.where(u <= 0.5, (2 * u) ** (1 / (CROSSOVER_ETA + 1)), (1 / (2 * (1 - u))) ** (1 / (CROSSOVER_ETA + 1)))
+    c1 = np.where(swap, 0.5 * ((1 + beta) * p1 + (1 - beta) * p2), p1)
+    c2 = np.where(swap, 0.5 * ((1 - beta) * p1 + (1 + beta) * p2), p2)
+    children = np.concatenate([c1, c2])
+    u = rng.random(children.shape)
+    delta = np.where(u < 0.5, (2 * u) ** (1 / (MUTATION_ETA + 1)) - 1, 1 - (2 * (1 - u)) ** (1 / (MUTATION_ETA + 1)))
+    children = np.where(mutate, children + delta * upper, children)
+    return np.clip(children, 0.0, upper)
+
+
+def pareto_search(pool, years, initial_values, decision_vars_list, params, lever_levels, levers=None, objectives=None,
+                  rcp=None, discrete=True, replicates=8, population=100, generations=50, max_seconds=None, seed=0,
+                  cache=None):
+    """NSGA-II で非劣解のスケジュールの集合を探して、結果の辞書を返す
+
+    objectives は目的にする BENCHMARK の指標名（既定はすべて）。いずれも score（大きいほど良い）で比べる。
+    cache は ScoreCache（なければこの呼び出しの中だけで使い回す）。
+    """
+    levers = list(DECISION_KEYS if levers is None else levers)
+    unknown = [key for key in levers if key not in DECISION_KEYS]
+    if not levers or unknown or len(set(levers)) != len(levers):
+        raise ValueError(f"levers must be distinct decision variables: {unknown or levers}")
+    objectives = list(BLOCK_METRICS if objectives is None else objectives)
+    unknown = [name for name in objectives if name not in BLOCK_METRICS]
+    if len(objectives) < 2 or unknown or len(set(objectives)) != len(objectives):
+        raise ValueError(f"objectives must be at least two distinct metrics of {BLOCK_METRICS}: {unknown or objectives}")
+    started = time.time()
+    rng = np.random.default_rng(seed)
+    cache = cache if cache is not None else ScoreCache(1 << 20)
+    years = np.asarray(years)
+    starts = period_starts(years)
+    base = compile_decisions(decision_vars_list, years, params['start_year'])
+    base_rows = base[np.searchsorted(years, starts)]
+    lever_columns = [DECISION_KEYS.index(key) for key in levers]
+    units = np.array([LEVER_UNITS[key] for key in levers])
+    upper = np.tile([float(lever_levels[key]) for key in levers], len(starts))
+    dims = len(upper)
+    shape = (len(starts), len(levers))
+    population = max(4, int(population) + int(population) % 2)
+    context = context_key(initial_values, base, params, seed, replicates)
+    names = [f"score:{metric}" for metric in BLOCK_METRICS] + [MEAN_SCORE]
+    columns = [names.index(f"score:{metric}") for metric in objectives]
+    counts = {"evaluations": 0, "cache_hits": 0}
+
+    def evaluate(levels):
+        # levels: (候補数 × 変数の数)。キャッシュにない候補だけを1回のバッチで計算し、(候補数 × len(names)) を返す
+        values = levels.reshape(len(levels), *shape) * units
+        # キーは期間ごとの全レバーの値（動かすレバーの組が違っても同じスケジュールなら同じキー）
+        rows = np.repeat(base_rows[np.newaxis], len(values), axis=0)
+        rows[:, :, lever_columns] = values
+        keys = [tuple(row.ravel()) for row in rows]
+        candidates = dict(zip(keys, values))
+        found = cache.get_many(context, list(candidates))
+        missing = [key for key in candidates if key not in found]
+        counts["cache_hits"] += len(found)
+        if missing:
+            batch = np.array([candidates[key] for key in missing])
+            metric_names, means = evaluate_in_pool(pool, years, initial_values, decision_vars_list, params, seed,
+                                                   replicates, schedules=build_schedules(base, years, starts, levers, batch),
+                                                   metrics_fn=objective_scores)
+            means = means[:, [metric_names.index(name) for name in names]]
+            fresh = dict(zip(missing, means))
+            cache.put_many(context, fresh.items())
+            found.update(fresh)
+            counts["evaluations"] += len(missing)
+        return np.array([found[key] for key in keys])
+
+    def prepare(levels):
+        return np.round(levels) if discrete else levels
+
+    # 初期集団：ラテン超方格に、基準のスケジュールと「何もしない」スケジュールを加える
+    x0 = np.clip(base_rows[:, lever_columns] / units, 0.0, upper.reshape(shape)).ravel()
+    parents = np.vstack([qmc.LatinHypercube(dims, seed=rng).random(population - 2) * upper, x0, np.zeros(dims)])
+    parents = prepare(parents)
+    parent_scores = evaluate(parents)
+    archive_levels, archive_scores = parents, parent_scores
+    history = []
+    stop_reason = "max_generations"
+
+    for generation in range(1, int(generations) + 1):
+        if max_seconds is not None and time.time() - started >= max_seconds:
+            stop_reason = "time_budget"
+            break
+        rank, crowding = _rank_and_crowding(parent_scores[:, columns])
+        mates = parents[_tournament(rng, rank, crowding, population)]
+        children = prepare(_variation(rng, mates, upper, discrete))
+        child_scores = evaluate(children)
+
+        combined = np.vstack([parents, children])
+        combined_scores = np.vstack([parent_scores, child_scores])
+        # 同じ候補が重複すると混雑距離が 0 になり多様性が落ちるので、重複を除いてから選ぶ
+        _, unique = np.unique(combined, axis=0, return_index=True)
+        unique = np.sort(unique)
+        keep = unique[_select(combined_scores[unique][:, columns], population)]
+        parents, parent_scores = combined[keep], combined_scores[keep]
+
+        # これまでに評価したすべての候補のうちの非劣解を保持する
+        pooled = np.vstack([archive_levels, children])
+        pooled_scores = np.vstack([archive_scores, child_scores])
+        _, unique = np.unique(pooled, axis=0, return_index=True)
+        unique = np.sort(unique)
+        front = unique[non_dominated_sort(pooled_scores[unique][:, columns])[0]]
+        archive_levels, archive_scores = pooled[front], pooled_scores[front]
+        history.append({"generation": generation, "front_size": int(len(front)),
+                        "evaluations": counts["evaluations"], "elapsed": time.time() - started})
+
+    front = non_dominated_sort(archive_scores[:, columns])[0] if len(archive_scores) else []
+    order = sorted(front, key=lambda i: -archive_scores[i, -1])
+    points = []
+    for i in order:
+        levels = archive_levels[i].reshape(shape)
+        points.append({
+            "strategy": strategy_records(levels * units, starts, levers, base_rows, rcp),
+            "levels": {key: [float(v) for v in levels[:, j]] for j, key in enumerate(levers)},
+            "scores": {metric: float(archive_scores[i, BLOCK_METRICS.index(metric)]) for metric in BLOCK_METRICS},
+            "total_score": float(archive_scores[i, -1]),
+        })
+    return {
+        "front": points,
+        "objectives": objectives,
+        "levers": levers,
+        "periods": [int(year) for year in starts],
+        "population": population,
+        "generations": len(history),
+        "evaluations": counts["evaluations"],
+        "cache_hits": counts["cache_hits"],
+        "num_runs": counts["evaluations"] * int(replicates),
+        "stop_reason": stop_reason,
+        "history": history,
+        "seed": seed,
+        "elapsed": time.time() - started,
+    }
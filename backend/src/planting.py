@@ -0,0 +1,95 @@
+# planting.py
+#
+# 植林履歴（planting_history）のリングバッファ。
+# モデルが参照するのは tree_growup_year 年前の植林量だけなので、年 → 植林量の辞書を
+# 毎年伸ばしていく代わりに、長さ tree_growup_year の配列を year % 長さ で使い回す。
+#
+# やり取り用の表現は {"last_year": 最後に記録した年, "amounts": [古い順の植林量]}。
+# 旧形式の {年: 植林量} の辞書も受け付ける。
+# シミュレーションごとに植林量が違う場合（最適化・感度分析）は broadcast(n) で (長さ × n) のリングにする。
+# シミュレーションごとに初期の履歴が違う場合（代理モデルの学習）は、(長さ × n) のリングを初期値として渡す。
+
+import numpy as np
+
+
+class PlantingRing:
+    """直近 length 年分の植林量だけを持つ固定長のリングバッファ"""
+
+    __slots__ = ('amounts', 'last_year')
+
+    def __init__(self, length):
+        self.amounts = np.zeros(max(1, int(length)))
+        self.last_year = None
+
+    @property
+    def length(self):
+        return len(self.amounts)
+
+    @classmethod
+    def from_value(cls, value, length):
+        """リクエストの planting_history（None / 旧形式の辞書 / wire 形式 / PlantingRing）から作る"""
+        ring = cls(length)
+        if value is None:
+            return ring
+        if isinstance(value, PlantingRing) and value.amounts.ndim > 1:
+            # シミュレーションごとの履歴（broadcast 済み）はそのまま複製する
+            return value.copy()
+        if isinstance(value, PlantingRing):
+            value = value.to_wire()
+        elif hasattr(value, 'model_dump'):
+            value = value.model_dump()
+        if 'amounts' in value:
+            amounts = list(value.get('amounts') or [])
+            last_year = value.get('last_year')
+            if last_year is not None:
+                first_year = int(last_year) - len(amounts) + 1
+                for offset, amount in enumerate(amounts):
+                    ring.record(first_year + offset, amount)
+        else:
+            for year, amount in sorted((int(k), float(v)) for k, v in value.items()):
+                ring.record(year, amount)
+        return ring
+
+    def copy(self):
+        ring = PlantingRing(self.length)
+        ring.amounts = self.amounts.copy()
+        ring.last_year = self.last_year
+        return ring
+
+    def broadcast(self, n):
+        """同じ履歴を n 本のシミュレーション分に複製したリング（matured は長さ n の配列を返す）"""
+        ring = PlantingRing(self.length)
+        ring.amounts = np.repeat(self.amounts[:, np.newaxis], n, axis=1)
+        ring.last_year = self.last_year
+        return ring
+
+    def matured(self, year):
+        """year - length 年に植えた量（記録していなければ 0）。record(year) より前に呼ぶこと"""
+        planted_year = int(year) - self.length
+        if self.last_year is None or not self.last_year - self.length < planted_year <= self.last_year:
+            return 0.0
+        if self.amounts.ndim > 1:
+            return self.amounts[planted_year % self.length].copy()
+        return float(self.amounts[planted_year % self.length])
+
+    def record(self, year, amount):
+        year = int(year)
+        if self.last_year is None:
+            self.amounts[:] = 0.0
+        elif year > self.last_year + 1:
+            # 飛ばした年の枠は古い値が残らないよう 0 にする
+            for skipped in range(self.last_year + 1, min(year, self.last_year + 1 + self.length)):
+                self.amounts[skipped % self.length] = 0.0
+        elif year <= self.last_year - self.length:
+            return
+        self.amounts[year % self.length] = amount
+        if self.last_year is None or year > self.last_year:
+            self.last_year = year
+
+    def to_wire(self):
+        """{"last_year": ..., "amounts": [古い順]} の形にする"""
+        if self.last_year is None:
+            return {'last_year': None, 'amounts': []}
+        first_year = self.last_year - self.length + 1
+        order = np.arange(first_year, self.last_year + 1) % self.length
+        return {'last_year': int(self.last_year), 'amounts': self.amounts[order].tolist()}
@@ -0,0 +1,125 @@
+# sampling.py
+#
+# モンテカルロモードの分散低減サンプリング。
+# 連続な乱数（気温・降水量・高温日数のノイズ、水需要・R&D／堤防の閾値ノイズ、森林係数の一様乱数、
+# 生態系の Dirichlet 重み）を、一様乱数の「計画」から逆関数法で作る。
+#
+# - random:     従来どおりの擬似乱数（計画を使わない）
+# - antithetic: 2本ずつ組にして、片方に U、もう片方に 1 - U を使う（対称変量）
+# - lhs:        DESIGN_BLOCK 本ごとのラテン超方格
+# - sobol:      DESIGN_BLOCK 本ごとにスクランブル（LMS + デジタルシフト。qmc.Sobol(scramble=True) と同じ）した Sobol 点列
+#
+# 計画は DESIGN_BLOCK 本ごとに独立した系列から作るので、シミュレーション i の値は (seed, i, 方式) だけで決まり、
+# N やワーカーへの分け方によらない。ブロック（antithetic は組）ごとの平均は互いに独立なので、
+# そのばらつきから推定量の分散（標準誤差）と有効サンプルサイズを見積もれる（summary.MetricTracker）。
+# 極端降水イベント（Poisson / Gumbel）は擬似乱数のまま。
+
+from functools import lru_cache
+
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import qmc
+
+SAMPLING_METHODS = ["random", "antithetic", "lhs", "sobol"]
+
+# SeedSequence(seed) の子のうち、計画に使う番号（気候外力は forcing.FORCING_STREAM、シミュレーションごとは ensemble.SIMULATION_STREAM）
+SAMPLING_STREAM = 2
+# 計画の種類（spawn_key の2番目）
+FORCING_DESIGN = 0
+NOISE_DESIGN = 1
+
+# この本数ごとに独立した計画を作る（Sobol の均等性のため 2 の累乗）。
+# ブロックが小さいほど標準誤差・有効サンプルサイズの見積もりに使える反復が増える
+DESIGN_BLOCK = 64
+
+# Sobol 点列の精度（scipy の既定と同じ 30 ビット）
+_SOBOL_BITS = 30
+
+# 逆関数法で ±inf にならないよう、計画の値を (0, 1) の内側に収める
+_EPS = 1e-12
+
+
+def replicate_size(method):
+    """互いに独立な反復（推定量の分散を見積もる単位）の本数"""
+    if method == "random":
+        return 1
+    if method == "antithetic":
+        return 2
+    return DESIGN_BLOCK
+
+
+def uniform_design(method, seed, design, sim_start, sim_stop, dims):
+    """シミュレーション [sim_start, sim_stop) の計画 ((sim_stop - sim_start) × dims の一様乱数)"""
+    first_block = sim_start // DESIGN_BLOCK
+    last_block = max(first_block + 1, -(-sim_stop // DESIGN_BLOCK))
+    blocks = [_design_block(method, seed, design, block, dims) for block in range(first_block, last_block)]
+    offset = first_block * DESIGN_BLOCK
+    u = np.concatenate(blocks)[sim_start - offset:sim_stop - offset]
+    return np.clip(u, _EPS, 1 - _EPS)
+
+
+def _design_block(method, seed, design, block, dims):
+    rng = np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(SAMPLING_STREAM, design, block))))
+    if method == "antithetic":
+        u = rng.random((DESIGN_BLOCK // 2, dims))
+        return np.stack([u, 1 - u], axis=1).reshape(DESIGN_BLOCK, dims)
+    if method == "lhs":
+        return qmc.LatinHypercube(dims, seed=rng).random(DESIGN_BLOCK)
+    if method == "sobol":
+        return _scrambled_sobol(rng, dims)
+    raise ValueError(f"Unknown sampling method: {method}")
+
+
+def _scrambled_sobol(rng, dims):
+    """Sobol 点列の先頭 DESIGN_BLOCK 点を、qmc.Sobol(dims, scramble=True) と同じ LMS + デジタルシフトで乱択化する
+
+    乱数は qmc.Sobol の _scramble と同じ順・同じ型で rng から引くので、rng を子の系列として使う
+    qmc.Sobol(dims, scramble=True, rng=親).random(DESIGN_BLOCK) と同じ点になる。
+    先頭 DESIGN_BLOCK 点は最初の log2(DESIGN_BLOCK) 個の方向数の XOR なので、変換はその方向数にだけ当てる
+    （qmc.Sobol は全ビット分の方向数を変換するので、ブロックごとに作ると数倍遅い）。
+    """
+    bit = np.arange(_SOBOL_BITS, dtype=np.uint64)
+    weights = np.uint64(1) << bit
+    shift = rng.integers(2, size=(dims, _SOBOL_BITS), dtype=np.uint32).astype(np.uint64) @ weights
+    # 下三角（対角は 1）の行列。行 p を上位ビットから並べた整数にすると、出力の第 (bits - 1 - p) ビットは parity(行 p & v)
+    ltm = np.tril(rng.integers(2, size=(dims, _SOBOL_BITS, _SOBOL_BITS), dtype=np.uint32)).astype(np.uint64)
+    ltm[:, np.arange(_SOBOL_BITS), np.arange(_SOBOL_BITS)] = 1
+    rows = (ltm @ weights[::-1])[:, ::-1]
+    directions, coefficients = _sobol_directions(dims)
+    scrambled = np.bitwise_xor.reduce(_parity(directions[:, :, np.newaxis] & rows) << bit, axis=2)
+    points = np.bitwise_xor.reduce(coefficients[:, :, np.newaxis] * scrambled, axis=1) ^ shift
+    return points / (1 << _SOBOL_BITS)
+
+
+@lru_cache(maxsize=8)
+def _sobol_directions(dims):
+    # 乱択化前の先頭 DESIGN_BLOCK 点を張る方向数 v_k（整数表現）と、各点の係数（点 n は gray(n) のビットが立っている v_k の XOR）。
+    # 次元数ごとに一度だけ作る
+    points = qmc.Sobol(dims, scramble=False, bits=_SOBOL_BITS).random(DESIGN_BLOCK)
+    points = (points * (1 << _SOBOL_BITS)).astype(np.uint64)
+    m = DESIGN_BLOCK.bit_length() - 1
+    # gray(2^(k+1) - 1) = 2^k
+    directions = points[[(1 << (k + 1)) - 1 for k in range(m)]]
+    n = np.arange(DESIGN_BLOCK)
+    coefficients = (((n ^ (n >> 1))[:, np.newaxis] >> np.arange(m)) & 1).astype(np.uint64)
+    directions.flags.writeable = False
+    coefficients.flags.writeable = False
+    return directions, coefficients
+
+
+def _parity(x):
+    # uint64 の各要素の立っているビットの数の偶奇
+    for shift in (32, 16, 8, 4, 2, 1):
+        x = x ^ (x >> np.uint64(shift))
+    return x & np.uint64(1)
+
+
+def standard_normal(u):
+    """一様乱数から標準正規乱数（逆関数法。antithetic なら -z と組になる）"""
+    return ndtri(u)
+
+
+def dirichlet_ones(u):
+    """最後の軸の一様乱数（k 個）から Dirichlet(1, ..., 1) の重み（指数乱数を正規化する）"""
+    e = -np.log(u)
+    return e / e.sum(axis=-1, keepdims=True)
@@ -0,0 +1,216 @@
+# sensitivity.py
+#
+# 大域的感度分析。DEFAULT_PARAMS の数値パラメータと意思決定変数（全期間一定の値として）を「因子」とし、
+# 指定した範囲で動かしたときに、期間ごとの total_score（aggregate_blocks）などがどれだけ変わるかを見る。
+#
+# - sobol:  Saltelli の計画（A, B と、A の列 i を B に置き換えた AB_i。N × (d + 2) 点）から
+#           1次の指数 S1（Saltelli 2010）と総合効果指数 ST（Jansen）を推定する
+# - morris: r 本の軌跡（d + 1 点ずつ、1因子ずつ Δ だけ動かす）の要素効果から mu / mu* / sigma を求める
+#
+# 各点は replicates 本の共通乱数アンサンブルの平均で評価し（evaluation.evaluate_variants）、
+# 全点をワーカープールでまとめて計算する。信頼区間は計画の行（軌跡）をブートストラップした百分位点。
+
+import time
+
+import numpy as np
+from scipy.stats import qmc
+
+from decisions import DECISION_KEYS
+from evaluation import constant_schedules, evaluate_in_pool, is_variable_param
+
+SENSITIVITY_METHODS = ["sobol", "morris"]
+
+
+def validate_factors(factors, params):
+    """factors: [(名前, 下限, 上限), ...]。問題があれば ValueError"""
+    if not factors:
+        raise ValueError("at least one factor is required")
+    names = [name for name, _, _ in factors]
+    if len(set(names)) != len(names):
+        raise ValueError("factor names must be unique")
+    for name, low, high in factors:
+        if name not in DECISION_KEYS and not is_variable_param(params, name):
+            raise ValueError(f"Unknown or non-numeric factor: {name}")
+        if not low < high:
+            raise ValueError(f"factor {name}: low must be less than high")
+
+
+def num_points(method, num_factors, num_samples):
+    """計画の点数（sobol は基本サンプル数を 2 の累乗に切り上げる）"""
+    if method == "sobol":
+        return _sobol_samples(num_samples) * (num_factors + 2)
+    return max(2, int(num_samples)) * (num_factors + 1)
+
+
+def _sobol_samples(num_samples):
+    return 1 << max(1, int(np.ceil(np.log2(max(2, num_samples)))))
+
+
+def saltelli_design(num_factors, num_samples, rng):
+    """単位超立方体上の (A, B, AB)。AB[i] は A の列 i を B の列 i に置き換えたもの"""
+    base = qmc.Sobol(2 * num_factors, scramble=True, seed=rng).random(num_samples)
+    a, b = base[:, :num_factors], base[:, num_factors:]
+    ab = np.repeat(a[np.newaxis], num_factors, axis=0)
+    for i in range(num_factors):
+        ab[i, :, i] = b[:, i]
+    return a, b, ab
+
+
+def sobol_indices(f_a, f_b, f_ab):
+    """f_a, f_b: (N × 指標数)、f_ab: (因子数 × N × 指標数) から (S1, ST)（それぞれ 因子数 × 指標数）"""
+    # 平均を引いておく（S1 の推定量は出力の水準に引きずられて分散が大きくなる）
+    center = np.concatenate([f_a, f_b]).mean(axis=0)
+    f_a, f_b, f_ab = f_a - center, f_b - center, f_ab - center
+    variance = np.var(np.concatenate([f_a, f_b]), axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s1 = np.mean(f_b * (f_ab - f_a), axis=1) / variance
+        st = 0.5 * np.mean((f_a - f_ab) ** 2, axis=1) / variance
+    return s1, st
+
+
+def morris_design(num_factors, num_trajectories, num_levels, rng):
+    """単位超立方体上の軌跡 (r × (d + 1) × d) と、各ステップで動かす因子の順番 (r × d)
+
+    各軌跡は下半分の格子点から始め、因子を1つずつ Δ = p / (2(p - 1)) だけ上げる。
+    """
+    delta = num_levels / (2 * (num_levels - 1))
+    starts = np.arange(num_levels // 2) / (num_levels - 1)
+    trajectories = np.empty((num_trajectories, num_factors + 1, num_factors))
+    orders = np.empty((num_trajectories, num_factors), dtype=int)
+    for t in range(num_trajectories):
+        point = rng.choice(starts, num_factors)
+        order = rng.permutation(num_factors)
+        trajectories[t, 0] = point
+        for k, i in enumerate(order):
+            point = point.copy()
+            point[i] += delta
+            trajectories[t, k + 1] = point
+        orders[t] = order
+    return trajectories, orders, delta
+
+
+def elementary_effects(values, orders, delta):
+    """values: (r × (d + 1) × 指標数) から、要素効果 (r × 因子数 × 指標数)（因子の範囲を 1 とした単位）"""
+    r, d = orders.shape
+    effects = np.empty((r, d, values.shape[-1]))
+    steps = (values[:, 1:] - values[:, :-1]) / delta
+    for t in range(r):
+        effects[t, orders[t]] = steps[t]
+    return effects
+
+
+def _morris_stats(effects):
+    # (mu, mu*, sigma)。sigma は非線形性・交互作用の目安
+    sigma = effects.std(axis=0, ddof=1) if len(effects) > 1 else np.zeros(effects.shape[1:])
+    return effects.mean(axis=0), np.abs(effects).mean(axis=0), sigma
+
+
+def _interval(samples, confidence):
+    # ブートストラップの百分位点 (2 × ...)
+    alpha = (1 - confidence) / 2
+    return np.nanquantile(samples, [alpha, 1 - alpha], axis=0)
+
+
+def _json_float(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def run_sensitivity(pool, years, initial_values, decision_vars_list, params, factors, method="sobol",
+                    num_samples=256, num_levels=4, replicates=8, seed=0, num_bootstrap=200, confidence=0.95,
+                    metrics=None):
+    """感度分析を実行して結果の辞書を返す
+
+    factors は [(名前, 下限, 上限), ...]。sobol は num_samples（2 の累乗に切り上げ）× (因子数 + 2) 点、
+    morris は num_samples 本の軌跡 × (因子数 + 1) 点を、それぞれ replicates 本ずつ計算する。
+    metrics は結果に含める指標名（既定は期間ごとの total_score とその平均）。
+    """
+    validate_factors(factors, params)
+    if method not in SENSITIVITY_METHODS:
+        raise ValueError(f"Unknown method: {method}")
+    started = time.time()
+    rng = np.random.default_rng(seed)
+    names = [name for name, _, _ in factors]
+    low = np.array([low for _, low, _ in factors], dtype=np.float64)
+    high = np.array([high for _, _, high in factors], dtype=np.float64)
+    d = len(factors)
+
+    if method == "sobol":
+        n = _sobol_samples(num_samples)
+        a, b, ab = saltelli_design(d, n, rng)
+        unit = np.concatenate([a, b, ab.reshape(-1, d)])
+    else:
+        if num_levels < 2 or num_levels % 2:
+            raise ValueError("num_levels must be an even number >= 2")
+        n = max(2, int(num_samples))
+        trajectories, orders, delta = morris_design(d, n, num_levels, rng)
+        unit = trajectories.reshape(-1, d)
+    points = low + unit * (high - low)
+
+    decision_overrides = {name: points[:, j] for j, name in enumerate(names) if name in DECISION_KEYS}
+    param_values = {name: points[:, j] for j, name in enumerate(names) if name not in DECISION_KEYS}
+    schedules = None
+    if decision_overrides:
+        schedules = constant_schedules(decision_vars_list, years, params['start_year'], decision_overrides)
+    metric_names, values = evaluate_in_pool(pool, years, initial_values, decision_vars_list, params, seed, replicates,
+                                            param_values=param_values, schedules=schedules)
+    if metrics is None:
+        metrics = [name for name in metric_names if name.startswith("block:")]
+    unknown = [name for name in metrics if name not in metric_names]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}")
+    values = values[:, [metric_names.index(name) for name in metrics]]
+
+    result = {
+        "method": method,
+        "factors": [{"name": name, "low": float(lo), "high": float(hi)} for name, lo, hi in factors],
+        "metrics": metrics,
+        "num_points": int(len(points)),
+        "replicates": int(replicates),
+        "num_runs": int(len(points) * replicates),
+        "seed": seed,
+        "indices": {},
+    }
+
+    if method == "sobol":
+        f_a, f_b, f_ab = values[:n], values[n:2 * n], values[2 * n:].reshape(d, n, -1)
+        s1, st = sobol_indices(f_a, f_b, f_ab)
+        boot_s1, boot_st = [], []
+        for _ in range(num_bootstrap):
+            rows = rng.integers(0, n, n)
+            bs1, bst = sobol_indices(f_a[rows], f_b[rows], f_ab[:, rows])
+            boot_s1.append(bs1)
+            boot_st.append(bst)
+        s1_ci = _interval(np.array(boot_s1), confidence) if num_bootstrap else np.full((2,) + s1.shape, np.nan)
+        st_ci = _interval(np.array(boot_st), confidence) if num_bootstrap else np.full((2,) + st.shape, np.nan)
+        for k, metric in enumerate(metrics):
+            result["indices"][metric] = {
+                name: {
+                    "S1": _json_float(s1[i, k]),
+                    "S1_conf": [_json_float(s1_ci[0, i, k]), _json_float(s1_ci[1, i, k])],
+                    "ST": _json_float(st[i, k]),
+                    "ST_conf": [_json_float(st_ci[0, i, k]), _json_float(st_ci[1, i, k])],
+                }
+                for i, name in enumerate(names)
+            }
+        result["num_samples"] = n
+    else:
+        effects = elementary_effects(values.reshape(n, d + 1, -1), orders, delta)
+        mu, mu_star, sigma = _morris_stats(effects)
+        boot = [np.abs(effects[rng.integers(0, n, n)]).mean(axis=0) for _ in range(num_bootstrap)]
+        mu_star_ci = _interval(np.array(boot), confidence) if num_bootstrap else np.full((2,) + mu_star.shape, np.nan)
+        for k, metric in enumerate(metrics):
+            result["indices"][metric] = {
+                name: {
+                    "mu": _json_float(mu[i, k]),
+                    "mu_star": _json_float(mu_star[i, k]),
+                    "mu_star_conf": [_json_float(mu_star_ci[0, i, k]), _json_float(mu_star_ci[1, i, k])],
+                    "sigma": _json_float(sigma[i, k]),
+                }
+                for i, name in enumerate(names)
+            }
+        result["num_trajectories"] = n
+        result["num_levels"] = int(num_levels)
+
+    result["elapsed"] = time.time() - started
+    return result
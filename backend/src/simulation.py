@@ -1,26 +1,35 @@
 # simulation.py
 
 import numpy as np
-import pandas as pd
-from scipy.stats import gumbel_r
 
-def simulate_year(year, prev_values, decision_vars, params):
+from decisions import DECISION_KEYS, compile_decisions
+from extremes import flood_damage, gumbel_inverse_cdf
+from params import CompiledParams, compile_params
+from planting import PlantingRing
+
+
+def simulate_year(year, prev_values, decision_vars, params, rng=None, include_planting_history=False):
+    # rng: np.random.Generator（未指定ならグローバルな np.random を使う）
+    rng = np.random if rng is None else rng
+    # params: CompiledParams（辞書が来た場合はこの年の分だけコンパイルする）
+    p = params if isinstance(params, CompiledParams) else compile_params(params, [year])
+
     # --- 前年の値を展開（初期値を定義していない変数は追って調整） ---
     prev_levee_level = prev_values.get('levee_level', 0.0)
     high_temp_tolerance_level = prev_values.get('high_temp_tolerance_level', 0.0)
     ecosystem_level = prev_values.get('ecosystem_level', 100)
-    prev_forest_area = prev_values.get('forest_area', params['total_area'] * params['initial_forest_area']) ##################
-    planting_history    = prev_values.get('planting_history', {}) ##################
+    prev_forest_area = prev_values.get('forest_area', p.initial_forest_area_ha) ##################
+    planting_history    = prev_values.get('planting_history') ##################
     resident_capacity = prev_values.get('resident_capacity', 0.0) ##################
     transportation_level = prev_values.get('transportation_level', 0.0) ##################
-    prev_municipal_demand = prev_values.get('municipal_demand', params['initial_municipal_demand'])##################
+    prev_municipal_demand = prev_values.get('municipal_demand', p.initial_municipal_demand)##################
     prev_available_water = prev_values.get('available_water', 0.0)
     levee_investment_total = prev_values.get('levee_investment_total', 0.0)
     RnD_investment_total = prev_values.get('RnD_investment_total', 0.0)
-    risky_house_total = prev_values.get('risky_house_total', params['house_total'])
+    risky_house_total = prev_values.get('risky_house_total', p.house_total)
     non_risky_house_total = prev_values.get('non_risky_house_total', 0)
     paddy_dam_area = prev_values.get('paddy_dam_area', 0)
-    temp_threshold_crop = prev_values.get('temp_threshold_crop', params['temp_threshold_crop_ini'])
+    temp_threshold_crop = prev_values.get('temp_threshold_crop', p.temp_threshold_crop_ini)
 
     # --- 意思決定変数を展開 ---
     # モンテカルロモードでは mapping された internal keys が来る前提
@@ -32,152 +41,84 @@ def simulate_year(year, prev_values, decision_vars, params):
     agricultural_RnD_cost        = decision_vars.get('agricultural_RnD_cost', 0)
     transportation_invest        = decision_vars.get('transportation_invest', 0)
 
-    # --- パラメータを展開 ---
-    start_year                    = params['start_year']
-    # 年平均気温
-    base_temp                     = params['base_temp']
-    temp_trend                    = params['temp_trend']
-    temp_uncertainty              = params['temp_uncertainty']
-    # 年降水量
-    base_precip                   = params['base_precip']
-    precip_trend                  = params['precip_trend']
-    base_precip_uncertainty       = params['base_precip_uncertainty']
-    precip_uncertainty_trend      = params['precip_uncertainty_trend']
-    # 高温
-    initial_hot_days              = params['initial_hot_days'] # hot_daysは今後の利用可能性を含め残す（熱中症など）
-    temp_to_hot_days_coeff        = params['temp_to_hot_days_coeff']
-    hot_days_uncertainty          = params['hot_days_uncertainty']
-    # 極端降水
-    base_extreme_precip_freq      = params['base_extreme_precip_freq']
-    extreme_precip_freq_trend     = params['extreme_precip_freq_trend']
-    extreme_precip_intensity_trend= params['extreme_precip_intensity_trend']
-    extreme_precip_uncertainty_trend=params['extreme_precip_uncertainty_trend']
-    base_mu = params['base_mu']
-    base_beta = params['base_beta']
-    # 水需要
-    municipal_demand_trend        = params['municipal_demand_trend']
-    municipal_demand_uncertainty  = params['municipal_demand_uncertainty']
-    # 水循環
-    max_available_water           = params['max_available_water']
-    evapotranspiration_amount     = params['evapotranspiration_amount']
-    ecosystem_threshold           = params['ecosystem_threshold']
-    # 農業
-    temp_coefficient              = params['temp_coefficient']
-    max_potential_yield           = params['max_potential_yield']
-    optimal_irrigation_amount     = params['optimal_irrigation_amount']
-    high_temp_tolerance_increment = params['high_temp_tolerance_increment']
-    necessary_water_for_crops = params['necessary_water_for_crops']
-    paddy_dam_cost_per_ha = params['paddy_dam_cost_per_ha']
-    paddy_dam_yield_coef = params['paddy_dam_yield_coef']
-    temp_critical_crop = params['temp_critical_crop']
-    # 水災害
-    flood_damage_coefficient      = params['flood_damage_coefficient']
-    levee_level_increment         = params['levee_level_increment']
-    levee_investment_threshold    = params['levee_investment_threshold']
-    RnD_investment_threshold      = params['RnD_investment_threshold']
-    levee_investment_required_years = params['levee_investment_required_years']
-    RnD_investment_required_years = params['RnD_investment_required_years']
-    flood_recovery_cost_coef = params['flood_recovery_cost_coef']
-    runoff_coef = params['runoff_coef']
-    # 森林
-    cost_per_1000trees = params['cost_per_1000trees']
-    forest_degradation_rate = params['forest_degradation_rate']
-    tree_growup_year = params['tree_growup_year']
-    co2_absorption_per_ha = params['co2_absorption_per_ha']
-    # 住宅
-    cost_per_migration = params['cost_per_migration']
-    # 住民意識
-    capacity_building_coefficient = params['capacity_building_coefficient']
-    resident_capacity_degrade_ratio = params['resident_capacity_degrade_ratio']
-    # 交通
-    transport_level_coef = params['transport_level_coef']
-    distance_urban_level_coef = params['distance_urban_level_coef']
-    # 領域横断影響
-    forest_flood_reduction_coef = params['forest_flood_reduction_coef'] ### 0.4-2.8 [%/%]
-    forest_water_retention_coef = params['forest_water_retention_coef'] ### 2-4 [mm/%]
-    forest_flood_reduction_coef = np.random.uniform(0.4,2.8)
-    forest_water_retention_coef = np.random.uniform(2,4)
-    # forest_ecosystem_boost_coef = params['forest_ecosystem_boost_coef'] 
-    flood_crop_damage_coef = params['flood_crop_damage_coef']
-    levee_ecosystem_damage_coef = params['levee_ecosystem_damage_coef']
-    flood_urban_damage_coef = params['flood_urban_damage_coef']
-    water_ecosystem_coef = params['water_ecosystem_coef']
-    paddy_dam_flood_coef = params['paddy_dam_flood_coef']
-    # 地形
-    total_area = params['total_area']
-    paddy_field_area = params['paddy_field_area']
-    
+    # --- パラメータ：年依存の項は前計算済みの配列から引く ---
+    i = p.year_index(year)
+    base_temp = p.base_temp
+    total_area = p.total_area
+    paddy_field_area = p.paddy_field_area
+    # 領域横断影響（params の値ではなく毎年一様乱数で決める）
+    forest_flood_reduction_coef = rng.uniform(0.4,2.8) ### 0.4-2.8 [%/%]
+    forest_water_retention_coef = rng.uniform(2,4) ### 2-4 [mm/%]
+
     # resident_density = 1000 # [person/km^2]
     # water_demand_per_resident = 130 # [m3/person]
     # current_municipal_demand = water_water_demand_per_resident * resident_density / 1000 = 130 [mm]
 
     # ---------------------------------------------------------
     # 1. 気象環境 ---
-    temp = base_temp + temp_trend * (year - start_year) + np.random.normal(0, temp_uncertainty)
+    temp = p.temp_mean[i] + rng.normal(0, p.temp_uncertainty)
 
-    precip_unc = base_precip_uncertainty + precip_uncertainty_trend * (year - start_year)
-    precip = max(0, base_precip + precip_trend * (year - start_year) + np.random.normal(0, precip_unc))
+    precip = max(0, p.precip_mean[i] + rng.normal(0, p.precip_unc[i]))
     
-    hot_days = initial_hot_days + (temp - base_temp) * temp_to_hot_days_coeff + np.random.normal(0, hot_days_uncertainty)
+    hot_days = p.initial_hot_days + (temp - base_temp) * p.temp_to_hot_days_coeff + rng.normal(0, p.hot_days_uncertainty)
     hot_days = max(hot_days, 0)
     
-    extreme_precip_freq = max(base_extreme_precip_freq + extreme_precip_freq_trend * (year - start_year), 0)
-    extreme_precip_events = np.random.poisson(extreme_precip_freq)
-    
-    mu = max(base_mu + extreme_precip_intensity_trend * (year - start_year), 0)
-    beta = max(base_beta + extreme_precip_intensity_trend * (year - start_year), 0) 
+    extreme_precip_freq = p.extreme_precip_freq[i]
+    extreme_precip_events = rng.poisson(extreme_precip_freq)
     
-    rain_events = gumbel_r.rvs(loc=mu, scale=beta, size=extreme_precip_events)
+    rain_events = gumbel_inverse_cdf(rng, p.mu[i], p.beta[i], extreme_precip_events)
 
     # ---------------------------------------------------------
     # 2. 社会環境（水需要） ---
-    municipal_growth = municipal_demand_trend + np.random.normal(0, municipal_demand_uncertainty)
+    municipal_growth = p.municipal_demand_trend + rng.normal(0, p.municipal_demand_uncertainty)
     current_municipal_demand = prev_municipal_demand * (1 + municipal_growth)
  
      # ---------------------------------------------------------
     # 3. 森林面積（植林 - 自然減衰） ---
-    planting_history[year] = planting_trees_amount # assume 1000 trees = 1ha
-    matured_trees = planting_history.get(year - tree_growup_year, 0)
-    natural_loss = prev_forest_area * forest_degradation_rate
+    # planting_history は tree_growup_year 年分のリングバッファ（前年までの状態から成熟分を読んでから今年分を記録）
+    if not isinstance(planting_history, PlantingRing):
+        planting_history = PlantingRing.from_value(planting_history, p.tree_growup_year)
+    matured_trees = planting_history.matured(year)
+    planting_history.record(year, planting_trees_amount) # assume 1000 trees = 1ha
+    natural_loss = prev_forest_area * p.forest_degradation_rate
     current_forest_area = max(prev_forest_area + matured_trees - natural_loss, 0)
 
     # #forest_area の効果発現 ---
-    flood_reduction = forest_flood_reduction_coef * ((current_forest_area - total_area * params['initial_forest_area']) / total_area)
+    flood_reduction = forest_flood_reduction_coef * ((current_forest_area - p.initial_forest_area_ha) / total_area)
     water_retention_boost = forest_water_retention_coef * current_forest_area / total_area # 水源涵養効果
-    co2_absorbed = current_forest_area * co2_absorption_per_ha  # tCO2
 
     # ---------------------------------------------------------
     # 4. 利用可能水量（System Dynamicsには未導入）
-    evapotranspiration_amount = evapotranspiration_amount * (1 + (temp - base_temp) * 0.05) # クラウジウス・クラペイロン
+    evapotranspiration_amount = p.evapotranspiration_amount * (1 + (temp - base_temp) * 0.05) # クラウジウス・クラペイロン
     current_available_water = min(
         max(
-            prev_available_water + precip - evapotranspiration_amount - current_municipal_demand - runoff_coef * precip + water_retention_boost * precip,
+            prev_available_water + precip - evapotranspiration_amount - current_municipal_demand - p.runoff_coef * precip + water_retention_boost * precip,
             0
         ),
-        max_available_water
+        p.max_available_water
     )
 
     # ---------------------------------------------------------
     # 5. 農業生産量
     temp_ripening = temp + 10.0 # 仮設定：登熟期の気温の計算
     excess = max(temp_ripening - (temp_threshold_crop + high_temp_tolerance_level), 0)
-    loss = (excess / (temp_critical_crop - temp_threshold_crop))
+    loss = (excess / (p.temp_critical_crop - temp_threshold_crop))
     temp_impact = min(loss, 1)
-    paddy_dam_area += paddy_dam_construction_cost / paddy_dam_cost_per_ha
-    paddy_dam_yield_impact = paddy_dam_yield_coef * min(paddy_dam_area / paddy_field_area, 1)
+    paddy_dam_area += paddy_dam_construction_cost / p.paddy_dam_cost_per_ha
+    paddy_dam_yield_impact = p.paddy_dam_yield_coef * min(paddy_dam_area / paddy_field_area, 1)
 
-    water_impact = min(current_available_water/necessary_water_for_crops, 1.0)
-    current_crop_yield = max((max_potential_yield * (1 - temp_impact)) * water_impact * (1 - paddy_dam_yield_impact),0) # * paddy_field_area [haあたり]
+    water_impact = min(current_available_water/p.necessary_water_for_crops, 1.0)
+    current_crop_yield = max((p.max_potential_yield * (1 - temp_impact)) * water_impact * (1 - paddy_dam_yield_impact),0) # * paddy_field_area [haあたり]
 
     # (4. 農業利用水を利用可能水から引く（System Dynamicsには未導入）)
-    current_available_water = max(current_available_water - necessary_water_for_crops, 0)
+    current_available_water = max(current_available_water - p.necessary_water_for_crops, 0)
 
     # 5.2 農業R&D：累積投資で耐熱性向上（確率的閾値）
     RnD_investment_total += agricultural_RnD_cost
-    RnD_threshold_with_noise = np.random.normal(RnD_investment_threshold * RnD_investment_required_years, RnD_investment_threshold * 0.1)
+    RnD_threshold_with_noise = rng.normal(p.RnD_threshold_mean, p.RnD_investment_threshold * 0.1)
 
     if RnD_investment_total >= RnD_threshold_with_noise:
-        high_temp_tolerance_level += high_temp_tolerance_increment
+        high_temp_tolerance_level += p.high_temp_tolerance_increment
         RnD_investment_total = 0.0
 
     # ---------------------------------------------------------
@@ -190,35 +131,30 @@ def simulate_year(year, prev_values, decision_vars, params):
     # ---------------------------------------------------------
     # 7.1 堤防：累積投資で建設（確率的閾値）
     levee_investment_total += dam_levee_construction_cost
-    levee_threshold_with_noise = np.random.normal(levee_investment_threshold * levee_investment_required_years, levee_investment_threshold * 0.1)
+    levee_threshold_with_noise = rng.normal(p.levee_threshold_mean, p.levee_investment_threshold * 0.1)
 
     if levee_investment_total >= levee_threshold_with_noise:
-        current_levee_level = prev_levee_level + levee_level_increment
+        current_levee_level = prev_levee_level + p.levee_level_increment
         levee_investment_total -= levee_threshold_with_noise # リセット（差額を残す）
     else:
         current_levee_level = prev_levee_level
 
-    # 7.2 水害
-    flood_impact = 0
-    paddy_dam_level = paddy_dam_flood_coef * min(paddy_dam_area / paddy_field_area, 1)
-    for rain in rain_events:
-        overflow_amount = max(rain - current_levee_level - paddy_dam_level, 0) * (1 - flood_reduction)
-        flood_impact = overflow_amount * flood_damage_coefficient
-        # 対策効果は災害規模により段階的に変化（S字カーブ）
-        response_factor = 1 / (1 + np.exp(-0.1 * (overflow_amount - 400)))  # 400mm超過で能力無効に近づく
-        effective_protection = (1 - resident_capacity * (1 - response_factor)) * (1 - migration_ratio * (1 - response_factor))
-        flood_impact += flood_impact * effective_protection
-    
+    # 7.2 水害（イベントごとに被害が上書きされるので、その年の最後のイベントで決まる）
+    paddy_dam_level = p.paddy_dam_flood_coef * min(paddy_dam_area / paddy_field_area, 1)
+    last_rain = rain_events[-1] if extreme_precip_events > 0 else 0.0
+    flood_impact = float(flood_damage(last_rain, extreme_precip_events > 0, current_levee_level, paddy_dam_level,
+                                      flood_reduction, resident_capacity, migration_ratio, p.flood_damage_coefficient))
+
     # # current_flood_damage = extreme_precip_events * flood_impact
     # current_flood_damage = flood_impact * (1 - resident_capacity) * (1 - migration_ratio)
     current_flood_damage = max(flood_impact,0.0)
-    current_crop_yield -= current_flood_damage * flood_crop_damage_coef
+    current_crop_yield -= current_flood_damage * p.flood_crop_damage_coef
 
 
     # ---------------------------------------------------------
     # 8. 損害・生態系の評価
     # Natural resource base (0–1)
-    ecological_base = 0.5 * min(current_forest_area / total_area, 1.0) + 0.5 * min(current_available_water / ecosystem_threshold, 1.0)
+    ecological_base = 0.5 * min(current_forest_area / total_area, 1.0) + 0.5 * min(current_available_water / p.ecosystem_threshold, 1.0)
 
     # Disturbance resistance
     temp_diff = abs(temp - base_temp)
@@ -231,16 +167,16 @@ def simulate_year(year, prev_values, decision_vars, params):
 
     # Weighted ecosystem score
     # w1, w2, w3 = 1/3, 1/3, 1/3
-    weights = np.random.dirichlet([1, 1, 1])
+    weights = rng.dirichlet([1, 1, 1])
     w1, w2, w3 = weights
 
     ecosystem_level = (w1 * ecological_base + w2 * disturbance_resistance + w3 * human_pressure) * 100
 
     # ---------------------------------------------------------
     # 9. 都市の居住可能性の評価（交通面のみ）→ 一旦，土地のすみやすさ，ばらつきを表現
-    transportation_level = transportation_level * 0.95 + transport_level_coef * transportation_invest - 0.01 #ここが非常に怪しい！
-    urban_level = distance_urban_level_coef * (1 - migration_ratio) * transportation_level #平均移動距離が長くなることの効果を算出
-    urban_level -= current_flood_damage * flood_urban_damage_coef
+    transportation_level = transportation_level * 0.95 + p.transport_level_coef * transportation_invest - 0.01 #ここが非常に怪しい！
+    urban_level = p.distance_urban_level_coef * (1 - migration_ratio) * transportation_level #平均移動距離が長くなることの効果を算出
+    urban_level -= current_flood_damage * p.flood_urban_damage_coef
     urban_level = min(max(urban_level, 0), 100)
     # urban_level = (1 - migration_ratio) * 100
 
@@ -248,12 +184,12 @@ def simulate_year(year, prev_values, decision_vars, params):
     # 10. 住民の防災能力・意識
     # resident_capacity = resident_capacity * (1 - resident_capacity_degrade_ratio) + capacity_building_cost * capacity_building_coefficient # 自然減
     # resident_capacity = min(0.95, resident_capacity)
-    resident_capacity = min(0.99, max(0.0, resident_capacity * (1 - resident_capacity_degrade_ratio) + capacity_building_cost * capacity_building_coefficient))
+    resident_capacity = min(0.99, max(0.0, resident_capacity * (1 - p.resident_capacity_degrade_ratio) + capacity_building_cost * p.capacity_building_coefficient))
 
     # ---------------------------------------------------------
     # 11. コスト・住民負担算出
-    planting_trees_cost = planting_trees_amount * cost_per_1000trees
-    migration_cost = house_migration_amount * cost_per_migration
+    planting_trees_cost = planting_trees_amount * p.cost_per_1000trees
+    migration_cost = house_migration_amount * p.cost_per_migration
     municipal_cost = dam_levee_construction_cost * 100_000_000 \
                    + agricultural_RnD_cost * 10_000_000 \
                    + paddy_dam_construction_cost * 1_000_000 \
@@ -262,7 +198,7 @@ def simulate_year(year, prev_values, decision_vars, params):
                    + migration_cost \
                    + transportation_invest * 10_000_000
     resident_burden = municipal_cost / total_house
-    resident_burden += current_flood_damage * flood_recovery_cost_coef / total_house # added
+    resident_burden += current_flood_damage * p.flood_recovery_cost_coef / total_house # added
 
     # --- 出力 ---
     outputs = {
@@ -286,7 +222,7 @@ def simulate_year(year, prev_values, decision_vars, params):
         'RnD investment total': RnD_investment_total,
         'Resident capacity': resident_capacity,
         'Forest Area': current_forest_area,
-        'planting_history': planting_history,
+        'planting_history': None, # include_planting_history のときだけ wire 形式で載せる
         'risky_house_total': risky_house_total,
         'non_risky_house_total': non_risky_house_total,
         'transportation_level' : transportation_level,
@@ -327,18 +263,10 @@ def simulate_year(year, prev_values, decision_vars, params):
         'biodiversity_level': ecosystem_level,
     }
 
-    # 辞書の中のNumPy型をすべてPython標準型に変換する関数を追加
-    def convert_numpy(obj):
-        if isinstance(obj, dict):
-            return {convert_numpy(k): convert_numpy(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [convert_numpy(i) for i in obj]
-        elif isinstance(obj, (np.integer, np.int64)):
-            return int(obj)
-        elif isinstance(obj, (np.floating, np.float64)):
-            return float(obj)
-        else:
-            return obj
+    if include_planting_history:
+        outputs['planting_history'] = planting_history.to_wire()
+    else:
+        del outputs['planting_history']
 
     outputs = convert_numpy(outputs)
     current_values = convert_numpy(current_values)
@@ -346,23 +274,39 @@ def simulate_year(year, prev_values, decision_vars, params):
     return current_values, outputs
 
 
-def simulate_simulation(years, initial_values, decision_vars_list, params):
+# 辞書の中のNumPy型をすべてPython標準型に変換する
+def convert_numpy(obj):
+    if isinstance(obj, dict):
+        return {convert_numpy(k): convert_numpy(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_numpy(i) for i in obj]
+    elif isinstance(obj, (np.integer, np.int64)):
+        return int(obj)
+    elif isinstance(obj, (np.floating, np.float64)):
+        return float(obj)
+    else:
+        return obj
+
+
+def simulate_simulation(years, initial_values, decision_vars_list, params, rng=None, include_planting_history=False):
+    # パラメータは実行ごとに一度だけコンパイルし、年ループでは添字で引く
+    compiled = params
+    if not isinstance(params, CompiledParams):
+        compiled = compile_params(params)
+        if not compiled.covers(years):
+            compiled = compile_params(params, np.concatenate([params['years'], years]))
     prev_values = initial_values.copy()
+    # 呼び出し元の planting_history を書き換えないよう、ここでリングバッファに変換しておく
+    prev_values['planting_history'] = PlantingRing.from_value(initial_values.get('planting_history'), compiled.tree_growup_year)
+    # 意思決定変数は (年 × 変数) の配列に一度だけ変換しておく
+    schedule = compile_decisions(decision_vars_list, years, compiled.start_year).tolist()
     results = []
 
     for idx, year in enumerate(years):
-        # 意思決定変数の取得
-        if isinstance(decision_vars_list, list):
-            # 意思決定変数の取得
-            decision_vars = decision_vars_list[len(decision_vars_list)-1]
-        elif isinstance(decision_vars_list, pd.DataFrame):
-            decision_vars = decision_vars_list.to_dict(orient='records')[0]
-        else:
-            decision_year = (year - params['start_year']) // 10 * 10 + params['start_year']
-            decision_vars_raw = decision_vars_list.loc[decision_year].to_dict()
-            decision_vars = decision_vars_raw
-
-        prev_values, outputs = simulate_year(year, prev_values, decision_vars, params)
+        decision_vars = dict(zip(DECISION_KEYS, schedule[idx]))
+
+        prev_values, outputs = simulate_year(year, prev_values, decision_vars, compiled, rng, include_planting_history)
         results.append(outputs)
 
-    return results
\ No newline at end of file
+    return results
+
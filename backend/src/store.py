@@ -0,0 +1,276 @@
+# store.py
+#
+# 期間スコア（block_scores.tsv）と意思決定ログ（decision_log.csv）の索引付きの保存先（SQLite）。
+# リクエストのたびに TSV 全体を読み込んで combine_first して書き直す代わりに、1行単位の upsert と索引を使った問い合わせにする。
+#
+# - WAL モード（読み込みは書き込みを待たない）。接続はスレッドごとに1つ
+# - block_scores は (user_name, scenario_name, period) が主キー。timestamp にも索引
+# - decisions は追記のみ。(user_name, scenario_name) と timestamp に索引
+# - 初回に既存の TSV / CSV を取り込む（import_files。取り込んだことは meta 表に記録する）
+# - 期間スコアを変える書き込みのたびに meta 表の版（scores_version）を1つ進める（順位表の古さの判定用。別プロセスの書き込みも分かる）
+# - ダウンロード用に、元と同じ形式（タブ区切り・同じ列名・同じ値の表現）の TSV に書き出す（export_block_scores）
+#
+# raw / score（指標ごとの値の辞書）は、pandas の to_csv が書いていたのと同じ文字列で保存する。
+
+import csv
+import io
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+# block_scores.tsv の列（/admin/clear-data が書くヘッダー + 指標ごとの値）
+BLOCK_SCORE_COLUMNS = ['user_name', 'scenario_name', 'period', 'total_score', 'timestamp', 'raw', 'score']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS block_scores (
+    user_name TEXT NOT NULL,
+    scenario_name TEXT NOT NULL,
+    period TEXT NOT NULL,
+    total_score REAL,
+    timestamp TEXT,
+    raw TEXT,
+    score TEXT,
+    PRIMARY KEY (user_name, scenario_name, period)
+);
+CREATE INDEX IF NOT EXISTS block_scores_timestamp ON block_scores (timestamp);
+CREATE TABLE IF NOT EXISTS decisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_name TEXT,
+    scenario_name TEXT,
+    timestamp TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS decisions_user ON decisions (user_name, scenario_name);
+CREATE INDEX IF NOT EXISTS decisions_timestamp ON decisions (timestamp);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('scores_version', '0');
+"""
+
+
+def _text(value):
+    # to_csv と同じ値の表現（欠損は NULL）
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return str(value)
+
+
+class ScoreStore:
+    """期間スコアと意思決定ログの SQLite の保存先"""
+
+    def __init__(self, path, decision_columns):
+        self._path = Path(path)
+        self._decision_columns = list(decision_columns)
+        self._local = threading.local()
+        # block_scores.tsv に書き出した後に変更があったか（ダウンロードのたびに書き直さないように）
+        self._dirty = True
+        self._dirty_lock = threading.Lock()
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        # 自動コミットの接続（読み込みはそれぞれの SELECT が1つの読み込みトランザクションになる）
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        # 書き込みのトランザクション
+        return _Transaction(self._connection())
+
+    @staticmethod
+    def _bump_version(conn):
+        # 書き込みのトランザクションの中で期間スコアの版を進め、新しい版を返す
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'scores_version'")
+        return int(conn.execute("SELECT value FROM meta WHERE key = 'scores_version'").fetchone()[0])
+
+    def scores_version(self):
+        """期間スコアの版（書き込みのたびに1つ進む）"""
+        conn = self._connection()
+        return int(conn.execute("SELECT value FROM meta WHERE key = 'scores_version'").fetchone()[0])
+
+    def _changed(self):
+        with self._dirty_lock:
+            self._dirty = True
+
+    # --- 取り込み ---
+
+    def import_files(self, rank_file, action_log_file):
+        """既存の block_scores.tsv / decision_log.csv を一度だけ取り込む。取り込んだ行数を返す（取り込み済みなら None）"""
+        with self._write() as conn:
+            if conn.execute("SELECT value FROM meta WHERE key = 'imported'").fetchone() is not None:
+                return None
+            counts = {"block_scores": 0, "decisions": 0}
+            rank_file, action_log_file = Path(rank_file), Path(action_log_file)
+            if rank_file.exists() and rank_file.stat().st_size > 0:
+                df = pd.read_csv(rank_file, sep='\t', dtype=str, keep_default_na=False)
+                if 'timestamp' in df.columns:
+                    df = df.sort_values('timestamp', kind='stable')
+                # 同じキーの行は新しい方を残す（/ranking の drop_duplicates(keep='last') と同じ）
+                rows = [self._score_row(record) for record in df.to_dict('records')]
+                conn.executemany(self._upsert_sql(replace=True), rows)
+                counts["block_scores"] = len(rows)
+            if action_log_file.exists() and action_log_file.stat().st_size > 0:
+                df = pd.read_csv(action_log_file, dtype=str, keep_default_na=False)
+                conn.executemany(
+                    "INSERT INTO decisions (user_name, scenario_name, timestamp, record) VALUES (?, ?, ?, ?)",
+                    [self._decision_row(record) for record in df.to_dict('records')]
+                )
+                counts["decisions"] = len(df)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('imported', ?)", (str(counts),))
+            self._bump_version(conn)
+        self._changed()
+        return counts
+
+    # --- 期間スコア ---
+
+    @staticmethod
+    def _score_row(record):
+        values = {column: _text(record.get(column)) for column in BLOCK_SCORE_COLUMNS}
+        if values['total_score'] is not None and values['total_score'] != '':
+            values['total_score'] = float(values['total_score'])
+        else:
+            values['total_score'] = None
+        return values
+
+    @staticmethod
+    def _upsert_sql(replace):
+        columns = ", ".join(BLOCK_SCORE_COLUMNS)
+        placeholders = ", ".join(f":{column}" for column in BLOCK_SCORE_COLUMNS)
+        conflict = "DO UPDATE SET " + ", ".join(
+            f"{column} = excluded.{column}" for column in BLOCK_SCORE_COLUMNS[3:]
+        ) if replace else "DO NOTHING"
+        return (f"INSERT INTO block_scores ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT (user_name, scenario_name, period) {conflict}")
+
+    def add_block_scores(self, user_name, scenario_name, block_scores, timestamp, replace=False):
+        """aggregate_blocks の結果を保存する。replace=False なら既にある (ユーザー, シナリオ, 期間) はそのまま
+        （逐次モードの combine_first と同じく、最初に保存した値を残す）。書き込み後の版を返す"""
+        rows = [self._score_row({**score, 'user_name': user_name, 'scenario_name': scenario_name,
+                                 'timestamp': timestamp}) for score in block_scores]
+        with self._write() as conn:
+            conn.executemany(self._upsert_sql(replace), rows)
+            version = self._bump_version(conn)
+        self._changed()
+        return version
+
+    def replace_user_scores(self, user_name, scenario_name, block_scores, timestamp):
+        """そのユーザーの期間スコアをすべて消してから保存する（結果記録モード）。書き込み後の版を返す"""
+        rows = [self._score_row({**score, 'user_name': user_name, 'scenario_name': scenario_name,
+                                 'timestamp': timestamp}) for score in block_scores]
+        with self._write() as conn:
+            conn.execute("DELETE FROM block_scores WHERE user_name = ?", (user_name,))
+            conn.executemany(self._upsert_sql(replace=True), rows)
+            version = self._bump_version(conn)
+        self._changed()
+        return version
+
+    def block_scores(self, user_name=None):
+        """期間スコアの行（dict のリスト。列は BLOCK_SCORE_COLUMNS）"""
+        sql = f"SELECT {', '.join(BLOCK_SCORE_COLUMNS)} FROM block_scores"
+        args = ()
+        if user_name is not None:
+            sql += " WHERE user_name = ?"
+            args = (user_name,)
+        conn = self._connection()
+        return [dict(row) for row in conn.execute(sql + " ORDER BY timestamp, rowid", args)]
+
+    def block_scores_frame(self, user_name=None):
+        return pd.DataFrame(self.block_scores(user_name), columns=BLOCK_SCORE_COLUMNS)
+
+    def ranking(self):
+        """ユーザーごとの total_score の平均の順位（/ranking と同じ形）"""
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT user_name, AVG(total_score) AS total_score FROM block_scores "
+            "GROUP BY user_name ORDER BY total_score DESC, user_name"
+        ).fetchall()
+        return [{"user_name": row["user_name"], "total_score": row["total_score"], "rank": i + 1}
+                for i, row in enumerate(rows)]
+
+    def user_score(self, user_name):
+        """そのユーザーの total_score の平均（ranking と同じ値。行がなければ None）"""
+        conn = self._connection()
+        return conn.execute("SELECT AVG(total_score) FROM block_scores WHERE user_name = ?", (user_name,)).fetchone()[0]
+
+    def score_stats(self):
+        """(期間スコアの行数, 期間のリスト)"""
+        conn = self._connection()
+        count = conn.execute("SELECT COUNT(*) FROM block_scores").fetchone()[0]
+        periods = [row[0] for row in conn.execute("SELECT DISTINCT period FROM block_scores")]
+        return count, periods
+
+    # --- 意思決定ログ ---
+
+    def _decision_row(self, record):
+        values = {column: _text(record.get(column)) for column in self._decision_columns}
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerow(
+            ['' if values[column] is None else values[column] for column in self._decision_columns])
+        return values.get('user_name'), values.get('scenario_name'), values.get('timestamp'), buffer.getvalue()
+
+    def add_decisions(self, records):
+        with self._write() as conn:
+            conn.executemany("INSERT INTO decisions (user_name, scenario_name, timestamp, record) VALUES (?, ?, ?, ?)",
+                             [self._decision_row(record) for record in records])
+
+    def decisions_csv(self, user_name):
+        """そのユーザーの意思決定ログを decision_log.csv と同じ形式の CSV 文字列で返す（なければ空文字列）"""
+        conn = self._connection()
+        rows = [row[0] for row in conn.execute(
+            "SELECT record FROM decisions WHERE user_name = ? ORDER BY id", (user_name,))]
+        if not rows:
+            return ""
+        header = io.StringIO()
+        csv.writer(header, lineterminator='\n').writerow(self._decision_columns)
+        return header.getvalue() + "".join(rows)
+
+    def count_decisions(self):
+        conn = self._connection()
+        return conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0]
+
+    # --- 書き出し・消去 ---
+
+    def export_block_scores(self, path, force=False):
+        """block_scores.tsv と同じ形式で書き出す（前回から変更がなければ何もしない）"""
+        path = Path(path)
+        with self._dirty_lock:
+            if not (self._dirty or force or not path.exists()):
+                return False
+            self._dirty = False
+        temporary = path.with_name(path.name + ".tmp")
+        self.block_scores_frame().to_csv(temporary, sep='\t', index=False)
+        os.replace(temporary, path)
+        return True
+
+    def clear(self):
+        with self._write() as conn:
+            conn.execute("DELETE FROM block_scores")
+            conn.execute("DELETE FROM decisions")
+            self._bump_version(conn)
+        self._changed()
+
+
+class _Transaction:
+    """with で BEGIN IMMEDIATE 〜 COMMIT（例外なら ROLLBACK）を行う接続のラッパー"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
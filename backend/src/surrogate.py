@@ -0,0 +1,535 @@
+# surrogate.py
+#
+# 予測モード（Predict Simulation Mode）用の代理モデル（エミュレータ）。
+# (RCP, 意思決定の年) ごとに、「その年の状態 + その年以降の意思決定」から、2100 年までの
+# 主要な軌跡の期待値と帯（5% / 50% / 95% 点）、期間ごとの total_score の期待値と帯を、ミリ秒未満で返す。
+#
+# 学習データはバッチ版エンジンで作る（オフラインの train_surrogate.py か、パラメータが変わったときのサーバーの自動再学習）。
+#   1. 基準の初期状態（REFERENCE_STATE。画面の初期値と同じ）から、意思決定の年の前までを、
+#      期間ごとにランダムな意思決定で1本ずつ計算して、意思決定の年の状態を多数作る
+#   2. 各状態から、ランダムな意思決定（予測モードと同じく 2100 年まで一定）で replicates 本ずつ計算し、
+#      軌跡の平均と分位点、期間ごとの指標の raw（aggregate_blocks と同じ集計）の平均と分位点を目的変数にする
+# 期間スコアは、予測した raw を _scale_to_100 と同じ変換で点数にして平均する（点数は 0〜100 で切り詰められて
+# 折れ曲がるので、滑らかな raw の方を当てはめる）。帯は指標ごとの分位点を点数にして平均した近似。
+# モデルは、標準化した特徴量の2次多項式のリッジ回帰。目的変数（年 × 列 × 統計量）は主成分に圧縮してから当てはめる。
+# 学習に使わなかった状態で精度（R² と平均絶対誤差）を測り、レポートとして保存する。
+#
+# モデルのファイルには DEFAULT_PARAMS・RCP のパラメータ・学習条件のハッシュ（fingerprint）を入れておき、
+# 起動時に一致しなければ作り直す（SurrogateStore.retrain_async）。
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from decisions import DECISION_KEYS
+from ensemble import OUTPUT_COLUMNS, draw_noise, simulate_ensemble
+from forcing import generate_forcing
+from metrics import BLOCK_METRICS, block_raw_values, block_total_scores, scale_to_100
+from optimizer import LEVER_UNITS, build_schedules, period_starts
+from planting import PlantingRing
+
+# 学習データの作り方やモデルの形を変えたら上げる（fingerprint が変わり、自動で作り直される）
+SURROGATE_VERSION = 1
+
+# 予測する軌跡の列
+SURROGATE_COLUMNS = [
+    'Temperature (℃)', 'Precipitation (mm)', 'Available Water', 'Crop Yield', 'Flood Damage',
+    'Ecosystem Level', 'Municipal Cost', 'Urban Level', 'Resident Burden', 'Forest Area',
+]
+BAND_STATS = ("mean", "q05", "q50", "q95")
+BLOCK_STATS = ("mean", "q05", "q95")
+
+# 年をまたいで引き継がれる状態（simulate_ensemble の初期値のキー → 出力列）
+STATE_COLUMNS = {
+    'levee_level': 'Levee Level',
+    'high_temp_tolerance_level': 'High Temp Tolerance Level',
+    'forest_area': 'Forest Area',
+    'resident_capacity': 'Resident capacity',
+    'transportation_level': 'transportation_level',
+    'municipal_demand': 'Municipal Demand',
+    'available_water': 'Available Water',
+    'levee_investment_total': 'Levee investment total',
+    'RnD_investment_total': 'RnD investment total',
+    'risky_house_total': 'risky_house_total',
+    'non_risky_house_total': 'non_risky_house_total',
+    'paddy_dam_area': 'paddy_dam_area',
+}
+# 植林履歴（まだ育っていない分）は、この年数ごとの合計を特徴量にする
+PLANTING_BIN_YEARS = 5
+
+# 学習の起点にする初期状態（画面の currentValues の初期値と同じ）
+REFERENCE_STATE = {
+    'temp': 15, 'precip': 1700, 'municipal_demand': 100, 'available_water': 1000, 'crop_yield': 100,
+    'hot_days': 30, 'extreme_precip_freq': 0.1, 'ecosystem_level': 100, 'levee_level': 0.5,
+    'high_temp_tolerance_level': 0, 'forest_area': 0, 'planting_history': {}, 'urban_level': 100,
+    'resident_capacity': 0, 'transportation_level': 0, 'levee_investment_total': 0, 'RnD_investment_total': 0,
+    'risky_house_total': 10000, 'non_risky_house_total': 0, 'resident_burden': 5.379e8, 'biodiversity_level': 100,
+}
+
+# 学習条件（(RCP, 年) ごとの状態の数と、各状態から計算する本数）
+TRAINING_STATES = 1536
+TRAINING_REPLICATES = 16
+# 学習データを1つのタスクで計算する状態の数
+TRAINING_CHUNK_STATES = 128
+# 精度の評価に取り分ける割合
+TEST_FRACTION = 0.2
+# 主成分の数の上限と、残す分散の割合
+MAX_COMPONENTS = 40
+EXPLAINED_VARIANCE = 0.9999
+# リッジの正則化の強さの候補（取り分けたデータの誤差で選ぶ）
+RIDGE_GRID = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)
+
+
+def _state_default(key, params):
+    # simulate_ensemble の _init と同じ既定値
+    if key == 'forest_area':
+        return params['total_area'] * params['initial_forest_area']
+    if key == 'municipal_demand':
+        return params['initial_municipal_demand']
+    if key == 'risky_house_total':
+        return params['house_total']
+    return 0.0
+
+
+def feature_names(params):
+    bins = -(-int(params['tree_growup_year']) // PLANTING_BIN_YEARS)
+    return list(STATE_COLUMNS) + [f"planting_{k}" for k in range(bins)] + list(DECISION_KEYS)
+
+
+def ring_amounts(ring, year):
+    """year の前の length 年分（古い順）の植林量。(length,) または (length × シミュレーション数)"""
+    length = ring.length
+    years = np.arange(year - length, year)
+    amounts = np.zeros((length,) + ring.amounts.shape[1:])
+    if ring.last_year is not None:
+        valid = (years > ring.last_year - length) & (years <= ring.last_year)
+        amounts[valid] = ring.amounts[years[valid] % length]
+    return amounts
+
+
+def build_features(states, amounts, decisions):
+    """states: {キー: (n,)}、amounts: (length × n) の植林量（古い順）、decisions: (n × len(DECISION_KEYS)) から (n × 特徴量数)"""
+    bins = np.array_split(np.asarray(amounts), -(-len(amounts) // PLANTING_BIN_YEARS), axis=0)
+    columns = [np.asarray(states[key], dtype=np.float64) for key in STATE_COLUMNS]
+    columns += [b.sum(axis=0) for b in bins]
+    return np.column_stack(columns + [np.asarray(decisions, dtype=np.float64)])
+
+
+def request_features(initial_values, decisions, decision_year, params):
+    """リクエストの current_year_index_seq と意思決定（{キー: 値}）から特徴量 (1 × 特徴量数)"""
+    states = {key: [float(initial_values.get(key, _state_default(key, params)) or 0.0)] for key in STATE_COLUMNS}
+    ring = PlantingRing.from_value(initial_values.get('planting_history'), params['tree_growup_year'])
+    amounts = ring_amounts(ring, decision_year)[:, np.newaxis]
+    return build_features(states, amounts, [[float(decisions.get(key, 0.0)) for key in DECISION_KEYS]])
+
+
+def training_chunk(years, params, reference, decision_year, designs, seed, replicates, state_start):
+    """状態 [state_start, state_start + len(designs)) の学習データ (特徴量, 目的変数) を作る
+
+    designs は (状態数 × 期間数 × len(DECISION_KEYS))。最後の期間の値を意思決定の年以降に使い、
+    それより前の期間の値で意思決定の年までの状態を作る。
+    """
+    years = np.asarray(years)
+    m = len(designs)
+    first_seed, second_seed = np.random.SeedSequence(seed).generate_state(2)
+    planting = DECISION_KEYS.index('planting_trees_amount')
+    ring = PlantingRing.from_value(reference.get('planting_history'), params['tree_growup_year']).broadcast(m)
+
+    # 1. 意思決定の年の前まで（1本ずつ）
+    prefix = years[years < decision_year]
+    if len(prefix):
+        starts = period_starts(prefix)
+        schedules = build_schedules(np.zeros((len(prefix), len(DECISION_KEYS))), prefix, starts, DECISION_KEYS,
+                                    designs[:, :len(starts)])
+        forcing = generate_forcing(prefix, params, first_seed, m, sim_start=state_start)
+        noise = draw_noise(first_seed, state_start, state_start + m, len(prefix))
+        out = simulate_ensemble(prefix, reference, schedules, params, forcing, noise)
+        states = {key: out[:, -1, OUTPUT_COLUMNS.index(column)] for key, column in STATE_COLUMNS.items()}
+        for t, year in enumerate(prefix):
+            ring.record(year, schedules[:, t, planting])
+    else:
+        states = {key: np.full(m, float(reference.get(key, _state_default(key, params)))) for key in STATE_COLUMNS}
+    decisions = designs[:, -1]
+    features = build_features(states, ring_amounts(ring, decision_year), decisions)
+
+    # 2. 意思決定の年から 2100 年まで（各状態から replicates 本）
+    horizon = years[years >= decision_year]
+    n = m * replicates
+    initial = dict(reference)
+    initial.update({key: np.repeat(values, replicates) for key, values in states.items()})
+    replicated = PlantingRing(ring.length)
+    replicated.amounts = np.repeat(ring.amounts, replicates, axis=1)
+    replicated.last_year = ring.last_year
+    initial['planting_history'] = replicated
+    schedules = np.repeat(decisions[:, np.newaxis, :], len(horizon), axis=1).repeat(replicates, axis=0)
+    forcing = generate_forcing(horizon, params, second_seed, n, sim_start=state_start * replicates)
+    noise = draw_noise(second_seed, state_start * replicates, state_start * replicates + n, len(horizon))
+    out = simulate_ensemble(horizon, initial, schedules, params, forcing, noise)
+    out = out.reshape(m, replicates, len(horizon), -1)
+    return features, _targets(out), _score_stats(out)
+
+
+def _targets(out):
+    # (状態数 × replicates × 年 × 出力列) から、目的変数 (状態数 × 目的変数の数) を作る。並びは unpack と同じ
+    parts = []
+    for column in SURROGATE_COLUMNS:
+        values = out[:, :, :, OUTPUT_COLUMNS.index(column)]
+        parts.append(values.mean(axis=1))
+        parts.extend(np.quantile(values, [0.05, 0.5, 0.95], axis=1))
+    m, r = out.shape[:2]
+    for raw in block_raw_values(out.reshape(m * r, *out.shape[2:])).values():
+        for metric in BLOCK_METRICS:
+            values = raw[metric].reshape(m, r)
+            parts.append(values.mean(axis=1)[:, np.newaxis])
+            parts.extend(q[:, np.newaxis] for q in np.quantile(values, [0.05, 0.95], axis=1))
+    return np.concatenate(parts, axis=1)
+
+
+def _score_stats(out):
+    # 精度の評価用に、実際の期間ごとの total_score の (平均, 5%, 95%) 点 (状態数 × 期間数 × 3)
+    m, r = out.shape[:2]
+    totals = block_total_scores(out.reshape(m * r, *out.shape[2:]))
+    stats = [np.stack([scores.reshape(m, r).mean(axis=1), *np.quantile(scores.reshape(m, r), [0.05, 0.95], axis=1)],
+                      axis=1) for scores in totals.values()]
+    return np.stack(stats, axis=1)
+
+
+def block_labels(years):
+    from utils import BLOCKS
+    years = np.asarray(years)
+    return [label for start, end, label in BLOCKS if ((years >= start) & (years <= end)).any()]
+
+
+def _expand(z):
+    # 2次の多項式の項（定数・1次・2次の積）
+    n, d = z.shape
+    i, j = np.triu_indices(d)
+    return np.hstack([np.ones((n, 1)), z, z[:, i] * z[:, j]])
+
+
+def _r2(actual, predicted):
+    total = ((actual - actual.mean()) ** 2).sum()
+    if total <= 1e-12 * max(1.0, (actual ** 2).sum()):
+        return None
+    return float(1 - ((actual - predicted) ** 2).sum() / total)
+
+
+class SurrogateModel:
+    """1つの (RCP, 意思決定の年) の代理モデル"""
+
+    ARRAYS = ('x_mean', 'x_scale', 'x_min', 'x_max', 'y_mean', 'y_scale', 'components', 'coef')
+
+    def __init__(self, rcp, decision_year, years, labels, report=None, **arrays):
+        self.rcp = float(rcp)
+        self.decision_year = int(decision_year)
+        self.years = [int(year) for year in years]
+        self.labels = list(labels)
+        self.report = report or {}
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def fit(cls, rcp, decision_year, years, features, targets, score_stats, seed=0):
+        """学習用と評価用に分けて正則化の強さを選び、精度を測ってから、全データで当てはめ直す"""
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(features))
+        num_test = max(1, int(len(features) * TEST_FRACTION))
+        test, train = order[:num_test], order[num_test:]
+        labels = block_labels(years)
+
+        best = None
+        for ridge, model in zip(RIDGE_GRID, cls._fit_arrays(rcp, decision_year, years, labels, features[train],
+                                                            targets[train], RIDGE_GRID)):
+            error = np.mean(((model.predict_raw(features[test]) - targets[test]) / model.y_scale) ** 2)
+            if best is None or error < best[0]:
+                best = (error, ridge, model)
+        _, ridge, model = best
+        report = model._accuracy(features[test], targets[test], score_stats[test])
+        report.update({"ridge": ridge, "num_train": int(len(train)), "num_test": int(num_test),
+                       "components": int(len(model.components) - len(labels) * len(BLOCK_METRICS) * len(BLOCK_STATS))})
+        model, = cls._fit_arrays(rcp, decision_year, years, labels, features, targets, [ridge])
+        model.report = report
+        return model
+
+    @classmethod
+    def _fit_arrays(cls, rcp, decision_year, years, labels, features, targets, ridges):
+        # 主成分と多項式の行列は正則化の強さによらないので、一度だけ計算して ridges の数だけモデルを返す
+        x_mean, x_scale = features.mean(axis=0), features.std(axis=0)
+        x_scale[x_scale == 0] = 1.0
+        y_mean, y_scale = targets.mean(axis=0), targets.std(axis=0)
+        y_scale[y_scale == 0] = 1.0
+        y = (targets - y_mean) / y_scale
+        # 軌跡だけを主成分に圧縮し、期間の raw（少数）はそのまま当てはめる（圧縮の誤差が点数に効かないように）
+        width = len(SURROGATE_COLUMNS) * len(BAND_STATS) * len(years)
+        _, singular, vt = np.linalg.svd(y[:, :width], full_matrices=False)
+        explained = np.cumsum(singular ** 2) / max((singular ** 2).sum(), 1e-300)
+        k = int(min(MAX_COMPONENTS, np.searchsorted(explained, EXPLAINED_VARIANCE) + 1, len(vt)))
+        components = np.zeros((k + y.shape[1] - width, y.shape[1]))
+        components[:k, :width] = vt[:k]
+        components[k:, width:] = np.eye(y.shape[1] - width)
+        design = _expand((features - x_mean) / x_scale)
+        gram = design.T @ design
+        rhs = design.T @ (y @ components.T)
+        return [
+            cls(rcp, decision_year, years, labels, x_mean=x_mean, x_scale=x_scale, x_min=features.min(axis=0),
+                x_max=features.max(axis=0), y_mean=y_mean, y_scale=y_scale, components=components,
+                coef=np.linalg.solve(gram + ridge * len(design) * np.eye(len(gram)), rhs))
+            for ridge in ridges
+        ]
+
+    def predict_raw(self, features):
+        """特徴量 (n × 特徴量数) から目的変数 (n × 目的変数の数)"""
+        design = _expand((np.asarray(features, dtype=np.float64) - self.x_mean) / self.x_scale)
+        return (design @ self.coef @ self.components) * self.y_scale + self.y_mean
+
+    def unpack(self, row):
+        """目的変数の1行を {"trajectories": {列: {統計量: [年ごと]}}, "block_scores": {期間: {統計量: 値}}} にする"""
+        n_years = len(self.years)
+        trajectories = {}
+        offset = 0
+        for column in SURROGATE_COLUMNS:
+            stats = {}
+            for stat in BAND_STATS:
+                stats[stat] = row[offset:offset + n_years]
+                offset += n_years
+            # 帯が交差しないように揃える
+            stats["q05"] = np.minimum(stats["q05"], stats["q50"])
+            stats["q95"] = np.maximum(stats["q95"], stats["q50"])
+            trajectories[column] = {stat: values.tolist() for stat, values in stats.items()}
+        raw, scores = self.block_scores(row[np.newaxis])
+        blocks = {}
+        for b, label in enumerate(self.labels):
+            mean, low, high = scores[0, b].mean(axis=0)
+            blocks[label] = {
+                "mean": float(mean), "q05": float(low), "q95": float(high),
+                "metrics": {metric: {"raw": float(raw[0, b, i, 0]), "score": float(scores[0, b, i, 0])}
+                            for i, metric in enumerate(BLOCK_METRICS)},
+            }
+        return {"trajectories": trajectories, "block_scores": blocks}
+
+    def block_scores(self, predicted):
+        """予測した目的変数 (n × 目的変数の数) から、期間・指標ごとの raw と点数 (n × 期間数 × 指標数 × (平均, 5%, 95%))
+
+        点数の帯は raw の分位点を点数にしたもの（小さいほど良い指標では 5% と 95% が入れ替わる）。
+        """
+        width = len(SURROGATE_COLUMNS) * len(BAND_STATS) * len(self.years)
+        raw = predicted[:, width:].reshape(len(predicted), len(self.labels), len(BLOCK_METRICS), len(BLOCK_STATS))
+        scores = np.stack([scale_to_100(raw[:, :, i], metric) for i, metric in enumerate(BLOCK_METRICS)], axis=2)
+        low = np.minimum(scores[..., 1], scores[..., 2])
+        high = np.maximum(scores[..., 1], scores[..., 2])
+        mean = scores[..., 0]
+        return raw, np.stack([mean, np.minimum(low, mean), np.maximum(high, mean)], axis=-1)
+
+    def _accuracy(self, features, targets, score_stats):
+        # 軌跡は目的変数そのもの、期間スコアは実際の total_score（score_stats）と比べる
+        predicted = self.predict_raw(features)
+        n_years = len(self.years)
+        report = {"trajectories": {}, "block_scores": {}}
+        offset = 0
+        for column in SURROGATE_COLUMNS:
+            width = n_years * len(BAND_STATS)
+            actual, guess = targets[:, offset:offset + width], predicted[:, offset:offset + width]
+            report["trajectories"][column] = {
+                "r2_mean": _r2(actual[:, :n_years], guess[:, :n_years]),
+                "r2_band": _r2(actual[:, n_years:], guess[:, n_years:]),
+                "mae_mean": float(np.abs(actual[:, :n_years] - guess[:, :n_years]).mean()),
+            }
+            offset += width
+        totals = self.block_scores(predicted)[1].mean(axis=2)
+        for b, label in enumerate(self.labels):
+            actual, guess = score_stats[:, b], totals[:, b]
+            report["block_scores"][label] = {
+                "r2": _r2(actual[:, 0], guess[:, 0]),
+                "mae": float(np.abs(actual[:, 0] - guess[:, 0]).mean()),
+                "band_mae": float(np.abs(actual[:, 1:] - guess[:, 1:]).mean()),
+            }
+        return report
+
+    def out_of_range(self, features, names):
+        """学習データの範囲（少し余裕を持たせる）の外にある特徴量の名前"""
+        margin = 0.05 * (self.x_max - self.x_min) + 1e-9
+        row = np.asarray(features)[0]
+        return [name for name, value, low, high in zip(names, row, self.x_min - margin, self.x_max + margin)
+                if not low <= value <= high]
+
+
+def surrogate_fingerprint(default_params, rcp_params):
+    """モデルを作り直すべきかを判定するハッシュ（パラメータ・学習条件・バージョン）"""
+    payload = {
+        "params": {name: (value.tolist() if isinstance(value, np.ndarray) else value) for name, value in default_params.items()},
+        "rcp": {str(rcp): values for rcp, values in rcp_params.items()},
+        "reference": REFERENCE_STATE,
+        "training": [TRAINING_STATES, TRAINING_REPLICATES, TEST_FRACTION, MAX_COMPONENTS, EXPLAINED_VARIANCE, RIDGE_GRID],
+        "version": SURROGATE_VERSION,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def train_surrogates(pool, default_params, rcp_params, lever_levels, seed=0, num_states=TRAINING_STATES,
+                     replicates=TRAINING_REPLICATES, progress=None):
+    """すべての (RCP, 意思決定の年) の代理モデルを学習して {(RCP, 年): SurrogateModel} を返す"""
+    models = {}
+    years = np.asarray(default_params['years'])
+    starts = period_starts(years)
+    units = np.array([LEVER_UNITS[key] for key in DECISION_KEYS])
+    upper = np.array([lever_levels[key] for key in DECISION_KEYS]) * units
+    for r, (rcp, overrides) in enumerate(sorted(rcp_params.items())):
+        params = dict(default_params, **overrides)
+        for decision_year in starts:
+            started = time.time()
+            model_seed = int(np.random.SeedSequence([seed, r, int(decision_year)]).generate_state(1)[0])
+            rng = np.random.default_rng(model_seed)
+            num_periods = starts.index(decision_year) + 1
+            # 半分はゲームで入力できる段階（0 を含む）、残りは範囲内の連続値
+            designs = rng.random((num_states, num_periods, len(DECISION_KEYS))) * upper
+            grid = rng.random(num_states) < 0.5
+            designs[grid] = np.round(designs[grid] / units) * units
+            tasks = [
+                (years, params, REFERENCE_STATE, decision_year, designs[start:start + TRAINING_CHUNK_STATES],
+                 model_seed, replicates, start)
+                for start in range(0, num_states, TRAINING_CHUNK_STATES)
+            ]
+            results = pool.map(training_chunk, tasks)
+            features = np.concatenate([features for features, _, _ in results])
+            targets = np.concatenate([targets for _, targets, _ in results])
+            score_stats = np.concatenate([stats for _, _, stats in results])
+            model = SurrogateModel.fit(rcp, decision_year, years[years >= decision_year], features, targets, score_stats,
+                                       model_seed)
+            model.report["training_seconds"] = time.time() - started
+            models[(float(rcp), int(decision_year))] = model
+            if progress is not None:
+                progress(rcp, decision_year, model)
+    return models
+
+
+class SurrogateStore:
+    """代理モデルの集合の保存・読み込み・予測と、バックグラウンドでの再学習"""
+
+    def __init__(self, path):
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._models = {}
+        self._fingerprint = None
+        self._trained_at = None
+        self._training = None
+        self._error = None
+
+    def load(self, fingerprint):
+        """ファイルがあり fingerprint が一致すれば読み込んで True"""
+        if not self._path.exists():
+            return False
+        with np.load(self._path, allow_pickle=False) as data:
+            meta = json.loads(str(data["__meta__"]))
+            if meta.get("fingerprint") != fingerprint:
+                return False
+            models = {}
+            for entry in meta["models"]:
+                prefix = f"{entry['rcp']}|{entry['decision_year']}|"
+                arrays = {name: data[prefix + name] for name in SurrogateModel.ARRAYS}
+                model = SurrogateModel(entry["rcp"], entry["decision_year"], entry["years"], entry["labels"],
+                                       entry["report"], **arrays)
+                models[(model.rcp, model.decision_year)] = model
+        with self._lock:
+            self._models = models
+            self._fingerprint = fingerprint
+            self._trained_at = meta.get("trained_at")
+        return True
+
+    def save(self, models, fingerprint):
+        arrays = {}
+        entries = []
+        for (rcp, decision_year), model in sorted(models.items()):
+            entries.append({"rcp": rcp, "decision_year": decision_year, "years": model.years, "labels": model.labels,
+                            "report": model.report})
+            for name in SurrogateModel.ARRAYS:
+                arrays[f"{rcp}|{decision_year}|{name}"] = getattr(model, name)
+        trained_at = datetime.now().isoformat()
+        arrays["__meta__"] = np.array(json.dumps({"fingerprint": fingerprint, "trained_at": trained_at, "models": entries}))
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        temporary = self._path.with_name(self._path.name + ".tmp.npz")
+        np.savez_compressed(temporary, **arrays)
+        os.replace(temporary, self._path)
+        with self._lock:
+            self._models = dict(models)
+            self._fingerprint = fingerprint
+            self._trained_at = trained_at
+
+    def retrain_async(self, pool, default_params, rcp_params, lever_levels, fingerprint, seed=0):
+        """バックグラウンドのスレッドで学習して保存する（学習中なら何もしない）。開始したら True"""
+        with self._lock:
+            if self._training is not None:
+                return False
+            self._training = {"started_at": datetime.now().isoformat(), "completed": 0,
+                              "total": len(rcp_params) * len(period_starts(default_params['years']))}
+            self._error = None
+
+        def progress(rcp, decision_year, model):
+            with self._lock:
+                self._training["completed"] += 1
+            print(f"🧠 [Surrogate] RCP {rcp} / {decision_year} 年模型训练完成（{model.report['training_seconds']:.1f} 秒）")
+
+        def run():
+            try:
+                models = train_surrogates(pool, default_params, rcp_params, lever_levels, seed=seed, progress=progress)
+                self.save(models, fingerprint)
+                print(f"✅ [Surrogate] 代理模型已保存: {self._path}")
+            except Exception as e:
+                print(f"❌ [Surrogate] 代理模型训练失败: {e}")
+                with self._lock:
+                    self._error = str(e)
+            finally:
+                with self._lock:
+                    self._training = None
+
+        threading.Thread(target=run, name="surrogate-training", daemon=True).start()
+        return True
+
+    def ready(self, fingerprint):
+        with self._lock:
+            return bool(self._models) and self._fingerprint == fingerprint
+
+    def get(self, rcp, decision_year):
+        with self._lock:
+            return self._models.get((float(rcp), int(decision_year)))
+
+    def predict(self, rcp, decision_year, initial_values, decisions, params):
+        """1つの状態・意思決定の予測。該当するモデルがなければ KeyError"""
+        model = self.get(rcp, decision_year)
+        if model is None:
+            raise KeyError((rcp, decision_year))
+        started = time.perf_counter()
+        features = request_features(initial_values, decisions, decision_year, params)
+        result = model.unpack(model.predict_raw(features)[0])
+        elapsed = time.perf_counter() - started
+        out_of_range = model.out_of_range(features, feature_names(params))
+        return {
+            "rcp": model.rcp,
+            "decision_year": model.decision_year,
+            "years": model.years,
+            **result,
+            "extrapolated": bool(out_of_range),
+            "out_of_range": out_of_range,
+            "elapsed_ms": elapsed * 1000,
+        }
+
+    def status(self):
+        with self._lock:
+            return {
+                "ready": bool(self._models),
+                "fingerprint": self._fingerprint,
+                "trained_at": self._trained_at,
+                "models": [{"rcp": rcp, "decision_year": year} for rcp, year in sorted(self._models)],
+                "training": dict(self._training) if self._training is not None else None,
+                "error": self._error,
+            }
+
+    def report(self):
+        with self._lock:
+            return {f"{rcp}/{year}": model.report for (rcp, year), model in sorted(self._models.items())}
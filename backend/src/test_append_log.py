@@ -0,0 +1,53 @@
+# test_append_log.py
+#
+# AppendOnlyCsv が、書き込みに失敗した行を捨てずに flush / status で知らせ、書けるようになったら書き直すことの確認。
+
+import csv
+
+import pytest
+
+from append_log import AppendOnlyCsv
+
+COLUMNS = ['user_name', 'value']
+
+
+def read_rows(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_rows_are_written_in_order_with_one_header(tmp_path):
+    log = AppendOnlyCsv(tmp_path / "log.csv", COLUMNS, fsync="always")
+    for i in range(10):
+        log.append({'user_name': f"user{i}", 'value': i})
+    assert log.flush(5)
+    log.close()
+    assert read_rows(tmp_path / "log.csv") == [COLUMNS] + [[f"user{i}", str(i)] for i in range(10)]
+
+
+def test_failed_batch_is_reported_and_retried(tmp_path):
+    path = tmp_path / "log.csv"
+    # 同じ名前のディレクトリがあるうちは書き込めない
+    path.mkdir()
+    log = AppendOnlyCsv(path, COLUMNS, fsync="never")
+    log.append({'user_name': "a", 'value': 1})
+    with pytest.raises(OSError):
+        log.flush(5)
+    status = log.status()
+    assert status["pending"] == 1 and status["failed"] == 1 and status["error"]
+
+    path.rmdir()
+    log.append({'user_name': "b", 'value': 2})
+    assert log.flush(5)
+    assert log.status()["error"] is None and log.status()["pending"] == 0
+    log.close()
+    assert read_rows(path) == [COLUMNS, ["a", "1"], ["b", "2"]]
+
+
+def test_close_raises_when_rows_cannot_be_written(tmp_path):
+    path = tmp_path / "log.csv"
+    path.mkdir()
+    log = AppendOnlyCsv(path, COLUMNS, fsync="never")
+    log.append({'user_name': "a", 'value': 1})
+    with pytest.raises(OSError):
+        log.close(5)
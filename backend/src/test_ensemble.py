@@ -0,0 +1,95 @@
+# test_ensemble.py
+#
+# バッチ版エンジン（simulate_ensemble）が参照実装（simulate_simulation）と行ごとに同じ値を出すことの確認。
+# 参照実装には、バッチ版が使った乱数（気候外力のブロックの系列と、シミュレーションごとの系列）を
+# simulate_year が引く順に返す Generator の代わり（ReplayRng）を渡して、同じ乱数の下で比べる。
+
+import numpy as np
+
+from ensemble import OUTPUT_COLUMNS, draw_noise, simulate_ensemble
+from forcing import FORCING_BLOCK, FORCING_STREAM, generate_forcing
+from simulation import simulate_simulation
+
+
+class ReplayRng:
+    """決めておいた乱数を simulate_year が引く順に返す（引き方や引数が食い違えば AssertionError）"""
+
+    def __init__(self, draws):
+        self._draws = iter(draws)
+
+    def _next(self, kind, *args):
+        expected_kind, expected_args, value = next(self._draws)
+        assert (kind, args) == (expected_kind, expected_args)
+        return value
+
+    def uniform(self, low, high):
+        return self._next('uniform', low, high)
+
+    def normal(self, loc, scale):
+        return loc + scale * self._next('normal')
+
+    def poisson(self, lam):
+        return self._next('poisson')
+
+    def random(self, size=None):
+        return self._next('random', size)
+
+    def dirichlet(self, alpha):
+        return self._next('dirichlet', tuple(alpha))
+
+    def exhausted(self):
+        return next(self._draws, None) is None
+
+
+def replay_draws(years, params, seed, num_simulations):
+    """バッチ版エンジンが使った乱数を、シミュレーションごとに simulate_year の引く順に並べる
+
+    一様乱数は simulate_ensemble と同じ式で係数にしたものを返す（0.4 + 2.4u と 0.4 + (2.8 - 0.4)u は丸めが違う）。
+    """
+    n_years = len(years)
+    noise = draw_noise(seed, 0, num_simulations, n_years)
+    # 気候外力の 0 番目のブロックの系列（forcing._generate_block と同じ順：正規 3 つ、Poisson、Gumbel 用の一様乱数）
+    rng = np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(FORCING_STREAM, 0))))
+    weather = [rng.standard_normal((FORCING_BLOCK, n_years)) for _ in range(3)]
+    elapsed = np.asarray(years) - params['start_year']
+    events = rng.poisson(np.maximum(params['base_extreme_precip_freq'] + params['extreme_precip_freq_trend'] * elapsed, 0),
+                         (FORCING_BLOCK, n_years))
+    uniforms = rng.random(events.sum())
+    starts = np.concatenate([[0], np.cumsum(events.ravel())])
+
+    draws = []
+    for i in range(num_simulations):
+        sim = []
+        for t in range(n_years):
+            z, u = noise['normal'][i, t], noise['uniform'][i, t]
+            start, count = starts[i * n_years + t], int(events[i, t])
+            sim += [
+                ('uniform', (0.4, 2.8), 0.4 + 2.4 * u[0]),
+                ('uniform', (2, 4), 2 + 2 * u[1]),
+                ('normal', (), weather[0][i, t]),
+                ('normal', (), weather[1][i, t]),
+                ('normal', (), weather[2][i, t]),
+                ('poisson', (), count),
+                ('random', (count,), uniforms[start:start + count]),
+                ('normal', (), z[0]),
+                ('normal', (), z[1]),
+                ('normal', (), z[2]),
+                ('dirichlet', ((1, 1, 1),), noise['weights'][i, t]),
+            ]
+        draws.append(sim)
+    return noise, draws
+
+
+def test_simulate_ensemble_matches_simulate_simulation(scenario):
+    years, params, seed = scenario['years'], scenario['params'], scenario['seed']
+    initial_values, decisions = scenario['initial_values'], scenario['decisions']
+    forcing = generate_forcing(years, params, seed, scenario['num_simulations'])
+    noise, draws = replay_draws(years, params, seed, scenario['num_simulations'])
+    batched = simulate_ensemble(years, initial_values, decisions, params, forcing, noise)
+
+    for i, sim_draws in enumerate(draws):
+        rng = ReplayRng(sim_draws)
+        rows = simulate_simulation(years, initial_values, decisions, params, rng=rng)
+        assert rng.exhausted()
+        expected = np.array([[row[column] for column in OUTPUT_COLUMNS] for row in rows], dtype=np.float64)
+        np.testing.assert_array_equal(batched[i], expected, err_msg=f"simulation {i}")
@@ -0,0 +1,62 @@
+# test_importance_sampling.py
+#
+# 重点サンプリング（極端降水を傾けた提案分布 + 尤度比の重み）の集計に偏りがないことの確認。
+# 同じシナリオを通常のモンテカルロで多めに計算し、Flood Damage の年ごとの平均と裾の分位点（再現期間 50 年）が
+# 標準誤差から決めた許容幅に収まることを見る（seed は固定）。
+
+import numpy as np
+
+from ensemble import OUTPUT_COLUMNS, draw_noise, simulate_ensemble
+from forcing import LOG_WEIGHT_KEY, generate_forcing
+from summary import summarize_ensemble, summarize_weighted
+
+COLUMN = 'Flood Damage'
+# models.ImportanceSampling の既定値 (freq_scale, min_freq, loc_shift, mix)
+TILT = (1.0, 1.0, 3.0, 0.5)
+NUM_PLAIN = 8192
+NUM_WEIGHTED = 2048
+RETURN_PERIOD = 50
+# 許容幅（標準誤差の何倍まで。75 年分を同時に見るので広めにとる）
+Z_LIMIT = 4.5
+
+
+def run(scenario, seed, num_simulations, tilt=None):
+    years, params = scenario['years'], scenario['params']
+    forcing = generate_forcing(years, params, seed, num_simulations, tilt=tilt)
+    array = simulate_ensemble(years, scenario['initial_values'], scenario['decisions'], params, forcing,
+                              draw_noise(seed, 0, num_simulations, len(years)))
+    return array, forcing
+
+
+def test_weighted_estimates_match_plain_monte_carlo(scenario):
+    plain, _ = run(scenario, scenario['seed'], NUM_PLAIN)
+    weighted, forcing = run(scenario, scenario['seed'] + 1, NUM_WEIGHTED, TILT)
+    log_weight = forcing[LOG_WEIGHT_KEY]
+    summary = summarize_weighted(weighted, log_weight, return_periods=[RETURN_PERIOD])
+    plain_summary = summarize_ensemble(plain)
+
+    x = plain[:, :, OUTPUT_COLUMNS.index(COLUMN)]
+    y = weighted[:, :, OUTPUT_COLUMNS.index(COLUMN)]
+    w = np.exp(log_weight - log_weight.max(axis=0))
+    w = w / w.sum(axis=0)
+
+    # 平均：自己正規化した推定量の標準誤差は sqrt(Σ w² (y - 平均)²)
+    mean = np.array(summary["columns"][COLUMN]["mean"])
+    plain_mean = np.array(plain_summary["columns"][COLUMN]["mean"])
+    np.testing.assert_allclose(plain_mean, x.mean(axis=0))
+    se = np.sqrt((w ** 2 * (y - mean) ** 2).sum(axis=0) + x.var(axis=0, ddof=1) / NUM_PLAIN)
+    z = (mean - plain_mean) / se
+    assert np.abs(z).max() < Z_LIMIT, f"mean z-scores {z}"
+
+    # 裾の分位点：重み付きの return level を超える割合を通常のモンテカルロで数え、1 / 再現期間 と比べる
+    # （分位点の誤差は確率の側で見ると二項分布の標準誤差で測れる）
+    level = np.array(summary["importance"]["return_levels"][COLUMN][str(RETURN_PERIOD)])
+    p = 1 / RETURN_PERIOD
+    plain_exceed = (x > level).mean(axis=0)
+    weighted_exceed = ((y > level) * w).sum(axis=0)
+    se = np.sqrt(p * (1 - p) / NUM_PLAIN + (w ** 2 * ((y > level) - weighted_exceed) ** 2).sum(axis=0))
+    z = (plain_exceed - p) / se
+    assert np.abs(z).max() < Z_LIMIT, f"tail z-scores {z}"
+
+    # 重点サンプリングは裾を通常のモンテカルロより細かく見ている（同じ本数なら裾に落ちる本数が多い）
+    assert (y > level).sum(axis=0).mean() > 2 * p * NUM_WEIGHTED
@@ -0,0 +1,57 @@
+# test_leaderboard.py
+#
+# Leaderboard（treap の順位表）の上位 K 人・順位を、同じデータを並べ替えた結果と比べる。
+
+import random
+
+from leaderboard import Leaderboard
+
+
+def sorted_ranking(scores):
+    # 平均点の高い順、同点はユーザー名順（ScoreStore.ranking と同じ）
+    ordered = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [{"user_name": user_name, "total_score": score, "rank": i + 1} for i, (user_name, score) in enumerate(ordered)]
+
+
+def check(leaderboard, scores, rng):
+    expected = sorted_ranking(scores)
+    assert leaderboard.ranking() == expected
+    for top in (0, 1, 3, len(expected), len(expected) + 5):
+        assert leaderboard.ranking(top) == expected[:top]
+    for row in expected:
+        assert leaderboard.rank_of(row["user_name"]) == {**row, "total_users": len(expected)}
+    assert leaderboard.rank_of(f"missing{rng.random()}") is None
+
+
+def test_random_updates_match_sorted_scores():
+    rng = random.Random(0)
+    users = [f"user{i:02d}" for i in range(40)]
+    initial = {user: float(rng.choice(range(0, 100, 5))) for user in users[:10]}
+    leaderboard = Leaderboard(seed=1)
+    version = 7
+    leaderboard.rebuild([{"user_name": user, "total_score": score} for user, score in initial.items()]
+                        + [{"user_name": "no_score", "total_score": None}], version)
+    scores = dict(initial)
+    check(leaderboard, scores, rng)
+
+    for step in range(600):
+        user = rng.choice(users)
+        # 同点を多く作るため、点数は少ない候補から選ぶ（たまに消す）
+        score = None if rng.random() < 0.1 else float(rng.choice(range(0, 100, 5)))
+        version += 1
+        assert leaderboard.update(user, score, version)
+        if score is None:
+            scores.pop(user, None)
+        else:
+            scores[user] = score
+        check(leaderboard, scores, rng)
+    assert leaderboard.status() == {"users": len(scores), "version": version}
+
+
+def test_skipped_version_marks_the_table_stale():
+    leaderboard = Leaderboard()
+    leaderboard.rebuild([{"user_name": "a", "total_score": 10.0}], 3)
+    assert leaderboard.is_current(3)
+    assert not leaderboard.update("b", 20.0, 5)
+    assert not leaderboard.is_current(5)
+    assert not leaderboard.update("b", 20.0, 6)
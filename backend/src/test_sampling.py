@@ -0,0 +1,51 @@
+# test_sampling.py
+#
+# 分散低減サンプリングの確認。
+# - sobol の計画が qmc.Sobol(scramble=True) のスクランブルした Sobol 点列と同じであること
+# - antithetic / lhs / sobol が、同じ本数の random より推定量の標準誤差を小さくすること
+#   （seed を変えて繰り返したときの、アンサンブル平均のばらつきで比べる）
+
+import numpy as np
+import pytest
+from scipy.stats import qmc
+
+from ensemble import OUTPUT_COLUMNS, draw_noise, simulate_ensemble
+from forcing import generate_forcing
+from sampling import DESIGN_BLOCK, NOISE_DESIGN, SAMPLING_STREAM, _design_block
+
+NUM_SIMULATIONS = 256
+REPEATS = 16
+# 計画から作る連続な乱数で決まる列（極端降水イベントは擬似乱数のままなので Flood Damage などは除く）
+COLUMNS = ['Temperature (℃)', 'Available Water', 'Ecosystem Level', 'Municipal Demand']
+# random に対する標準誤差の比の上限
+MAX_RATIO = 0.7
+
+
+@pytest.mark.parametrize("dims", [1, 5, 600])
+@pytest.mark.parametrize("block", [0, 3])
+def test_sobol_design_is_scrambled_sobol(dims, block):
+    seed = 20240601
+    # qmc.Sobol は渡された Generator の SeedSequence から子を1つ作って使うので、子がこのブロックの系列になる親を渡す
+    parent = np.random.Generator(np.random.PCG64(
+        np.random.SeedSequence(seed, spawn_key=(SAMPLING_STREAM, NOISE_DESIGN), n_children_spawned=block)))
+    expected = qmc.Sobol(dims, scramble=True, rng=parent).random(DESIGN_BLOCK)
+    np.testing.assert_array_equal(_design_block("sobol", seed, NOISE_DESIGN, block, dims), expected)
+
+
+def ensemble_means(scenario, method, seed):
+    years, params = scenario['years'], scenario['params']
+    forcing = generate_forcing(years, params, seed, NUM_SIMULATIONS, sampling=method)
+    array = simulate_ensemble(years, scenario['initial_values'], scenario['decisions'], params, forcing,
+                              draw_noise(seed, 0, NUM_SIMULATIONS, len(years), method))
+    return [array[:, :, OUTPUT_COLUMNS.index(column)].mean() for column in COLUMNS]
+
+
+def standard_error(scenario, method):
+    means = [ensemble_means(scenario, method, scenario['seed'] + repeat) for repeat in range(REPEATS)]
+    return np.std(means, axis=0, ddof=1)
+
+
+@pytest.mark.parametrize("method", ["antithetic", "lhs", "sobol"])
+def test_variance_reduction_beats_random(scenario, method):
+    ratio = standard_error(scenario, method) / standard_error(scenario, "random")
+    assert (ratio < MAX_RATIO).all(), dict(zip(COLUMNS, ratio))
@@ -0,0 +1,88 @@
+# test_store.py
+#
+# ScoreStore に既存の block_scores.tsv / decision_log.csv（以前の pandas の to_csv が書いていた形式）を取り込み、
+# 書き出したものが同じ列・同じ行（同じ値の表現）になることの確認。
+
+import io
+
+import numpy as np
+import pandas as pd
+
+from store import ScoreStore
+
+DECISION_COLUMNS = ['year', 'planting_trees_amount', 'house_migration_amount', 'dam_levee_construction_cost',
+                    'paddy_dam_construction_cost', 'capacity_building_cost', 'transportation_invest',
+                    'agricultural_RnD_cost', 'cp_climate_params', 'user_name', 'scenario_name', 'timestamp']
+PERIODS = ['2026-2050', '2051-2075', '2076-2100']
+
+
+def write_block_scores(path):
+    # 以前の _save_results_data と同じく、aggregate_blocks の結果に user_name などを足して to_csv したもの
+    rows = []
+    for i, user_name in enumerate(["alice", "bob", "カエル"]):
+        for j, period in enumerate(PERIODS):
+            raw = {'Flood Damage': 1234.5 * (i + 1) + j, 'Crop Yield': 4100.25 - j}
+            score = {'Flood Damage': 61.5 - j, 'Crop Yield': 88.0}
+            rows.append({'period': period, 'raw': raw, 'score': score,
+                         'total_score': np.nan if (i, j) == (2, 2) else round(74.75 - j - i / 3, 4),
+                         'user_name': user_name, 'scenario_name': f"{user_name}のシナリオ",
+                         'timestamp': pd.Timestamp("2026-01-01", tz="UTC") + pd.Timedelta(minutes=3 * i + j)})
+    pd.DataFrame(rows).to_csv(path, sep='\t', index=False)
+
+
+def write_decision_log(path):
+    rows = []
+    for i, user_name in enumerate(["alice", "bob", "alice", "carol"]):
+        for year in (2026, 2051, 2076):
+            rows.append({'year': year, 'planting_trees_amount': 100.0 * i, 'house_migration_amount': 0.0,
+                         'dam_levee_construction_cost': 1.5, 'paddy_dam_construction_cost': float(i),
+                         'capacity_building_cost': 2.0, 'transportation_invest': 0.0, 'agricultural_RnD_cost': 3.25,
+                         'cp_climate_params': 4.5, 'user_name': user_name, 'scenario_name': f"シナリオ, {i}",
+                         'timestamp': pd.Timestamp("2026-01-01", tz="UTC") + pd.Timedelta(seconds=i)})
+    pd.DataFrame(rows, columns=DECISION_COLUMNS).to_csv(path, index=False)
+
+
+def read_text_frame(text, sep):
+    return pd.read_csv(io.StringIO(text), sep=sep, dtype=str, keep_default_na=False)
+
+
+def test_import_then_export_keeps_the_format(tmp_path):
+    rank_file, action_log_file = tmp_path / "block_scores.tsv", tmp_path / "decision_log.csv"
+    write_block_scores(rank_file)
+    write_decision_log(action_log_file)
+    original_scores = read_text_frame(rank_file.read_text(encoding="utf-8"), '\t')
+    original_decisions = action_log_file.read_text(encoding="utf-8").splitlines(keepends=True)
+
+    store = ScoreStore(tmp_path / "store.sqlite3", DECISION_COLUMNS)
+    assert store.import_files(rank_file, action_log_file) == {"block_scores": 9, "decisions": 12}
+    assert store.import_files(rank_file, action_log_file) is None
+
+    exported_file = tmp_path / "exported.tsv"
+    assert store.export_block_scores(exported_file)
+    exported = read_text_frame(exported_file.read_text(encoding="utf-8"), '\t')
+    assert sorted(exported.columns) == sorted(original_scores.columns)
+    pd.testing.assert_frame_equal(exported[original_scores.columns], original_scores)
+
+    # 意思決定ログはユーザーごとに、元のファイルのその人の行をそのままの順・表現で返す
+    header = original_decisions[0]
+    for user_name in ("alice", "bob", "carol"):
+        lines = [line for line in original_decisions[1:] if read_text_frame(header + line, ',')['user_name'][0] == user_name]
+        assert store.decisions_csv(user_name) == header + "".join(lines)
+    assert store.decisions_csv("nobody") == ""
+    assert store.count_decisions() == 12
+
+
+def test_export_round_trips_through_import(tmp_path):
+    rank_file = tmp_path / "block_scores.tsv"
+    write_block_scores(rank_file)
+    store = ScoreStore(tmp_path / "store.sqlite3", DECISION_COLUMNS)
+    store.import_files(rank_file, tmp_path / "missing.csv")
+    exported_file = tmp_path / "exported.tsv"
+    store.export_block_scores(exported_file)
+
+    again = ScoreStore(tmp_path / "again.sqlite3", DECISION_COLUMNS)
+    again.import_files(exported_file, tmp_path / "missing.csv")
+    again_file = tmp_path / "again.tsv"
+    again.export_block_scores(again_file)
+    assert again_file.read_bytes() == exported_file.read_bytes()
+    assert again.ranking() == store.ranking()
@@ -0,0 +1,129 @@
+# test_summary.py
+#
+# ストリーミング集計のマージ可能な集計器の確認。
+# - MomentAccumulator: 塊ごとの更新・部分集計の合併が、全体を一度に計算した平均・分散と一致する
+# - QuantileSketch: コンパクションまでは np.quantile と同じ値、それ以降も順位の誤差が docstring の範囲に収まる
+# - StreamingSummary: 塊に分けて合併した結果が summarize_ensemble と一致する
+
+import numpy as np
+import pytest
+
+from ensemble import OUTPUT_COLUMNS
+from summary import MomentAccumulator, QuantileSketch, StreamingSummary, summarize_ensemble
+
+QUANTILES = np.linspace(0.01, 0.99, 99)
+# ワーカーに渡す塊の大きさ（config.MC_STREAM_CHUNK_SIZE の既定値）
+CHUNK = 500
+
+
+def chunks(values, rng):
+    # 大きさのばらばらな塊に分ける（空の塊も混ぜる）
+    cuts = np.sort(rng.integers(0, len(values), 12))
+    return np.split(values, cuts)
+
+
+def merge_all(parts):
+    # ワーカーの部分集計を2つずつ合併していく（順番は保つ）
+    while len(parts) > 1:
+        merged = []
+        for i in range(0, len(parts), 2):
+            if i + 1 < len(parts):
+                parts[i].merge(parts[i + 1])
+            merged.append(parts[i])
+        parts = merged
+    return parts[0]
+
+
+def rank_error(values, estimates, quantiles):
+    # 分位点の推定値の、本当の順位（全体に対する割合）の区間からのずれの最大
+    n = len(values)
+    worst = 0.0
+    ordered = np.sort(values, axis=0)
+    for cell in np.ndindex(values.shape[1:]):
+        column = ordered[(slice(None),) + cell]
+        estimate = estimates[(slice(None),) + cell]
+        low = np.searchsorted(column, estimate, 'left') / n
+        high = np.searchsorted(column, estimate, 'right') / n
+        worst = max(worst, np.maximum(np.maximum(low - quantiles, quantiles - high), 0).max())
+    return worst
+
+
+def test_moment_merge_matches_single_pass():
+    rng = np.random.default_rng(0)
+    # 平均が標準偏差よりずっと大きい値（桁落ちしやすい）も混ぜる
+    values = rng.normal(size=(1237, 3, 4)) * [1, 10, 0.01, 5] + [0, 1e6, -3, 1e9]
+    sequential = MomentAccumulator(values.shape[1:])
+    parts = []
+    for chunk in chunks(values, rng):
+        sequential.update(chunk)
+        part = MomentAccumulator(values.shape[1:])
+        part.update(chunk)
+        parts.append(part)
+    merged = merge_all(parts)
+
+    for accumulator in (sequential, merged):
+        assert accumulator.count == len(values)
+        np.testing.assert_allclose(accumulator.mean, values.mean(axis=0), rtol=1e-12)
+        np.testing.assert_allclose(accumulator.std(), values.std(axis=0, ddof=1), rtol=1e-6)
+
+
+def test_sketch_is_exact_before_compaction():
+    rng = np.random.default_rng(1)
+    values = rng.normal(size=(200, 2, 3))
+    parts = []
+    for chunk in chunks(values, rng):
+        part = QuantileSketch(values.shape[1:])
+        part.update(chunk)
+        parts.append(part)
+    sketch = merge_all(parts)
+    assert sketch.count() == len(values)
+    np.testing.assert_array_equal(sketch.quantile(QUANTILES), np.quantile(values, QUANTILES, axis=0))
+
+
+DISTRIBUTIONS = {
+    'normal': lambda rng, n: rng.normal(size=(n, 2)),
+    'sorted': lambda rng, n: np.sort(rng.normal(size=(n, 2)), axis=0),
+    'ties': lambda rng, n: rng.integers(0, 10, (n, 2)).astype(np.float64),
+    'heavy_tail': lambda rng, n: rng.pareto(1.5, (n, 2)),
+}
+
+
+@pytest.mark.parametrize("distribution", sorted(DISTRIBUTIONS))
+@pytest.mark.parametrize("merged", [False, True])
+def test_sketch_rank_error_is_bounded(distribution, merged):
+    rng = np.random.default_rng(2)
+    values = DISTRIBUTIONS[distribution](rng, 20000)
+    sketch = QuantileSketch(values.shape[1:])
+    for start in range(0, len(values), CHUNK):
+        if merged:
+            part = QuantileSketch(values.shape[1:])
+            part.update(values[start:start + CHUNK])
+            sketch.merge(part)
+        else:
+            sketch.update(values[start:start + CHUNK])
+    assert sketch.count() == len(values)
+    error = rank_error(values, sketch.quantile(QUANTILES), QUANTILES)
+    assert error <= len(sketch.levels) / sketch.k
+    assert error <= 0.02
+
+
+def test_streaming_summary_matches_summarize_ensemble():
+    rng = np.random.default_rng(3)
+    array = rng.normal(size=(240, 5, len(OUTPUT_COLUMNS))) * 100
+    array[:, :, OUTPUT_COLUMNS.index('Year')] = np.arange(2026, 2031)
+    expected = summarize_ensemble(array)
+
+    parts = []
+    for start in range(0, len(array), 50):
+        part = StreamingSummary(range(2026, 2031))
+        part.update(array[start:start + 50], start)
+        parts.append(part)
+    result = merge_all(parts).result()
+
+    assert result["num_simulations"] == expected["num_simulations"]
+    assert result["years"] == expected["years"]
+    for column, stats in expected["columns"].items():
+        np.testing.assert_allclose(result["columns"][column]["mean"], stats["mean"], rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(result["columns"][column]["std"], stats["std"], rtol=1e-10)
+        # 240 本はコンパクションの前なので分位点は厳密に一致する
+        np.testing.assert_array_equal(result["columns"][column]["quantiles"], stats["quantiles"])
@@ -0,0 +1,133 @@
+# test_user_log.py
+#
+# UserLog の索引を使った読み込みを、ファイル全体を json.loads で読んで絞り込んだ結果と比べる。
+# 別のプロセスの追記・切り詰め・置き換え・改行のない最後の行・rebuild の後も一致することを確認する。
+
+import json
+import os
+import subprocess
+import sys
+
+from user_log import UserLog, parse_time
+
+USERS = ["alice", "bob", "carol"]
+TYPES = ["login", "simulate", "decision"]
+
+
+def make_logs(start, count):
+    return [{"user_name": USERS[i % 3], "type": TYPES[i % 4 % 3], "timestamp": f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}",
+             "seq": i} for i in range(start, start + count)]
+
+
+def scan(path, user_name=None, event_type=None, since=None, until=None):
+    # 索引を使わない読み込み（改行のない最後の行と JSON でない行は読み飛ばす）
+    logs = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                log = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # JSON のオブジェクトでない行も読み込みには含まれる（ユーザー・種別・時刻はないものとして扱う）
+            fields = log if isinstance(log, dict) else {}
+            time = parse_time(fields.get("timestamp"))
+            if user_name is not None and fields.get("user_name") != user_name:
+                continue
+            if event_type is not None and fields.get("type") != event_type:
+                continue
+            if since is not None and (time is None or time < since):
+                continue
+            if until is not None and (time is None or time >= until):
+                continue
+            logs.append(log)
+    return logs
+
+
+def check(log, path):
+    since, until = parse_time("2026-01-01T00:00:20"), parse_time("2026-01-01T00:01:10")
+    for filters in ({}, {"user_name": "bob"}, {"event_type": "simulate"}, {"since": since}, {"until": until},
+                    {"user_name": "alice", "event_type": "login", "since": since, "until": until}):
+        expected = scan(path, **filters)
+        assert log.query(**filters) == (expected, len(expected))
+        for offset, limit in ((0, 7), (5, 3), (len(expected) - 2, 10), (len(expected) + 1, 5)):
+            assert log.query(**filters, offset=offset, limit=limit) == (expected[offset:offset + limit], len(expected))
+    expected = scan(path)
+    # timestamp（文字列）の新しい順、同じならファイルの順（timestamp のない行は最後）
+    order = list(range(len(expected)))
+    timestamps = [entry.get("timestamp") if isinstance(entry, dict) else None for entry in expected]
+    order.sort(key=lambda i: (timestamps[i] is not None, timestamps[i] or ""), reverse=True)
+    recent = [expected[i] for i in order[:5]]
+    assert log.recent(5) == recent
+    assert log.stats()[0] == len(expected)
+
+
+def test_index_matches_scan(tmp_path):
+    path = tmp_path / "user_log.jsonl"
+    log = UserLog(path, tmp_path / "user_log.index.sqlite3")
+    assert log.query() == ([], 0)
+    assert log.append_logs(make_logs(0, 50)) == 50
+    check(log, path)
+
+
+def test_append_from_another_process(tmp_path):
+    path = tmp_path / "user_log.jsonl"
+    log = UserLog(path, tmp_path / "user_log.index.sqlite3")
+    log.append_logs(make_logs(0, 30))
+    check(log, path)
+    lines = "".join(json.dumps(entry) + "\n" for entry in make_logs(30, 40)) + "not json\n"
+    script = "import sys; open(sys.argv[1], 'a', encoding='utf-8').write(sys.stdin.read())"
+    subprocess.run([sys.executable, "-c", script, str(path)], input=lines, text=True, check=True)
+    check(log, path)
+    assert log.query()[1] == 70
+
+
+def test_partial_last_line_is_indexed_once_complete(tmp_path):
+    path = tmp_path / "user_log.jsonl"
+    log = UserLog(path, tmp_path / "user_log.index.sqlite3")
+    log.append_logs(make_logs(0, 10))
+    line = json.dumps(make_logs(10, 1)[0])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[:20])
+    check(log, path)
+    assert log.query()[1] == 10
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[20:] + "\n")
+    check(log, path)
+    assert log.query()[1] == 11
+
+
+def test_truncated_and_replaced_files_are_reindexed(tmp_path):
+    path = tmp_path / "user_log.jsonl"
+    log = UserLog(path, tmp_path / "user_log.index.sqlite3")
+    log.append_logs(make_logs(0, 40))
+    check(log, path)
+
+    # 短くなった（切り詰められた）
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in make_logs(100, 5)))
+    check(log, path)
+
+    # 同じ長さ以上の別のファイルに置き換わった
+    replacement = tmp_path / "replacement.jsonl"
+    replacement.write_text("".join(json.dumps(entry) + "\n" for entry in make_logs(200, 60)), encoding="utf-8")
+    os.replace(replacement, path)
+    check(log, path)
+
+    log.clear()
+    check(log, path)
+    assert log.query() == ([], 0)
+
+
+def test_rebuild(tmp_path):
+    path = tmp_path / "user_log.jsonl"
+    index_path = tmp_path / "user_log.index.sqlite3"
+    log = UserLog(path, index_path)
+    log.append_logs(make_logs(0, 25))
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("[1, 2]\n{broken\n")
+    assert log.rebuild() == 26
+    check(log, path)
+    # 索引のファイルを開き直しても同じ内容
+    check(UserLog(path, index_path), path)
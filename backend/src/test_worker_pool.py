@@ -0,0 +1,30 @@
+# test_worker_pool.py
+#
+# EnsemblePool.run の結果が seed・sampling と気候外力だけで決まり、プールのサイズ
+# （0 = リクエスト処理スレッド内、1、ワーカー数で割り切れない N）によらないことの確認。
+
+import numpy as np
+
+from forcing import generate_forcing
+from worker_pool import EnsemblePool
+
+POOL_SIZES = (0, 1, 3)
+
+
+def run_with_pool(size, scenario, forcing):
+    pool = EnsemblePool(size)
+    pool.start()
+    try:
+        with pool.run(scenario['years'], scenario['initial_values'], scenario['decisions'], scenario['params'],
+                      scenario['num_simulations'], scenario['seed'], forcing) as result:
+            return np.array(result.array)
+    finally:
+        pool.shutdown()
+
+
+def test_same_seed_gives_same_ensemble_for_any_pool_size(scenario):
+    forcing = generate_forcing(scenario['years'], scenario['params'], scenario['seed'], scenario['num_simulations'])
+    results = [run_with_pool(size, scenario, forcing) for size in POOL_SIZES]
+
+    for size, array in zip(POOL_SIZES[1:], results[1:]):
+        np.testing.assert_array_equal(array, results[0], err_msg=f"pool size {size}")
@@ -0,0 +1,286 @@
+# user_log.py
+#
+# 操作ログ（user_log.jsonl）と、その行のバイト位置の索引（SQLite のサイドカーファイル）。
+# ユーザー1人分のログを読むのに、ファイル全体を json.loads する代わりに、索引で該当する行の位置を引いて
+# その行だけを seek して読む（ページ分割・時間範囲・イベント種別での絞り込みも索引の上で行う）。
+#
+# - 書き込み（append / clear）はこのクラスを通す。追記した後、同じロックの下で新しく書いた部分だけを索引に足す
+# - 索引は「ログの先頭から何バイト目までを索引にしたか」を持つ。ファイルがそれより長ければ（別のプロセスの追記など）
+#   読み込みの前に残りを索引に足し、短い・別のファイルに置き換わっていれば作り直す（rebuild で明示的にも作り直せる）
+# - JSON として読めない行は索引に入れない（従来の読み込みも読み飛ばしていた）
+#
+# timestamp は文字列のまま（ダッシュボードの並べ替えは従来どおり文字列順）と、時間範囲の絞り込み用の UNIX 秒の両方を持つ。
+
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+# 索引（最初から作るときは行を入れ終わってから作る方が速い）
+INDEXES = """
+CREATE INDEX IF NOT EXISTS entries_user_time ON entries (user_name, time);
+CREATE INDEX IF NOT EXISTS entries_user_type ON entries (user_name, type);
+CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp);
+"""
+DROP_INDEXES = """
+DROP INDEX IF EXISTS entries_user_time;
+DROP INDEX IF EXISTS entries_user_type;
+DROP INDEX IF EXISTS entries_timestamp;
+"""
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    offset INTEGER PRIMARY KEY,
+    length INTEGER NOT NULL,
+    user_name TEXT,
+    type TEXT,
+    timestamp TEXT,
+    time REAL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+""" + INDEXES
+# 一度に索引に足す行数
+INDEX_BATCH_LINES = 10000
+
+
+def parse_time(value):
+    """ISO 8601 の文字列を UNIX 秒にする（タイムゾーンのないものは UTC とみなす）。読めなければ None"""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _entry(offset, line):
+    # 1行の索引の行（JSON でなければ None）
+    try:
+        log = json.loads(line.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    if not isinstance(log, dict):
+        return offset, len(line), None, None, None, None
+    user_name, event_type, timestamp = (log.get(key) for key in ('user_name', 'type', 'timestamp'))
+    return (offset, len(line), user_name if isinstance(user_name, str) else None,
+            event_type if isinstance(event_type, str) else None,
+            timestamp if isinstance(timestamp, str) else None, parse_time(timestamp))
+
+
+class UserLog:
+    """user_log.jsonl への追記と、索引を使った読み込み"""
+
+    def __init__(self, path, index_path):
+        self._path = Path(path)
+        self._index_path = Path(index_path)
+        # ログへの追記・切り詰め・行の読み込みと索引の更新はこのロックの下で行う
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn.executescript(SCHEMA)
+
+    @property
+    def _conn(self):
+        # スレッドごとの自動コミットの接続
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._index_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @property
+    def path(self):
+        return self._path
+
+    # --- 書き込み ---
+
+    def append(self, lines):
+        """行（JSON の文字列）を追記して索引に足す。追記した行数を返す"""
+        text = "".join(line + "\n" for line in lines)
+        if not text:
+            return 0
+        with self._lock:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(text)
+            self._catch_up()
+        return len(lines)
+
+    def append_logs(self, logs):
+        """dict のログを JSON にして追記する"""
+        return self.append([json.dumps(log, ensure_ascii=False) for log in logs])
+
+    def clear(self):
+        """ログを空にして索引も消す"""
+        with self._lock:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            open(self._path, "w", encoding="utf-8").close()
+            self._reset()
+
+    def rebuild(self):
+        """索引をログの先頭から作り直す。索引にした行数を返す"""
+        with self._lock:
+            self._reset()
+            self._catch_up()
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # --- 索引の維持 ---
+
+    def _meta(self):
+        rows = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        return int(rows.get("indexed_size", 0)), rows.get("file_id")
+
+    def _file_id(self, stat):
+        return f"{stat.st_dev}:{stat.st_ino}"
+
+    def _reset(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _catch_up(self):
+        # 索引にしていないログの末尾を索引に足す（self._lock の下で呼ぶ）
+        try:
+            stat = self._path.stat()
+        except FileNotFoundError:
+            if self._meta()[0]:
+                self._reset()
+            return
+        indexed_size, file_id = self._meta()
+        if stat.st_size < indexed_size or (file_id is not None and file_id != self._file_id(stat)):
+            # 切り詰められたか、別のファイルに置き換わった
+            self._reset()
+            indexed_size = 0
+        if stat.st_size == indexed_size:
+            return
+        if indexed_size == 0:
+            self._conn.executescript(DROP_INDEXES)
+        try:
+            self._index_tail(stat, indexed_size)
+        finally:
+            if indexed_size == 0:
+                self._conn.executescript(INDEXES)
+
+    def _index_tail(self, stat, indexed_size):
+        with open(self._path, "rb") as f:
+            f.seek(indexed_size)
+            offset = indexed_size
+            done = False
+            while not done:
+                entries = []
+                for _ in range(INDEX_BATCH_LINES):
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        # 書きかけの行（改行がまだない）は次の機会に索引にする
+                        done = True
+                        break
+                    entry = _entry(offset, line)
+                    if entry is not None:
+                        entries.append(entry)
+                    offset += len(line)
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", entries)
+                    self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                           [("indexed_size", str(offset)), ("file_id", self._file_id(stat))])
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+
+    # --- 読み込み ---
+
+    @staticmethod
+    def _filters(user_name=None, event_type=None, since=None, until=None):
+        clauses, args = [], []
+        for column, value in (("user_name", user_name), ("type", event_type)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if since is not None:
+            clauses.append("time >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("time < ?")
+            args.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def _read(self, positions):
+        # (offset, length) の行を読んで dict にする（offset の昇順に読む。self._lock の下で呼ぶ）
+        if not positions:
+            # まだ一度も書いていない（ファイルがない）場合もここに来る
+            return []
+        logs = {}
+        with open(self._path, "rb") as f:
+            for offset, length in sorted(positions):
+                f.seek(offset)
+                logs[offset] = json.loads(f.read(length))
+        return [logs[offset] for offset, _ in positions]
+
+    def query(self, user_name=None, event_type=None, since=None, until=None, offset=0, limit=None):
+        """条件に合うログ（ファイルの順）の offset 件目から limit 件と、条件に合う件数
+
+        since / until は UNIX 秒（since 以上 until 未満。timestamp のないログは時間の条件があると含まれない）。
+        """
+        where, args = self._filters(user_name, event_type, since, until)
+        with self._lock:
+            self._catch_up()
+            total = self._conn.execute(f"SELECT COUNT(*) FROM entries{where}", args).fetchone()[0]
+            positions = self._conn.execute(
+                f"SELECT offset, length FROM entries{where} ORDER BY offset LIMIT ? OFFSET ?",
+                args + [-1 if limit is None else int(limit), int(offset)]
+            ).fetchall()
+            return self._read(positions), total
+
+    def recent(self, count):
+        """timestamp（文字列）の新しい順に count 件（ダッシュボードの「最近の操作」）"""
+        with self._lock:
+            self._catch_up()
+            positions = self._conn.execute(
+                "SELECT offset, length FROM entries ORDER BY timestamp DESC, offset LIMIT ?", (int(count),)
+            ).fetchall()
+            return self._read(positions)
+
+    def event_counts(self, user_name):
+        """そのユーザーのイベント種別ごとの件数"""
+        with self._lock:
+            self._catch_up()
+        rows = self._conn.execute(
+            "SELECT type, COUNT(*) FROM entries WHERE user_name = ? GROUP BY type ORDER BY type", (user_name,)
+        ).fetchall()
+        return {event_type: count for event_type, count in rows}
+
+    def stats(self):
+        """(件数, ユーザー名のリスト, 最も古い timestamp, 最も新しい timestamp)。timestamp は文字列の順"""
+        with self._lock:
+            self._catch_up()
+        count, earliest, latest = self._conn.execute(
+            "SELECT COUNT(*), MIN(NULLIF(timestamp, '')), MAX(NULLIF(timestamp, '')) FROM entries"
+        ).fetchone()
+        users = [row[0] for row in self._conn.execute(
+            "SELECT DISTINCT user_name FROM entries WHERE user_name IS NOT NULL ORDER BY user_name"
+        )]
+        return count, users, earliest, latest
+
+    def status(self):
+        with self._lock:
+            indexed_size, _ = self._meta()
+        return {
+            "path": str(self._path),
+            "size": self._path.stat().st_size if self._path.exists() else 0,
+            "indexed_size": indexed_size,
+            "index_path": str(self._index_path),
+        }
@@ -0,0 +1,362 @@
+# worker_pool.py
+#
+# モンテカルロモード用の常駐ワーカープール。
+# アプリ起動時に一度だけプロセスを立ち上げ、同時に来たリクエスト間で温まったワーカーを共有する。
+# ワーカーに渡す関数はすべてモジュールレベルに置き、pickle できるようにしている。
+#
+# 結果は親プロセスが確保した共有メモリ上の (sims × years × outputs) 配列に各ワーカーが直接書き込み、
+# 親はその配列をコピーせずに DataFrame として参照する。
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from ensemble import OUTPUT_COLUMNS, draw_noise, simulate_ensemble, ensemble_to_frame, planting_snapshots
+from forcing import generate_forcing, slice_forcing
+from summary import StreamingSummary
+
+
+def _warmup():
+    # 1つのワーカーが全部の warmup を取らないよう、少しだけ占有する
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def run_ensemble_chunk(shm_name, shape, sim_start, sim_stop, years, initial_values, decision_vars_list, params, seed, forcing,
+                       sampling="random"):
+    """ワーカー側で [sim_start, sim_stop) のシミュレーションを計算し、共有メモリ上の配列に直接書き込む
+
+    forcing はこの範囲の分だけを切り出した気候外力。
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        buffer = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        simulate_ensemble(years, initial_values, decision_vars_list, params, forcing,
+                          draw_noise(seed, sim_start, sim_stop, len(years), sampling), out=buffer[sim_start:sim_stop])
+        del buffer
+    finally:
+        shm.close()
+    return sim_stop - sim_start
+
+
+def summarize_ensemble_chunk(sim_start, sim_stop, years, initial_values, decision_vars_list, params, seed, quantiles,
+                             sampling="random"):
+    """ワーカー側で [sim_start, sim_stop) を計算し、その塊の部分集計（StreamingSummary）だけを返す
+
+    気候外力もこの範囲の分だけをその場で生成するので、塊の大きさぶんのメモリしか使わない。
+    """
+    forcing = generate_forcing(years, params, seed, sim_stop - sim_start, sim_start, sampling)
+    array = simulate_ensemble(years, initial_values, decision_vars_list, params, forcing,
+                              draw_noise(seed, sim_start, sim_stop, len(years), sampling))
+    summary = StreamingSummary(years, quantiles, sampling=sampling)
+    summary.update(array, sim_start)
+    return summary
+
+
+def split_batches(num_simulations, num_batches):
+    """[0, num_simulations) を連続した (offset, size) の塊に分ける"""
+    num_batches = max(1, min(num_batches, num_simulations))
+    base, extra = divmod(num_simulations, num_batches)
+    batches = []
+    offset = 0
+    for i in range(num_batches):
+        size = base + (1 if i < extra else 0)
+        batches.append((offset, size))
+        offset += size
+    return batches
+
+
+# ストリーミング集計の最初の塊の大きさ（最初の途中結果を早く返すため）
+FIRST_CHUNK_SIZE = 50
+
+
+def _chunk_plan(num_simulations, chunk_size):
+    """[0, num_simulations) を、最初だけ FIRST_CHUNK_SIZE 本、以降は chunk_size 本ずつの [start, stop) に分ける"""
+    chunk_size = max(1, int(chunk_size))
+    chunks = []
+    start = 0
+    size = min(chunk_size, FIRST_CHUNK_SIZE)
+    while start < num_simulations:
+        stop = min(start + size, num_simulations)
+        chunks.append((start, stop))
+        start = stop
+        size = chunk_size
+    return chunks
+
+
+class EnsembleResult:
+    """アンサンブルの出力配列 (sims × years × outputs) と、それを保持する共有メモリ"""
+
+    def __init__(self, array, planting_history, shm=None):
+        self.array = array
+        self.planting_history = planting_history
+        self._shm = shm
+
+    def to_frame(self):
+        # 数値列は共有メモリ上の配列をそのまま参照する。close() の前に DataFrame を手放すこと
+        return ensemble_to_frame(self.array, self.planting_history)
+
+    def close(self):
+        self.array = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # まだ参照している DataFrame がある場合は GC 時に解放される（名前は unlink 済み）
+                pass
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EnsemblePool:
+    """ProcessPoolExecutor をアプリの寿命に合わせて保持し、サイズ変更と状態確認を提供する"""
+
+    def __init__(self, size):
+        self._size = max(0, int(size))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._worker_pids = []
+        self._active_requests = 0
+        self._completed_requests = 0
+        self._completed_batches = 0
+
+    def start(self):
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._size == 0:
+            self._executor = None
+            self._worker_pids = []
+        else:
+            # 共有メモリの後始末を親と同じ resource tracker に任せるため、ワーカー起動前に立ち上げておく
+            resource_tracker.ensure_running()
+            self._executor = ProcessPoolExecutor(max_workers=self._size)
+            # ワーカーを先に起動し、import を済ませておく
+            warmups = [self._executor.submit(_warmup) for _ in range(self._size)]
+            self._worker_pids = sorted({f.result() for f in warmups})
+        self._started_at = time.time()
+
+    def _rebuild_locked(self, broken):
+        # 壊れたプールを作り直す（self._lock の下で呼ぶ）。他のスレッドが作り直し済みなら何もしない
+        if self._executor is not broken:
+            return
+        print("⚠️ [Worker Pool] 进程池已损坏，正在重建")
+        # 壊れたプールの管理スレッドとキューを残さないよう、先に止めておく
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._start_locked()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._worker_pids = []
+
+    def resize(self, size):
+        """新しいサイズでプールを作り直す。実行中のタスクは古いプールで最後まで処理される"""
+        with self._lock:
+            old = self._executor
+            self._size = max(0, int(size))
+            self._start_locked()
+        if old is not None:
+            old.shutdown(wait=False)
+        return self.status()
+
+    def status(self):
+        return {
+            "size": self._size,
+            "running": self._executor is not None,
+            "worker_pids": list(self._worker_pids),
+            "started_at": self._started_at,
+            "active_requests": self._active_requests,
+            "completed_requests": self._completed_requests,
+            "completed_batches": self._completed_batches,
+        }
+
+    def run(self, years, initial_values, decision_vars_list, params, num_simulations, seed, forcing,
+            include_planting_history=False, sampling="random"):
+        """アンサンブルをワーカー数ぶんの連続した塊に分けて計算し、EnsembleResult を返す
+
+        forcing は num_simulations 本分の気候外力（同じ sampling で生成したもの）。
+        結果は seed・sampling と forcing だけで決まり、プールのサイズにはよらない。
+        include_planting_history のときだけ、各行に載せる planting_history を作る。
+        """
+        with self._lock:
+            executor = self._executor
+            self._active_requests += 1
+        num_batches = 0
+        try:
+            if executor is None:
+                array = simulate_ensemble(years, initial_values, decision_vars_list, params, forcing,
+                                          draw_noise(seed, 0, num_simulations, len(years), sampling))
+                result = EnsembleResult(array, None)
+                num_batches = 1
+            else:
+                batches = split_batches(num_simulations, self._size)
+                shape = (num_simulations, len(years), len(OUTPUT_COLUMNS))
+                result = self._run_shared(executor, shape, batches, years, initial_values, decision_vars_list, params, seed,
+                                          forcing, sampling)
+                num_batches = len(batches)
+            if include_planting_history:
+                result.planting_history = planting_snapshots(years, initial_values, decision_vars_list, params)
+        finally:
+            with self._lock:
+                self._active_requests -= 1
+                if num_batches:
+                    self._completed_batches += num_batches
+                    self._completed_requests += 1
+        return result
+
+    def run_summary(self, years, initial_values, decision_vars_list, params, num_simulations, seed, quantiles, chunk_size,
+                    sampling="random"):
+        """全行を持たずに集計だけを返す（ストリーミング集計）。iter_summary を最後まで回した結果"""
+        summary = StreamingSummary(years, quantiles, sampling=sampling)
+        for summary, _ in self.iter_summary(years, initial_values, decision_vars_list, params, num_simulations,
+                                            seed, quantiles, chunk_size, sampling=sampling):
+            pass
+        return summary
+
+    def iter_summary(self, years, initial_values, decision_vars_list, params, num_simulations, seed, quantiles,
+                     chunk_size, cancel=None, sampling="random"):
+        """塊ごとの部分集計を投入順に合併し、塊が終わるたびに (途中までの StreamingSummary, 完了したシミュレーション数) を返す
+
+        最初の塊だけ小さくして、最初の途中結果を早く返す。同時に処理中の塊はワーカー数の2倍までなので、
+        ピークメモリはアンサンブルの大きさによらない。結果は seed と chunk_size だけで決まり、プールのサイズにはよらない。
+        cancel（threading.Event）がセットされるか、ジェネレータが閉じられたら、新しい塊は投入しない。
+        """
+        with self._lock:
+            executor = self._executor
+            self._active_requests += 1
+        chunks = _chunk_plan(num_simulations, chunk_size)
+        task_args = (years, initial_values, decision_vars_list, params, seed, quantiles, sampling)
+        summary = StreamingSummary(years, quantiles, sampling=sampling)
+        merged = 0
+        retried = False
+        try:
+            while merged < len(chunks) and not (cancel is not None and cancel.is_set()):
+                try:
+                    for partial in self._iter_partials(executor, chunks[merged:], task_args, cancel):
+                        summary.merge(partial)
+                        merged += 1
+                        yield summary, chunks[merged - 1][1]
+                except BrokenProcessPool:
+                    # ワーカーが落ちた場合は、プールを作り直して未合併の塊から一度だけやり直す
+                    if retried:
+                        raise
+                    retried = True
+                    with self._lock:
+                        self._rebuild_locked(executor)
+                        executor = self._executor
+        finally:
+            with self._lock:
+                self._active_requests -= 1
+                self._completed_batches += merged
+                self._completed_requests += 1
+
+    def _iter_partials(self, executor, chunks, task_args, cancel):
+        def cancelled():
+            return cancel is not None and cancel.is_set()
+
+        if executor is None:
+            for start, stop in chunks:
+                if cancelled():
+                    return
+                yield summarize_ensemble_chunk(start, stop, *task_args)
+            return
+        window = max(1, 2 * self._size)
+        pending = deque()
+        try:
+            for start, stop in chunks:
+                if cancelled():
+                    return
+                futures, executor = self._submit(executor, [(start, stop) + task_args], summarize_ensemble_chunk)
+                pending.extend(futures)
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                if cancelled():
+                    return
+                yield pending.popleft().result()
+        finally:
+            # まだ始まっていない塊は取り消す（実行中の塊は最後まで計算されて捨てられる）
+            for future in pending:
+                future.cancel()
+
+    def _run_shared(self, executor, shape, batches, years, initial_values, decision_vars_list, params, seed, forcing, sampling):
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        try:
+            self._run_batches(executor, shm.name, shape, batches, years, initial_values, decision_vars_list, params, seed,
+                              forcing, sampling)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        # ワーカーの書き込みは完了したので名前は不要。マッピングは close() まで残る
+        shm.unlink()
+        array = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        return EnsembleResult(array, None, shm)
+
+    def _run_batches(self, executor, shm_name, shape, batches, years, initial_values, decision_vars_list, params, seed,
+                     forcing, sampling):
+        tasks = [(shm_name, shape, offset, offset + size, years, initial_values, decision_vars_list, params, seed,
+                  slice_forcing(forcing, offset, offset + size), sampling)
+                 for offset, size in batches]
+        return self._gather(executor, tasks, run_ensemble_chunk)
+
+    def map(self, fn, tasks):
+        """tasks（引数のタプルのリスト）をワーカーで fn に渡して並列に計算し、結果を tasks の順に返す
+
+        fn はモジュールレベルの関数（pickle できること）。感度分析・最適化で変種の塊を評価するのに使う。
+        """
+        with self._lock:
+            executor = self._executor
+            self._active_requests += 1
+        try:
+            if executor is None:
+                return [fn(*task) for task in tasks]
+            return self._gather(executor, tasks, fn)
+        finally:
+            with self._lock:
+                self._active_requests -= 1
+                self._completed_batches += len(tasks)
+                self._completed_requests += 1
+
+    def _gather(self, executor, tasks, fn):
+        for attempt in range(2):
+            try:
+                futures, _ = self._submit(executor, tasks, fn)
+                return [f.result() for f in futures]
+            except BrokenProcessPool:
+                # ワーカーが落ちた場合は、プールを作り直して一度だけやり直す
+                if attempt == 1:
+                    raise
+                with self._lock:
+                    self._rebuild_locked(executor)
+                    executor = self._executor
+                if executor is None:
+                    return [fn(*task) for task in tasks]
+
+    def _submit(self, executor, tasks, fn=run_ensemble_chunk):
+        """tasks を投入し、(futures, 実際に投入したプール) を返す"""
+        try:
+            return [executor.submit(fn, *task) for task in tasks], executor
+        except RuntimeError:
+            # resize 直後に古いプールへ投入しようとした場合は、現在のプールに投入し直す
+            with self._lock:
+                executor = self._executor
+            if executor is None:
+                raise BrokenProcessPool("worker pool has been shut down")
+            return [executor.submit(fn, *task) for task in tasks], executor
@@ -0,0 +1,61 @@
+"""
+Offline surrogate training
+
+予測モード用の代理モデル（src/surrogate.py）をサーバーを起動せずに学習し、data/surrogate.npz に保存する。
+学習に使っていないデータでの精度を表示する（--report で JSON にも書き出す）。
+    python train_surrogate.py --workers 4 --report surrogate_report.json
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from config import DEFAULT_PARAMS, PARAMETER_ZONES_FILE, SURROGATE_FILE, rcp_climate_params
+from optimizer import load_lever_levels
+from surrogate import TRAINING_REPLICATES, TRAINING_STATES, SurrogateStore, surrogate_fingerprint, train_surrogates
+from worker_pool import EnsemblePool
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the Predict mode surrogate models")
+    parser.add_argument("--output", "-o", default=str(SURROGATE_FILE), help="model file (default: data/surrogate.npz)")
+    parser.add_argument("--report", help="write the accuracy report to this JSON file")
+    parser.add_argument("--rcp", type=float, action="append", help="train only these RCP scenarios (repeatable)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--states", type=int, default=TRAINING_STATES,
+                        help="sampled states per (RCP, decision year)")
+    parser.add_argument("--replicates", type=int, default=TRAINING_REPLICATES)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (0 computes in this process)")
+    args = parser.parse_args()
+
+    rcp_params = rcp_climate_params
+    if args.rcp:
+        rcp_params = {rcp: rcp_climate_params[rcp] for rcp in args.rcp}
+
+    def progress(rcp, decision_year, model):
+        blocks = ", ".join(f"{label} R²={accuracy['r2']:.3f}" for label, accuracy in model.report["block_scores"].items())
+        print(f"🧠 [Surrogate] RCP {rcp} / {decision_year} 年: {blocks}（{model.report['training_seconds']:.1f} 秒）")
+
+    pool = EnsemblePool(args.workers)
+    pool.start()
+    try:
+        models = train_surrogates(pool, DEFAULT_PARAMS, rcp_params, load_lever_levels(PARAMETER_ZONES_FILE),
+                                  seed=args.seed, num_states=args.states, replicates=args.replicates,
+                                  progress=progress)
+    finally:
+        pool.shutdown()
+
+    # サーバーは全 RCP の fingerprint と照合するので、一部の RCP だけのモデルは起動時に作り直される
+    store = SurrogateStore(args.output)
+    store.save(models, surrogate_fingerprint(DEFAULT_PARAMS, rcp_params))
+    print(f"✅ [Surrogate] 代理模型已保存: {args.output}")
+    if args.report:
+        Path(args.report).write_text(json.dumps(store.report(), ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()